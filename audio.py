@@ -0,0 +1,79 @@
+# This module contains the audio backends. The CHIP-8 has a single tone that
+# sounds while the sound timer is running, so a looping square wave is
+# synthesized once and only started and stopped on the edges of the timer,
+# instead of being restarted on every 60 Hz tick.
+
+import array
+
+# Length of the synthesized buffer in seconds. The buffer holds a whole
+# number of periods so it loops without clicks
+TONE_SECONDS = 0.1
+
+# Returns the samples of a looping square wave as signed 16-bit values,
+# repeated for every channel
+def square_wave(frequency, volume, sample_rate, channels=1):
+    period = max(2, round(sample_rate / frequency))
+    periods = max(1, round(TONE_SECONDS * sample_rate / period))
+    amplitude = int(32767 * max(0.0, min(1.0, volume)))
+    samples = array.array("h")
+    for i in range(period * periods):
+        sample = amplitude if i % period < period // 2 else -amplitude
+        samples.extend([sample] * channels)
+    return samples
+
+# Keeps track of the tone without producing any sound, for headless runs.
+# Other backends extend it with start() and stop()
+class NullAudio:
+    def __init__(self):
+        self.playing = False
+
+        # Counters
+        self.starts = 0
+        self.ticks = 0
+
+    # Called by CHIP8.timers_tick on every 60 Hz tick with the sound timer
+    # state. Only changes of the state start or stop the tone
+    def update(self, playing):
+        if playing:
+            self.ticks += 1
+        if playing != self.playing:
+            self.playing = playing
+            if playing:
+                self.starts += 1
+                self.start()
+            else:
+                self.stop()
+
+    # Start the tone
+    def start(self):
+        pass
+
+    # Stop the tone
+    def stop(self):
+        pass
+
+    # Audio counters
+    def stats(self):
+        return {
+            "tone_starts": self.starts,
+            "tone_ticks": self.ticks
+        }
+
+# Plays the tone through the PyGame mixer, which must be initialized.
+# PyGame is only imported here so headless runs don't depend on it
+class PygameAudio(NullAudio):
+    def __init__(self, frequency=440, volume=0.25):
+        super().__init__()
+        import pygame
+
+        sample_rate, size, channels = pygame.mixer.get_init()
+        samples = square_wave(frequency, volume, sample_rate, channels)
+        self.sound = pygame.mixer.Sound(buffer=samples.tobytes())
+
+    # Loop the tone until stopped
+    def start(self):
+        self.sound.play(loops=-1)
+
+    # Stop the tone
+    def stop(self):
+        self.sound.stop()
@@ -0,0 +1,110 @@
+# This file contains the batch runner. It runs many ROMs, or many seeds of
+# the same ROM, headless on a pool of worker processes for a fixed cycle
+# budget and gathers the throughput, framebuffer hashes and crashes of every
+# run into a single JSON report.
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import engines
+import headless
+
+# Run a single (file, seed) job. Top level function so the worker processes
+# can import it. The final save state is dropped to keep the report small
+def job_run(job):
+    result = headless.run(job["file"], job["cycles"], job["cycles_per_frame"],
+                          job["engine"], job["shift_VY"], job["seed"],
+                          job["state"], job["cache_directory"])
+    del result["state"]
+    return result
+
+# Returns the list of jobs running every file with seeds seed to
+# seed + seeds - 1. When state is given every job resumes from it
+def jobs_create(files, seeds, seed, cycles, cycles_per_frame, engine,
+                shift_VY, state=None, cache_directory=None):
+    return [{"file": file, "seed": seed + i, "cycles": cycles,
+             "cycles_per_frame": cycles_per_frame, "engine": engine,
+             "shift_VY": shift_VY, "state": state,
+             "cache_directory": cache_directory}
+            for file in files for i in range(seeds)]
+
+# Run every job on a pool of processes and return the report dictionary.
+# Results are listed in the order of jobs no matter which worker finished
+# first, so reports of the same batch can be diffed
+def batch_run(jobs, processes=None):
+    start_time = time.perf_counter()
+    if processes == 1:
+        results = [job_run(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(job_run, jobs))
+    elapsed = time.perf_counter() - start_time
+
+    cycles = sum(result["cycles"] for result in results)
+    return {
+        "processes": processes or os.cpu_count(),
+        "runs": len(results),
+        "crashes": sum(result["crash"] is not None for result in results),
+        "cycles": cycles,
+        "seconds": elapsed,
+        "ips": cycles / elapsed if elapsed > 0 else 0.0,
+        "results": results
+    }
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run CHIP-8 ROMs headless in parallel")
+    parser.add_argument("files", nargs="*",
+                        help="ROM names inside the roms directory, all by default")
+    parser.add_argument("--cycles", type=int, default=600000,
+                        help="instructions executed per run")
+    parser.add_argument("--cycles-per-frame", type=int, default=10,
+                        help="instructions executed per 60 Hz frame")
+    parser.add_argument("--seeds", type=int, default=1,
+                        help="runs per ROM, each one with its own seed")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the first run of every ROM")
+    parser.add_argument("--engine", default="table",
+                        choices=sorted(engines.engines))
+    parser.add_argument("--shift-vy", action="store_true",
+                        help="shift VY instead of VX in 8XY6 and 8XYE")
+    parser.add_argument("--load-state", default=None,
+                        help="save state every run resumes from, reseeded "
+                             "with the run's seed")
+    parser.add_argument("--cache", default=None,
+                        help="directory of the block engine's program cache")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes, one per core by default")
+    parser.add_argument("--output", default=None,
+                        help="JSON report file, printed to stdout by default")
+    args = parser.parse_args()
+
+    files = args.files or sorted(os.listdir("roms"))
+    for file in files:
+        if not os.path.isfile(os.path.join("roms", file)):
+            print("WRONG FILE NAME:", file)
+            sys.exit(1)
+
+    state = None
+    if args.load_state is not None:
+        with open(args.load_state, "rb") as f:
+            state = f.read()
+
+    jobs = jobs_create(files, args.seeds, args.seed, args.cycles,
+                       args.cycles_per_frame, args.engine, int(args.shift_vy),
+                       state, args.cache)
+    report = batch_run(jobs, args.processes)
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("RUNS:", report["runs"], "CRASHES:", report["crashes"],
+              "SECONDS:", format(report["seconds"], ".3f"),
+              "IPS:", format(report["ips"], ".0f"))
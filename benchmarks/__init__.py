@@ -0,0 +1,2 @@
+# This package contains the benchmarks. Run them from the repository root
+# with python -m benchmarks.<module>
@@ -0,0 +1,86 @@
+# This benchmark compares the packed framebuffer against the original one
+# byte per pixel list, where DXYN wrote the sprite bit by bit, on the
+# sprite heavy ROMs.
+
+import argparse
+import time
+
+import computer
+import engines
+
+# Sprite heavy ROMs used by default
+ROMS = ["BLINKY", "BRIX", "INVADERS", "PONG", "TANK", "UFO", "VBRIX"]
+
+# CHIP8 with the original 2048 entries video memory list
+class ListFramebufferCHIP8(computer.CHIP8):
+    def __init__(self, seed=None):
+        super().__init__(seed=seed)
+        self.video_memory = [0] * (64 * 32)
+
+    # Writes a bit to the video memory
+    def video_memory_write(self, x, y, system_memory_bit):
+        if x < 64 and y < 32:
+            # row major calculation for video memory offset
+            video_offset = x + (y * 64)
+            # Set the sprite collision detection flag
+            if (self.video_memory[video_offset] & int(system_memory_bit)) == 1:
+                self.register_V[0xF] = 1
+            # video memory writes are XORed in CHIP8
+            self.video_memory[video_offset] ^= int(system_memory_bit)
+
+    # Writes a sprite to the video memory one bit at a time
+    def dxyn(self, x, y, n):
+        # Reset collision detection flag
+        self.register_V[0xF] = 0
+
+        for i in range(n):
+            system_memory_byte = int(self.system_memory[self.register_I+i])
+            for j in range(8):
+                self.video_memory_write(x+j, y+i, (system_memory_byte >> 7-j) & 0x01)
+            if system_memory_byte and x < 64 and y+i < 32:
+                self.video_dirty_rows |= 1 << (y+i)
+        self.video_draw_flag = 1
+
+    def video_clear(self):
+        self.video_memory = [0] * (64 * 32)
+        self.video_draw_flag = 1
+        self.video_dirty_rows = computer.VIDEO_ROWS_ALL
+
+    def video_pixels(self):
+        return bytes(self.video_memory)
+
+# Run file on a machine of class machine for the given frames and returns
+# the elapsed seconds and the final pixels
+def rom_run(machine, file, frames, cycles_per_frame, engine):
+    chip8 = machine(seed=0)
+    chip8.file_open(file)
+    cpu = engines.engine_create(engine, chip8)
+    start_time = time.perf_counter()
+    for _ in range(frames):
+        cpu.run(cycles_per_frame)
+        chip8.timers_tick()
+    return time.perf_counter() - start_time, chip8.video_pixels()
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the packed and list framebuffers")
+    parser.add_argument("files", nargs="*", default=ROMS)
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--cycles-per-frame", type=int, default=10)
+    parser.add_argument("--engine", default="table",
+                        choices=sorted(engines.engines))
+    args = parser.parse_args()
+
+    cycles = args.frames * args.cycles_per_frame
+    print(format("FILE", "10"), format("LIST IPS", ">10"),
+          format("PACKED IPS", ">10"), format("SPEEDUP", ">8"), "SAME")
+    for file in args.files:
+        list_seconds, list_pixels = rom_run(ListFramebufferCHIP8, file,
+            args.frames, args.cycles_per_frame, args.engine)
+        packed_seconds, packed_pixels = rom_run(computer.CHIP8, file,
+            args.frames, args.cycles_per_frame, args.engine)
+        print(format(file, "10"), format(cycles / list_seconds, ">10.0f"),
+              format(cycles / packed_seconds, ">10.0f"),
+              format(list_seconds / packed_seconds, ">7.2f") + "x",
+              list_pixels == packed_pixels)
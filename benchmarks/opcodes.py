@@ -0,0 +1,82 @@
+# This benchmark runs a small program per opcode group, the group's
+# instructions followed by a jump back to the start, and reports the
+# instructions per second every engine executes it at.
+
+import argparse
+
+import computer
+import engines
+
+from benchmarks import timing
+
+# Instructions of every group. Registers are loaded at the start of the body
+# so every iteration does the same work, and the skips that are taken jump
+# over a 6F00 filler. The "flow" group calls the 00EE at SUBROUTINE and the
+# memory instructions use the free memory at 0x800
+GROUPS = {
+    "load": [0x6012, 0x6134, 0x7001, 0x7102, 0xA800, 0x6256, 0x7203, 0x6300],
+    "alu": [0x6005, 0x6103, 0x8010, 0x8011, 0x8012, 0x8013, 0x8014, 0x8015,
+            0x8016, 0x8017, 0x801E, 0x8104],
+    "skip": [0x6005, 0x6105, 0x3006, 0x4005, 0x5010, 0x6F00, 0x9010, 0x3005,
+             0x6F00, 0x4006, 0x6F00],
+    "flow": [0x2300, 0x2300, 0x2300, 0x2300],
+    "memory": [0xA800, 0x60FE, 0xF033, 0xF155, 0xF165, 0xF01E, 0xF029, 0xF065],
+    "timers": [0x6030, 0xF015, 0xF007, 0xF118, 0xF107],
+    "keys": [0x6005, 0xE09E, 0xE0A1, 0x6F00],
+    "random": [0xC0FF, 0xC17F, 0xC20F, 0xC3F0],
+    "draw": [0x6010, 0x6108, 0x6200, 0xF229, 0xD015, 0xD015],
+    "clear": [0x00E0, 0x6000]
+}
+
+# Address of the subroutine called by the "flow" group
+SUBROUTINE = 0x300
+
+# Engines measured by default. The idle engine isn't one of them, it counts
+# the iterations of the groups that don't change their registers without
+# running them
+ENGINES = ["reference", "table", "block"]
+
+# Returns the ROM image running body in a loop
+def program_create(body):
+    program = bytearray(SUBROUTINE - 0x200 + 2)
+    for i, instruction in enumerate(body + [0x1200]):
+        program[2*i:2*i+2] = instruction.to_bytes(2, "big")
+    program[SUBROUTINE-0x200:SUBROUTINE-0x200+2] = (0x00EE).to_bytes(2, "big")
+    return bytes(program)
+
+# Returns a function executing cycles instructions of body on engine
+def program_runner(body, engine, cycles):
+    chip8 = computer.CHIP8(seed=0)
+    chip8.rom_load(program_create(body))
+    cpu = engines.engine_create(engine, chip8)
+    return lambda: cpu.run(cycles)
+
+# Run every group on every engine. Returns the results keyed by
+# "opcodes/<group>/<engine>"
+def benchmarks_run(groups=None, engine_names=None, cycles=20000, repeats=5):
+    results = {}
+    for group in groups or GROUPS:
+        for engine in engine_names or ENGINES:
+            results["opcodes/" + group + "/" + engine] = timing.benchmark(
+                program_runner(GROUPS[group], engine, cycles), cycles, repeats)
+    return results
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the speed of every opcode group")
+    parser.add_argument("groups", nargs="*", metavar="GROUP",
+                        help="groups to measure, all by default: " + " ".join(GROUPS))
+    parser.add_argument("--engine", action="append", dest="engines",
+                        choices=sorted(engines.engines),
+                        help="engine to measure, may be repeated")
+    parser.add_argument("--cycles", type=int, default=20000,
+                        help="instructions executed per repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    for group in args.groups:
+        if group not in GROUPS:
+            parser.error("UNKNOWN GROUP: " + group)
+
+    timing.results_print(benchmarks_run(args.groups, args.engines,
+                                        args.cycles, args.repeats))
@@ -0,0 +1,65 @@
+# This benchmark measures screen.Renderer.frame_draw on an offscreen canvas,
+# redrawing the whole screen, a band of rows and a few scattered rows, and
+# reports the frames drawn per second. The SDL dummy video driver is used
+# when no other one is set, so it runs without a display.
+
+import argparse
+import os
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+import computer
+import profiles
+import screen
+
+from benchmarks import timing
+
+# Rows redrawn by every case, as a video_dirty_rows mask
+CASES = {
+    "full": computer.VIDEO_ROWS_ALL,
+    "band": 0b11111 << 13,
+    "scattered": 1 << 2 | 1 << 9 | 1 << 17 | 1 << 30
+}
+
+# Returns a function drawing count frames of random pixels with dirty_rows
+# flagged on every frame, at the given zoom
+def frames_runner(count, dirty_rows, zoom, seed=0):
+    profile = dict(profiles.profile_get("normal"))
+    profile["zoom"] = zoom
+    canvas = pygame.Surface((64 * zoom, 32 * zoom))
+    renderer = screen.Renderer(canvas, profile)
+
+    chip8 = computer.CHIP8(seed=0)
+    rng = random.Random(seed)
+    chip8.video_memory[:] = bytes(rng.randrange(256) for _ in range(len(chip8.video_memory)))
+
+    def run():
+        for _ in range(count):
+            chip8.video_dirty_rows = dirty_rows
+            renderer.frame_draw(chip8)
+    return run
+
+# Run the render benchmarks. Returns the results keyed by
+# "render/<case>/<zoom>"
+def benchmarks_run(count=500, zoom=10, repeats=5):
+    pygame.init()
+    results = {}
+    for case, dirty_rows in CASES.items():
+        results["render/" + case + "/" + str(zoom)] = timing.benchmark(
+            frames_runner(count, dirty_rows, zoom), count, repeats)
+    return results
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the speed of the frame renderer")
+    parser.add_argument("--count", type=int, default=500,
+                        help="frames drawn per repeat")
+    parser.add_argument("--zoom", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    timing.results_print(benchmarks_run(args.count, args.zoom, args.repeats))
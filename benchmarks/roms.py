@@ -0,0 +1,59 @@
+# This benchmark runs every bundled ROM headlessly for a fixed amount of
+# cycles on each engine and reports the instructions per second, with the
+# framebuffer hash so runs on different engines can be checked to agree.
+
+import argparse
+import os
+
+import engines
+import headless
+
+from benchmarks import timing
+
+# Engines measured by default
+ENGINES = ["table", "block"]
+
+# Returns the names of the ROMs inside directory
+def roms_list(directory="roms"):
+    return sorted(name for name in os.listdir(directory)
+                  if os.path.isfile(os.path.join(directory, name)))
+
+# Run file repeats times plus a warm up run. Returns the result of the runs
+# with the framebuffer hash and crash of the last one
+def rom_benchmark(file, engine, cycles, cycles_per_frame, repeats):
+    headless.run(file, cycles, cycles_per_frame, engine)
+    runs = [headless.run(file, cycles, cycles_per_frame, engine)
+            for _ in range(repeats)]
+    result = timing.result_create([run["seconds"] for run in runs], cycles)
+    result["framebuffer_hash"] = runs[-1]["framebuffer_hash"]
+    result["crash"] = None if runs[-1]["crash"] is None else runs[-1]["crash"]["reason"]
+    return result
+
+# Run every ROM on every engine. Returns the results keyed by
+# "roms/<file>/<engine>"
+def benchmarks_run(files=None, engine_names=None, cycles=60000,
+                   cycles_per_frame=10, repeats=3):
+    results = {}
+    for file in files or roms_list():
+        for engine in engine_names or ENGINES:
+            results["roms/" + file + "/" + engine] = rom_benchmark(
+                file, engine, cycles, cycles_per_frame, repeats)
+    return results
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the speed of the bundled ROMs")
+    parser.add_argument("files", nargs="*", help="ROMs to run, all by default")
+    parser.add_argument("--engine", action="append", dest="engines",
+                        choices=sorted(engines.engines),
+                        help="engine to measure, may be repeated")
+    parser.add_argument("--cycles", type=int, default=60000,
+                        help="instructions executed per run")
+    parser.add_argument("--cycles-per-frame", type=int, default=10,
+                        help="instructions executed per 60 Hz frame")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    timing.results_print(benchmarks_run(args.files, args.engines, args.cycles,
+                                        args.cycles_per_frame, args.repeats))
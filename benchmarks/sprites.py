@@ -0,0 +1,62 @@
+# This benchmark measures CHIP8.dxyn on its own, blitting sprites of every
+# height at random positions, including ones clipped by the right and bottom
+# edges, and reports the sprites drawn per second.
+
+import argparse
+import random
+
+import computer
+
+from benchmarks import timing
+
+# Address of the sprite data, 15 rows with varied bit patterns
+SPRITE_ADDRESS = 0x800
+
+# Returns a function drawing count random sprites with heights from heights
+# on a machine. Sprites clipped at the edges are only kept when clipped is
+# set, otherwise they all fit on the screen
+def blits_runner(count, heights, clipped=True, seed=0):
+    chip8 = computer.CHIP8(seed=0)
+    rng = random.Random(seed)
+    for i in range(15):
+        chip8.system_memory[SPRITE_ADDRESS+i] = rng.randrange(1, 256)
+    chip8.register_I = SPRITE_ADDRESS
+
+    blits = []
+    for _ in range(count):
+        n = rng.choice(heights)
+        if clipped:
+            blits.append((rng.randrange(64), rng.randrange(32), n))
+        else:
+            blits.append((rng.randrange(64 - 8 + 1), rng.randrange(32 - n + 1), n))
+
+    dxyn = chip8.dxyn
+    def run():
+        for x, y, n in blits:
+            dxyn(x, y, n)
+    return run
+
+# Run the sprite benchmarks. Returns the results keyed by "sprites/<case>"
+def benchmarks_run(count=20000, repeats=5):
+    cases = {
+        "small": ([1, 2, 3, 4, 5], False),
+        "large": ([10, 11, 12, 13, 14, 15], False),
+        "mixed": (list(range(1, 16)), False),
+        "clipped": (list(range(1, 16)), True)
+    }
+    results = {}
+    for case, (heights, clipped) in cases.items():
+        results["sprites/" + case] = timing.benchmark(
+            blits_runner(count, heights, clipped), count, repeats)
+    return results
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the speed of the DXYN sprite blit")
+    parser.add_argument("--count", type=int, default=20000,
+                        help="sprites drawn per repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    timing.results_print(benchmarks_run(args.count, args.repeats))
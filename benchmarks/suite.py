@@ -0,0 +1,83 @@
+# This module runs every benchmark, writes the results as JSON and compares
+# them against a baseline written by an earlier run, exiting with status 1
+# when a benchmark got slower than the threshold allows.
+
+import argparse
+import platform
+import sys
+import time
+
+from benchmarks import opcodes
+from benchmarks import roms
+from benchmarks import sprites
+from benchmarks import timing
+
+# Benchmark modules in the order they run. The render benchmark needs PyGame
+# and is left out when it isn't installed
+SUITES = ["opcodes", "sprites", "render", "roms"]
+
+# Run the given suites. quick shortens every benchmark, for smoke runs
+# whose numbers aren't meant to be compared
+def suites_run(suites, repeats=5, quick=False):
+    scale = 10 if quick else 1
+    results = {}
+    for suite in suites:
+        print("RUNNING", suite.upper(), file=sys.stderr)
+        if suite == "opcodes":
+            results.update(opcodes.benchmarks_run(cycles=20000 // scale, repeats=repeats))
+        elif suite == "sprites":
+            results.update(sprites.benchmarks_run(20000 // scale, repeats))
+        elif suite == "render":
+            try:
+                from benchmarks import render
+            except ImportError:
+                print("PYGAME NOT INSTALLED, SKIPPING RENDER", file=sys.stderr)
+                continue
+            results.update(render.benchmarks_run(500 // scale, repeats=repeats))
+        elif suite == "roms":
+            results.update(roms.benchmarks_run(cycles=60000 // scale,
+                                               repeats=max(1, repeats // 2)))
+    return results
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the benchmarks and compare them against a baseline")
+    parser.add_argument("suites", nargs="*", metavar="SUITE",
+                        help="suites to run, all by default: " + " ".join(SUITES))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--quick", action="store_true",
+                        help="shorten every benchmark for a smoke run")
+    parser.add_argument("--output", default="benchmarks.json",
+                        help="file to write the JSON results to")
+    parser.add_argument("--baseline", default=None,
+                        help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown of the median rate, as a fraction, "
+                             "reported as a regression")
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error("UNKNOWN SUITE: " + suite)
+
+    results = suites_run(args.suites or SUITES, args.repeats, args.quick)
+    timing.results_print(results)
+    timing.results_save(args.output, results, {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "repeats": args.repeats,
+        "quick": args.quick
+    })
+
+    if args.baseline is not None:
+        regressions = timing.results_compare(results, timing.results_load(args.baseline),
+                                             args.threshold)
+        for name, regression in regressions.items():
+            print("REGRESSION:", name, format(regression["baseline_ips"], ".0f"),
+                  "->", format(regression["ips"], ".0f"),
+                  format(100 * regression["change"], "+.1f") + "%")
+        if regressions:
+            sys.exit(1)
+        print("NO REGRESSIONS ABOVE", format(100 * args.threshold, ".0f") + "%")
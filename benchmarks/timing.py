@@ -0,0 +1,83 @@
+# This module contains the helpers shared by the benchmarks: timing a
+# function over several repeats, summarizing the samples as rates and
+# percentiles, printing them and comparing them against a stored baseline.
+
+import json
+import time
+
+import profiler
+
+# Call function warmup times untimed, then repeats times. Returns the elapsed
+# seconds of every timed call
+def samples_measure(function, repeats=5, warmup=1):
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start_time)
+    return samples
+
+# Returns the result of a benchmark that ran operations operations per call
+# in each of samples seconds. "ips" is the operations per second of the
+# median call, the percentiles are of the per call rate, so p5 is a slow
+# call and p95 a fast one
+def result_create(samples, operations):
+    times = sorted(samples)
+    rates = sorted(operations / seconds for seconds in samples if seconds > 0)
+    if not rates:
+        rates = [0.0]
+    return {
+        "operations": operations,
+        "repeats": len(samples),
+        "seconds_min": times[0],
+        "seconds_p50": profiler.percentile(times, 0.50),
+        "seconds_max": times[-1],
+        "ips": profiler.percentile(rates, 0.50),
+        "ips_p5": profiler.percentile(rates, 0.05),
+        "ips_p25": profiler.percentile(rates, 0.25),
+        "ips_p75": profiler.percentile(rates, 0.75),
+        "ips_p95": profiler.percentile(rates, 0.95)
+    }
+
+# Time function and return its result, see samples_measure and result_create
+def benchmark(function, operations, repeats=5, warmup=1):
+    return result_create(samples_measure(function, repeats, warmup), operations)
+
+# Print results as a table, one benchmark per line
+def results_print(results):
+    print(format("BENCHMARK", "34"), format("IPS", ">12"), format("P5", ">12"),
+          format("P95", ">12"), format("MS P50", ">9"))
+    for name, result in results.items():
+        print(format(name, "34"), format(result["ips"], ">12.0f"),
+              format(result["ips_p5"], ">12.0f"), format(result["ips_p95"], ">12.0f"),
+              format(1000 * result["seconds_p50"], ">9.3f"))
+
+# Write a report holding results to file as JSON
+def results_save(file, results, metadata):
+    with open(file, "w") as f:
+        json.dump({"metadata": metadata, "results": results}, f, indent=2)
+
+# Returns the results of a report written by results_save
+def results_load(file):
+    with open(file) as f:
+        return json.load(f)["results"]
+
+# Compare results against the baseline results. Returns a dictionary of the
+# benchmarks whose median rate dropped by more than threshold, a fraction of
+# the baseline rate, with both rates and the change. Benchmarks missing from
+# either side are ignored
+def results_compare(results, baseline, threshold=0.10):
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline or baseline[name]["ips"] <= 0:
+            continue
+        change = result["ips"] / baseline[name]["ips"] - 1
+        if change < -threshold:
+            regressions[name] = {
+                "ips": result["ips"],
+                "baseline_ips": baseline[name]["ips"],
+                "change": change
+            }
+    return regressions
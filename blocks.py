@@ -0,0 +1,284 @@
+# This module contains a CPU engine that translates basic blocks of CHIP-8
+# code into cached Python functions. A block starts at a PC and runs straight
+# through the code, following 1NNN jumps and 2NNN calls whose targets are
+# known, until it reaches an instruction whose successor depends on the
+# machine state. The whole block then runs with a single dispatch instead of
+# fetching and decoding every instruction again.
+
+import dispatch
+
+# Instructions whose successor depends on the machine state end a block.
+# FX33 and FX55 also end blocks, so a write into the running block never
+# executes stale code
+terminal_handlers = {
+    dispatch.op_00ee, dispatch.op_3xnn, dispatch.op_4xnn, dispatch.op_5xy0,
+    dispatch.op_9xy0, dispatch.op_bnnn, dispatch.op_ex9e, dispatch.op_exa1,
+    dispatch.op_fx0a, dispatch.op_fx33, dispatch.op_fx55
+}
+
+# Instructions that may raise an exception need the PC register to point at
+# them before they run, so a crash leaves the same state as cpu_cycle
+raising_handlers = {dispatch.op_dxyn, dispatch.op_fx65}
+
+# Python source for the instructions translated inline. Everything else
+# calls its dispatch handler
+inline_sources = {
+    dispatch.op_nop: [],
+    dispatch.op_6xnn: ["V[{x}] = {nn}"],
+    dispatch.op_7xnn: ["V[{x}] = (V[{x}] + {nn}) & 0xFF"],
+    dispatch.op_8xy0: ["V[{x}] = V[{y}]"],
+    dispatch.op_8xy1: ["V[{x}] |= V[{y}]"],
+    dispatch.op_8xy2: ["V[{x}] &= V[{y}]"],
+    dispatch.op_8xy3: ["V[{x}] ^= V[{y}]"],
+    dispatch.op_8xy4: ["V[{x}] = (V[{x}] + V[{y}]) & 0xFF", "V[15] = 0"],
+    dispatch.op_8xy5: ["if V[{x}] < V[{y}]: V[15] = 0",
+                       "elif V[{x}] > V[{y}]: V[15] = 1",
+                       "V[{x}] = (V[{x}] - V[{y}]) & 0xFF"],
+    dispatch.op_8xy7: ["if V[{y}] < V[{x}]: V[15] = 0",
+                       "elif V[{y}] > V[{x}]: V[15] = 1",
+                       "V[{x}] = (V[{y}] - V[{x}]) & 0xFF"],
+    dispatch.op_annn: ["chip8.register_I = {nnn}"],
+    dispatch.op_fx07: ["V[{x}] = chip8.delay_timer"],
+    dispatch.op_fx15: ["chip8.delay_timer = V[{x}]"],
+    dispatch.op_fx18: ["chip8.sound_timer = V[{x}]"],
+    dispatch.op_fx1e: ["chip8.register_I += V[{x}]"],
+    dispatch.op_fx29: ["chip8.register_I = V[{x}] * 5"]
+}
+
+# Longest run of instructions translated into a single block
+BLOCK_SIZE_MAX = 64
+
+# Number of interpreted runs before a block is compiled. Single instruction
+# blocks are never compiled since the function call would only add overhead
+BLOCK_HOT_RUNS = 8
+
+# Runs the CPU from a cache of translated basic blocks keyed by start address.
+# Blocks are invalidated when FX33 or FX55 write into their code range, and
+# all of them are dropped when the machine's memory_epoch changes
+class BlockEngine:
+    def __init__(self, chip8):
+        self.chip8 = chip8
+
+        # Translated blocks keyed by their start address. Each block is a
+        # [function, length, ops, addresses, runs, code] list, where ops holds
+        # the pre-decoded (handler, instruction) pairs, and function and its
+        # code object are None until the block is hot enough to be compiled
+        self.blocks = {}
+
+        # Number of cached blocks covering each memory address. Lets writes to
+        # data areas skip the search for blocks to invalidate
+        self.code_map = [0] * len(chip8.system_memory)
+
+        # Memory epoch of the machine the cached blocks were decoded from
+        self.memory_epoch = chip8.memory_epoch
+
+        # Addresses every block must start at instead of running through.
+        # The debugger keeps its breakpoints here
+        self.block_starts = set()
+
+        # Cache counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.imported = 0
+
+    # Execute count instructions
+    def run(self, count):
+        chip8 = self.chip8
+        if chip8.memory_epoch != self.memory_epoch:
+            self.clear()
+        blocks = self.blocks
+        while count > 0:
+            block = blocks.get(chip8.register_PC)
+            if block is None:
+                block = self.block_translate(chip8.register_PC)
+            else:
+                self.hits += 1
+
+            function = block[0]
+            if function is not None and block[1] <= count:
+                function(chip8)
+                count -= block[1]
+            elif block[1] == 1:
+                handler, instruction = block[2][0]
+                handler(chip8, instruction)
+                chip8.register_PC += 2
+                count -= 1
+            else:
+                # Cold blocks, and blocks that only partially fit in the
+                # budget, run from their pre-decoded instructions
+                ops = block[2]
+                if len(ops) > count:
+                    ops = ops[:count]
+                for handler, instruction in ops:
+                    handler(chip8, instruction)
+                    chip8.register_PC += 2
+                count -= len(ops)
+
+                block[4] += 1
+                if block[4] == BLOCK_HOT_RUNS and block[1] > 1:
+                    source, namespace = self.block_source(block[2], block[3])
+                    block[5] = compile(source, "<block>", "exec")
+                    exec(block[5], namespace)
+                    block[0] = namespace["block"]
+
+    # Returns the (handler, instruction) pair run for instruction. FX33 and
+    # FX55 go through the engine so their writes invalidate blocks
+    def op_get(self, instruction):
+        handler = dispatch.instruction_handlers[instruction]
+        if handler is dispatch.op_fx33:
+            return (self.op_fx33, instruction)
+        elif handler is dispatch.op_fx55:
+            return (self.op_fx55, instruction)
+        return (handler, instruction)
+
+    # Decode the block starting at address and add it to the cache. Blocks
+    # are compiled into a Python function once they run BLOCK_HOT_RUNS times
+    def block_translate(self, address):
+        self.misses += 1
+        system_memory = self.chip8.system_memory
+        table = dispatch.instruction_handlers
+
+        ops = []
+        addresses = []
+        pc = address
+        while True:
+            instruction = system_memory[pc] << 8 | system_memory[pc+1]
+            handler = table[instruction]
+            addresses.append(pc)
+            ops.append(self.op_get(instruction))
+            if handler in terminal_handlers:
+                break
+
+            if handler is dispatch.op_1nnn or handler is dispatch.op_2nnn:
+                pc = instruction & 0x0FFF
+            else:
+                pc += 2
+
+            # Stop on loops, on long blocks, before block_starts and before a
+            # fetch that would read past the end of memory, so the next
+            # dispatch fails just like the reference interpreter
+            if (pc in addresses or len(ops) == BLOCK_SIZE_MAX
+                    or pc + 1 >= len(system_memory) or pc in self.block_starts):
+                break
+
+        return self.block_add(address, [None, len(ops), ops, addresses, 0, None])
+
+    # Add a block to the cache
+    def block_add(self, address, block):
+        self.blocks[address] = block
+        for pc in block[3]:
+            self.code_map[pc] += 1
+            self.code_map[pc+1] += 1
+        return block
+
+    # Generate the source of the Python function running the pre-decoded
+    # instructions ops located at addresses. Returns the source and the
+    # namespace holding the handlers it calls
+    def block_source(self, ops, addresses):
+        source = ["def block(chip8):", "    V = chip8.register_V"]
+        namespace = {}
+        for (function, instruction), pc in zip(ops, addresses):
+            handler = dispatch.instruction_handlers[instruction]
+            operands = {"x": (instruction & 0x0F00) >> 8,
+                        "y": (instruction & 0x00F0) >> 4,
+                        "nn": instruction & 0x00FF,
+                        "nnn": instruction & 0x0FFF}
+            next_pc = pc + 2
+            if handler in inline_sources:
+                for line in inline_sources[handler]:
+                    source.append("    " + line.format(**operands))
+            elif handler is dispatch.op_1nnn:
+                next_pc = operands["nnn"]
+            elif handler is dispatch.op_2nnn:
+                source.append("    chip8.stack.append(" + str(pc) + ")")
+                next_pc = operands["nnn"]
+            else:
+                name = "h" + str(len(namespace))
+                namespace[name] = function
+                if handler in raising_handlers or handler in terminal_handlers:
+                    source.append("    chip8.register_PC = " + str(pc))
+                source.append("    " + name + "(chip8, " + str(instruction) + ")")
+
+        if handler in terminal_handlers:
+            source.append("    chip8.register_PC += 2")
+        else:
+            source.append("    chip8.register_PC = " + str(next_pc))
+
+        return "\n".join(source), namespace
+
+    # Drop every cached block covering memory addresses start to end - 1
+    def invalidate(self, start, end):
+        if not any(self.code_map[start:end]):
+            return
+        for address, block in list(self.blocks.items()):
+            addresses = block[3]
+            if any(start - 1 <= pc < end for pc in addresses):
+                del self.blocks[address]
+                for pc in addresses:
+                    self.code_map[pc] -= 1
+                    self.code_map[pc+1] -= 1
+                self.invalidations += 1
+
+    # Drop every cached block
+    def clear(self):
+        self.blocks = {}
+        self.code_map = [0] * len(self.chip8.system_memory)
+        self.memory_epoch = self.chip8.memory_epoch
+
+    # Returns the cached blocks whose code matches memory, normally the ROM
+    # image right after loading, as a marshal friendly tuple of (address,
+    # addresses, instructions, runs, code) entries. Blocks decoded from
+    # memory the program modified are left out, so importing the result on
+    # a freshly loaded machine never runs stale code
+    def program_export(self, memory):
+        program = []
+        for address, block in self.blocks.items():
+            instructions = tuple(instruction for handler, instruction in block[2])
+            if all(memory[pc] << 8 | memory[pc+1] == instruction
+                   for pc, instruction in zip(block[3], instructions)):
+                program.append((address, tuple(block[3]), instructions,
+                                block[4], block[5]))
+        return tuple(program)
+
+    # Add the blocks of a program_export() result to the cache, skipping
+    # the decoding and compilation. Blocks that don't match the current
+    # memory are ignored
+    def program_import(self, program):
+        if self.chip8.memory_epoch != self.memory_epoch:
+            self.clear()
+        system_memory = self.chip8.system_memory
+        for address, addresses, instructions, runs, code in program:
+            if address in self.blocks or not all(
+                    system_memory[pc] << 8 | system_memory[pc+1] == instruction
+                    for pc, instruction in zip(addresses, instructions)):
+                continue
+            ops = [self.op_get(instruction) for instruction in instructions]
+            block = [None, len(ops), ops, list(addresses), runs, code]
+            if code is not None:
+                namespace = self.block_source(ops, addresses)[1]
+                exec(code, namespace)
+                block[0] = namespace["block"]
+            self.block_add(address, block)
+            self.imported += 1
+
+    # FX33 followed by the invalidation of the 3 written bytes
+    def op_fx33(self, chip8, instruction):
+        dispatch.op_fx33(chip8, instruction)
+        self.invalidate(chip8.register_I, chip8.register_I + 3)
+
+    # FX55 followed by the invalidation of the V0 to VX written bytes
+    def op_fx55(self, chip8, instruction):
+        start = chip8.register_I
+        dispatch.op_fx55(chip8, instruction)
+        self.invalidate(start, chip8.register_I)
+
+    # Engine specific counters
+    def stats(self):
+        return {
+            "block_hits": self.hits,
+            "block_misses": self.misses,
+            "block_invalidations": self.invalidations,
+            "blocks_imported": self.imported,
+            "blocks_cached": len(self.blocks)
+        }
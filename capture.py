@@ -0,0 +1,379 @@
+# This module records what a ROM draws without a display. The video memory
+# is already 1 bit per pixel, so each 60 Hz frame is kept as the XOR of the
+# previous distinct frame, run-length encoded, and frames identical to the
+# previous one only add to its repeat count. Exports decode the frames one at
+# a time and stream them to an animated GIF, a PNG sequence or raw video, so
+# long runs never hold more than one full-size frame in memory.
+
+import argparse
+import os
+import re
+import struct
+import zlib
+
+import computer
+
+# Capture file format. The header holds the magic, the format version and
+# the amount of frames, followed by the records of the distinct frames
+CAPTURE_MAGIC = b"CH8V"
+CAPTURE_VERSION = 1
+HEADER = struct.Struct("<4sBI")
+
+# Every distinct frame is stored as the frames it lasts and the length of its
+# encoded delta, followed by the delta
+RECORD = struct.Struct("<IH")
+
+# Runs of non zero bytes of a delta
+NONZERO_RUN = re.compile(b"[^\x00]+")
+
+# Default export colors, the ones of the "normal" profile
+BACKGROUND_COLOR = (0x99, 0xBD, 0x2A)
+FOREGROUND_COLOR = (0x2F, 0x63, 0x33)
+
+# Longest delay a GIF graphic control block holds, in hundredths of a second
+GIF_DELAY_MAX = 0xFFFF
+
+# Returns data run-length encoded as pairs of a zero run length and a literal
+# length, each followed by the literal bytes. Trailing zeros are dropped
+def rle_encode(data):
+    encoded = bytearray()
+    position = 0
+    for match in NONZERO_RUN.finditer(data):
+        start, end = match.span()
+        zeros = start - position
+        while zeros > 255:
+            encoded += b"\xff\x00"
+            zeros -= 255
+        while end - start > 255:
+            encoded += bytes((zeros, 255)) + data[start:start+255]
+            zeros = 0
+            start += 255
+        encoded += bytes((zeros, end - start)) + data[start:end]
+        position = end
+    return bytes(encoded)
+
+# Returns the size bytes encoded by rle_encode
+def rle_decode(encoded, size):
+    data = bytearray(size)
+    position = 0
+    i = 0
+    while i < len(encoded):
+        position += encoded[i]
+        count = encoded[i+1]
+        data[position:position+count] = encoded[i+2:i+2+count]
+        position += count
+        i += 2 + count
+    return data
+
+# Returns the XOR of two byte strings of the same length
+def bytes_xor(a, b):
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).to_bytes(len(a), "big")
+
+# Captures the video memory of a CHIP8. frame_capture must be called once
+# per 60 Hz frame, after the frame's instructions ran
+class FrameCapture:
+    def __init__(self):
+        # Encoded records of the finished distinct frames, the current frame
+        # and the amount of frames it lasted so far
+        self.data = bytearray()
+        self.frame = bytes(computer.VIDEO_MEMORY_SIZE)
+        self.repeats = 0
+        self.previous = bytes(computer.VIDEO_MEMORY_SIZE)
+
+        # Counters
+        self.frames = 0
+        self.distinct_frames = 0
+
+    # Store the current frame of the video memory of chip8
+    def frame_capture(self, chip8):
+        self.frame_add(bytes(chip8.video_memory))
+
+    # Store a frame of packed video memory
+    def frame_add(self, frame):
+        self.frames += 1
+        if self.repeats and frame == self.frame:
+            self.repeats += 1
+            return
+        if self.repeats:
+            self.data += self.record_encode()
+            self.previous = self.frame
+        self.frame = frame
+        self.repeats = 1
+        self.distinct_frames += 1
+
+    # Returns the record of the current frame, encoded as the delta from the
+    # previous one
+    def record_encode(self):
+        delta = rle_encode(bytes_xor(self.frame, self.previous))
+        return RECORD.pack(self.repeats, len(delta)) + delta
+
+    # Returns the encoded records with the current frame's included, without
+    # ending its run, so capturing can go on afterwards
+    def data_get(self):
+        if not self.repeats:
+            return bytes(self.data)
+        return bytes(self.data) + self.record_encode()
+
+    # Yields every distinct frame as packed video memory with the amount of
+    # frames it lasts
+    def frames_get(self):
+        data = self.data_get()
+        frame = bytes(computer.VIDEO_MEMORY_SIZE)
+        offset = 0
+        while offset < len(data):
+            repeats, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            delta = rle_decode(data[offset:offset+length], len(frame))
+            offset += length
+            frame = bytes_xor(frame, delta)
+            yield frame, repeats
+
+    # Write the capture to file
+    def save(self, file):
+        with open(file, "wb") as f:
+            f.write(HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, self.frames))
+            f.write(self.data_get())
+
+    # Capture counters
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "distinct_frames": self.distinct_frames,
+            "capture_bytes": len(self.data_get())
+        }
+
+# Returns a FrameCapture read from a file written by FrameCapture.save.
+# Raises ValueError if the file isn't a capture
+def capture_load(file):
+    with open(file, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError("NOT A CAPTURE FILE: " + file)
+    magic, version, frames = HEADER.unpack_from(data)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError("NOT A CAPTURE FILE: " + file)
+
+    capture = FrameCapture()
+    capture.data = bytearray(data[HEADER.size:])
+    capture.frames = frames
+    offset = 0
+    while offset < len(capture.data):
+        length = RECORD.unpack_from(capture.data, offset)[1]
+        offset += RECORD.size + length
+        capture.distinct_frames += 1
+    return capture
+
+# Returns the rows of a packed frame scaled by scale, as bytes with one bit
+# per pixel, most significant bit first
+def frame_rows(frame, scale=1):
+    rows = []
+    for y in range(32):
+        row = frame[y*computer.VIDEO_ROW_SIZE:(y+1)*computer.VIDEO_ROW_SIZE]
+        if scale > 1:
+            bits = "".join(bit * scale for bit in format(int.from_bytes(row, "big"), "064b"))
+            row = int(bits, 2).to_bytes(8 * scale, "big")
+        rows.extend([row] * scale)
+    return rows
+
+# computer.BYTE_PIXELS with every pixel repeated, keyed by the scale
+scaled_byte_pixels = {1: computer.BYTE_PIXELS}
+
+# Returns the pixels of rows top to bottom of a packed frame scaled by scale,
+# one byte per pixel set to 0 or 1
+def frame_pixels(frame, scale=1, top=0, bottom=32):
+    byte_pixels = scaled_byte_pixels.get(scale)
+    if byte_pixels is None:
+        byte_pixels = [bytes(pixel for pixel in pixels for _ in range(scale))
+                       for pixels in computer.BYTE_PIXELS]
+        scaled_byte_pixels[scale] = byte_pixels
+    pixels = bytearray()
+    for y in range(top, bottom):
+        row = frame[y*computer.VIDEO_ROW_SIZE:(y+1)*computer.VIDEO_ROW_SIZE]
+        pixels += b"".join([byte_pixels[byte] for byte in row]) * scale
+    return bytes(pixels)
+
+# Returns a PNG image of a packed frame, 1 bit per pixel with a palette
+def png_encode(frame, scale=1, colors=(BACKGROUND_COLOR, FOREGROUND_COLOR)):
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data)))
+
+    rows = frame_rows(frame, scale)
+    header = struct.pack(">IIBBBBB", 64 * scale, 32 * scale, 1, 3, 0, 0, 0)
+    palette = bytes(colors[0]) + bytes(colors[1])
+    image = zlib.compress(b"".join(b"\x00" + row for row in rows), 9)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"PLTE", palette) +
+            chunk(b"IDAT", image) + chunk(b"IEND", b""))
+
+# Write one PNG per distinct frame of capture inside directory, named after
+# the frame it starts at. Returns the amount of files written
+def png_export(capture, directory, scale=1, colors=(BACKGROUND_COLOR, FOREGROUND_COLOR)):
+    os.makedirs(directory, exist_ok=True)
+    frame_number = 0
+    files = 0
+    for frame, repeats in capture.frames_get():
+        with open(os.path.join(directory, format(frame_number, "07d") + ".png"), "wb") as f:
+            f.write(png_encode(frame, scale, colors))
+        frame_number += repeats
+        files += 1
+    return files
+
+# Write every frame of capture to file as raw 8-bit grayscale video at 60
+# frames per second, 0 for the background and 255 for the foreground. It can
+# be converted with, e.g., ffmpeg -f rawvideo -pix_fmt gray -s 64x32 -r 60
+def raw_export(capture, file, scale=1):
+    with open(file, "wb") as f:
+        for frame, repeats in capture.frames_get():
+            pixels = frame_pixels(frame, scale).replace(b"\x01", b"\xff")
+            for _ in range(repeats):
+                f.write(pixels)
+
+# Returns indices compressed with the variable length LZW of the GIF format
+def lzw_encode(indices, minimum_code_size):
+    clear_code = 1 << minimum_code_size
+    end_code = clear_code + 1
+
+    encoded = bytearray()
+    buffer = 0
+    buffer_bits = 0
+    code_size = minimum_code_size + 1
+    table = {bytes((i,)): i for i in range(clear_code)}
+    next_code = end_code + 1
+
+    codes = [clear_code]
+    prefix = b""
+    for index in indices:
+        candidate = prefix + bytes((index,))
+        if candidate in table:
+            prefix = candidate
+            continue
+        codes.append(table[prefix])
+        if next_code == 4096:
+            codes.append(clear_code)
+            table = {bytes((i,)): i for i in range(clear_code)}
+            next_code = end_code + 1
+        else:
+            table[candidate] = next_code
+            next_code += 1
+        prefix = bytes((index,))
+    if prefix:
+        codes.append(table[prefix])
+    codes.append(end_code)
+
+    # The code size grows once the decoder's table, one entry behind the
+    # encoder's, fills the current size
+    next_code = end_code + 1
+    first = True
+    for code in codes:
+        buffer |= code << buffer_bits
+        buffer_bits += code_size
+        while buffer_bits >= 8:
+            encoded.append(buffer & 0xFF)
+            buffer >>= 8
+            buffer_bits -= 8
+        if code == clear_code:
+            code_size = minimum_code_size + 1
+            next_code = end_code + 1
+            first = True
+        elif first:
+            first = False
+        else:
+            next_code += 1
+            if next_code == 1 << code_size and code_size < 12:
+                code_size += 1
+    if buffer_bits:
+        encoded.append(buffer & 0xFF)
+    return bytes(encoded)
+
+# Returns the first and last plus one rows that differ between two packed
+# frames, or None if they are the same
+def rows_changed(frame, previous):
+    delta = int.from_bytes(bytes_xor(frame, previous), "big")
+    if not delta:
+        return None
+    row_bits = 8 * computer.VIDEO_ROW_SIZE
+    top = 32 - (delta.bit_length() + row_bits - 1) // row_bits
+    bottom = 32 - ((delta & -delta).bit_length() - 1) // row_bits
+    return top, bottom
+
+# Write capture to file as an animated GIF that loops forever. Every image
+# after the first only covers the rows that changed and is drawn over the
+# previous one. GIF delays are in hundredths of a second, so they are
+# rounded keeping the total time
+def gif_export(capture, file, scale=1, colors=(BACKGROUND_COLOR, FOREGROUND_COLOR)):
+    width = 64 * scale
+    with open(file, "wb") as f:
+        f.write(b"GIF89a" + struct.pack("<HHBBB", width, 32 * scale, 0x80, 0, 0))
+        f.write(bytes(colors[0]) + bytes(colors[1]))
+        f.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+
+        # Every image is written once the next one starts, so records that
+        # change nothing only extend the delay of the image before them
+        frame_number = 0
+        previous = None
+        pending = None
+        for frame, repeats in capture.frames_get():
+            rows = (0, 32) if previous is None else rows_changed(frame, previous)
+            if rows is not None:
+                if pending is not None:
+                    gif_image_write(f, *pending, frame_number, scale)
+                pending = (frame, rows, frame_number)
+                previous = frame
+            frame_number += repeats
+        if pending is not None:
+            gif_image_write(f, *pending, frame_number, scale)
+        f.write(b"\x3b")
+
+# Write the rows top to bottom - 1 of a packed frame as a GIF image shown
+# from frame number start to end. Holds longer than GIF_DELAY_MAX go on
+# with 1x1 transparent images carrying the rest of the delay
+def gif_image_write(f, frame, rows, start, end, scale):
+    top, bottom = rows
+    delay = round(end * 100 / 60) - round(start * 100 / 60)
+    hold = min(delay, GIF_DELAY_MAX)
+
+    # Disposal method 1 leaves the image in place for the next one
+    f.write(b"\x21\xf9\x04\x04" + struct.pack("<H", hold) + b"\x00\x00")
+    f.write(b"\x2c" + struct.pack("<HHHHB", 0, top * scale, 64 * scale,
+                                  (bottom - top) * scale, 0))
+
+    # The minimum code size is 2 even for a 2 color image
+    image = lzw_encode(frame_pixels(frame, scale, top, bottom), 2)
+    f.write(b"\x02")
+    for i in range(0, len(image), 255):
+        f.write(bytes((len(image[i:i+255]),)) + image[i:i+255])
+    f.write(b"\x00")
+
+    # Color 0 of the filler images is transparent, so they draw nothing
+    delay -= hold
+    while delay > 0:
+        hold = min(delay, GIF_DELAY_MAX)
+        f.write(b"\x21\xf9\x04\x05" + struct.pack("<H", hold) + b"\x00\x00")
+        f.write(b"\x2c" + struct.pack("<HHHHB", 0, 0, 1, 1, 0))
+        image = lzw_encode(b"\x00", 2)
+        f.write(b"\x02" + bytes((len(image),)) + image + b"\x00")
+        delay -= hold
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export a capture written by headless.py --capture")
+    parser.add_argument("capture", help="capture file")
+    parser.add_argument("--gif", default=None, help="animated GIF to write")
+    parser.add_argument("--png", default=None,
+                        help="directory to write a PNG per distinct frame to")
+    parser.add_argument("--raw", default=None,
+                        help="raw 8-bit grayscale 60 fps video to write")
+    parser.add_argument("--scale", type=int, default=4,
+                        help="pixels per CHIP-8 pixel of the GIF and PNG images")
+    args = parser.parse_args()
+
+    capture = capture_load(args.capture)
+    for name, value in capture.stats().items():
+        print(name.upper() + ":", value)
+    if args.gif is not None:
+        gif_export(capture, args.gif, args.scale)
+    if args.png is not None:
+        print("PNG FILES:", png_export(capture, args.png, args.scale))
+    if args.raw is not None:
+        raw_export(capture, args.raw)
@@ -1,23 +1,75 @@
 # This module contains the CPU & memory. It also includes functions
-# to support the DXYN instruction and load ROM files.
+# to support the DXYN instruction and load ROM files. It doesn't depend on
+# PyGame so the CPU can run headless.
 
-import pygame
-import sys
+import array
+import os
 import random
-import time
+import struct
 
-# Stateful class representing the CHIP-8 computer
+# Bit mask with one bit set for each of the 32 rows of the video memory
+VIDEO_ROWS_ALL = (1 << 32) - 1
+
+# The video memory packs 8 pixels per byte, most significant bit first, so
+# each 64 pixels row takes 8 bytes like on the COSMAC VIP
+VIDEO_ROW_SIZE = 8
+VIDEO_MEMORY_SIZE = 32 * VIDEO_ROW_SIZE
+
+# Maps a video memory byte to its 8 pixels, one byte per pixel set to 0 or 1
+BYTE_PIXELS = [bytes((byte >> (7 - j)) & 0x01 for j in range(8))
+               for byte in range(256)]
+
+# Save state binary format. A header with the magic, format version, PC, I,
+# timers, shift_VY and stack depth is followed by V0-VF, the keys, the system
+# memory, the video memory, the stack entries and the Mersenne Twister state
+# of the CXNN random number generator. All values are little endian
+STATE_MAGIC = b"CH8S"
+STATE_VERSION = 1
+STATE_HEADER = struct.Struct("<4sBHIBBBH")
+STATE_RNG = struct.Struct("<625I?d")
+
+# Default fontset loaded into system memory. Each character takes 5 bytes
+FONTSET = bytes([0xF0, 0x90, 0x90, 0x90, 0xF0, #0
+                 0x20, 0x60, 0x20, 0x20, 0x70, #1
+                 0xF0, 0x10, 0xF0, 0x80, 0xF0, #2
+                 0xF0, 0x10, 0xF0, 0x10, 0xF0, #3
+                 0x90, 0x90, 0xF0, 0x10, 0x10, #4
+                 0xF0, 0x80, 0xF0, 0x10, 0xF0, #5
+                 0xF0, 0x80, 0xF0, 0x90, 0xF0, #6
+                 0xF0, 0x10, 0x20, 0x40, 0x40, #7
+                 0xF0, 0x90, 0xF0, 0x90, 0xF0, #8
+                 0xF0, 0x90, 0xF0, 0x10, 0xF0, #9
+                 0xF0, 0x90, 0xF0, 0x90, 0x90, #A
+                 0xE0, 0x90, 0xE0, 0x90, 0xE0, #B
+                 0xF0, 0x80, 0x80, 0x80, 0xF0, #C
+                 0xE0, 0x90, 0x90, 0x90, 0xE0, #D
+                 0xF0, 0x80, 0xF0, 0x80, 0xF0, #E
+                 0xF0, 0x80, 0xF0, 0x80, 0x80]) #F
+
+# Stateful class representing the CHIP-8 computer. The memories, V registers
+# and keys are bytearrays, which take a byte per value, only hold 8-bit values
+# and can be shared without copies through memoryview or NumPy's frombuffer.
+# They are always updated in place so those views stay valid. The stack is a
+# 16-bit array. Attributes are fixed by __slots__ to keep instances small
 class CHIP8:
-    # Initialize CPU & memory
-    def __init__(self):
+    __slots__ = ("system_memory", "video_memory", "stack", "register_V",
+                 "delay_timer", "sound_timer", "register_I", "register_PC",
+                 "video_draw_flag", "video_dirty_rows", "keys_pressed",
+                 "shift_VY", "seed", "rng", "memory_epoch", "audio")
+
+    # Initialize CPU & memory. audio is an audio.py backend told on every 60
+    # Hz timer tick whether the sound timer is running, None keeps the
+    # machine silent. seed makes the CXNN random numbers reproducible, None
+    # seeds from the OS
+    def __init__(self, audio=None, seed=None):
 
         # Memory and stack
-        self.system_memory = [0] * 4096
-        self.video_memory = [0] * (64 * 32)
-        self.stack = [] 
+        self.system_memory = bytearray(4096)
+        self.video_memory = bytearray(VIDEO_MEMORY_SIZE)
+        self.stack = array.array("H")
 
         # 8-bits registers
-        self.register_V = [0] * 16
+        self.register_V = bytearray(16)
         self.delay_timer = 0
         self.sound_timer = 0
         
@@ -28,79 +80,95 @@ class CHIP8:
         # Draw flag pseudo register. set to 1 when a screen redraw is needed
         self.video_draw_flag = 0
 
+        # Dirty rows pseudo register. Bit n is set when row n of the video
+        # memory may have changed since the screen last drew it
+        self.video_dirty_rows = VIDEO_ROWS_ALL
+
         # Keyboard pseudo register. indexes 0-15 are use to store the 
         # correspospoding hex keys state. Set to 1 if the key is pressed and 0 
         # otherwise 
-        self.keys_pressed = [0] * 16
+        self.keys_pressed = bytearray(16)
 
         # shift_VY is a compatibility flag that can be toggled off to 
         # shift VX instead of VY. Check instructions 8XY6 and 8XYE. Many games
         # like "BLINKY" requires it off
         self.shift_VY = 0
 
-        # cycle_start_time and cycle_end_time are used to measure the time 
-        # between CPU cycles
-        self.cycle_start_time = 0
-        self.cycle_end_time = 0
-        
+        # Random number generator used by CXNN. Every machine owns one so runs
+        # can be reproduced from their seed
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        # Incremented whenever the system memory is rewritten from outside the
+        # CPU, like loading a ROM or a save state, so engines caching decoded
+        # code know it must be dropped
+        self.memory_epoch = 0
+
         # Initialize sound
-        pygame.mixer.music.load("pong.wav") 
-
-        # Load default fontset into system memory. Each character takes 5 bytes
-        self.fontset = [0xF0, 0x90, 0x90, 0x90, 0xF0, #0
-                        0x20, 0x60, 0x20, 0x20, 0x70, #1
-                        0xF0, 0x10, 0xF0, 0x80, 0xF0, #2
-                        0xF0, 0x10, 0xF0, 0x10, 0xF0, #3
-                        0x90, 0x90, 0xF0, 0x10, 0x10, #4
-                        0xF0, 0x80, 0xF0, 0x10, 0xF0, #5
-                        0xF0, 0x80, 0xF0, 0x90, 0xF0, #6
-                        0xF0, 0x10, 0x20, 0x40, 0x40, #7
-                        0xF0, 0x90, 0xF0, 0x90, 0xF0, #8
-                        0xF0, 0x90, 0xF0, 0x10, 0xF0, #9
-                        0xF0, 0x90, 0xF0, 0x90, 0x90, #A
-                        0xE0, 0x90, 0xE0, 0x90, 0xE0, #B
-                        0xF0, 0x80, 0x80, 0x80, 0xF0, #C
-                        0xE0, 0x90, 0x90, 0x90, 0xE0, #D
-                        0xF0, 0x80, 0xF0, 0x80, 0xF0, #E
-                        0xF0, 0x80, 0xF0, 0x80, 0x80] #F
-        for i in range(80):
-            self.system_memory[i] = self.fontset[i]
-
-    # Writes a bit to the video memory
-    def video_memory_write(self, x, y, system_memory_bit):
-        if x < 64 and y < 32:
-            # row major calculation for video memory offset
-            video_offset = x + (y * 64)
-            # Set the sprite collision detection flag
-            if (self.video_memory[video_offset] & int(system_memory_bit)) == 1:
-                self.register_V[0xF] = 1 
-            # video memory writes are XORed in CHIP8
-            self.video_memory[video_offset] ^= int(system_memory_bit)
-
-    # Writes a sprite to the video memory
+        self.audio = audio
+
+        # Load default fontset into system memory
+        self.system_memory[:len(FONTSET)] = FONTSET
+
+    # Returns the value (0 or 1) of the pixel at x, y
+    def video_pixel(self, x, y):
+        return (self.video_memory[y*VIDEO_ROW_SIZE + (x >> 3)] >> (7 - (x & 7))) & 0x01
+
+    # Returns the 64 pixels of row y, one byte per pixel set to 0 or 1
+    def video_row_pixels(self, y):
+        offset = y * VIDEO_ROW_SIZE
+        return b"".join([BYTE_PIXELS[byte] for byte in
+                         self.video_memory[offset:offset+VIDEO_ROW_SIZE]])
+
+    # Returns the 64x32 pixels in row major order, one byte per pixel
+    def video_pixels(self):
+        return b"".join([BYTE_PIXELS[byte] for byte in self.video_memory])
+
+    # Clear the video memory in place, so views of it stay valid
+    def video_clear(self):
+        self.video_memory[:] = bytes(VIDEO_MEMORY_SIZE)
+        self.video_draw_flag = 1
+        self.video_dirty_rows = VIDEO_ROWS_ALL
+
+    # Writes a sprite to the video memory. Each sprite row is XORed into its
+    # video memory row as a single 64-bit word and a collision happens when
+    # both words share set bits. Pixels falling off the right or bottom edges
+    # are clipped
     def dxyn(self, x, y, n):
         # Reset collision detection flag
         self.register_V[0xF] = 0
 
+        video_memory = self.video_memory
         for i in range(n):
-            system_memory_byte = int(self.system_memory[self.register_I+i])
-            for j in range(8):
-                self.video_memory_write(x+j, y+i, (system_memory_byte >> 7-j) & 0x01)
+            system_memory_byte = self.system_memory[self.register_I+i]
+            if system_memory_byte and x < 64 and y+i < 32:
+                # Shifting right past bit 0 clips the sprite at the right edge
+                sprite_row = (system_memory_byte << 56) >> x
+                offset = (y+i) * VIDEO_ROW_SIZE
+                video_row = int.from_bytes(video_memory[offset:offset+VIDEO_ROW_SIZE], "big")
+
+                # Set the sprite collision detection flag
+                if video_row & sprite_row:
+                    self.register_V[0xF] = 1
+
+                # video memory writes are XORed in CHIP8
+                video_memory[offset:offset+VIDEO_ROW_SIZE] = (video_row ^ sprite_row).to_bytes(VIDEO_ROW_SIZE, "big")
+                self.video_dirty_rows |= 1 << (y+i)
         self.video_draw_flag = 1
             
-    # Open a game ROM file and load it on RAM location 0x200
-    def file_open(self, file_name):
-        try:
-            with open("roms/" + file_name, "rb") as f:
-                file_bytes = f.read()
-                for i in range(len(file_bytes)):
-                    self.system_memory[0x200+i] = int(file_bytes[i])
-        except:
-            print("WRONG FILE NAME, USE SYNTAX: python main.py <FILE>, <profile>")
-            print("EXAMPLE: python main.py INVADERS, normal")
-            
-            pygame.quit()
-            sys.exit()
+    # Open a game ROM file inside directory and load it on RAM location
+    # 0x200. Raises OSError if the file can't be read
+    def file_open(self, file_name, directory="roms"):
+        with open(os.path.join(directory, file_name), "rb") as f:
+            self.rom_load(f.read())
+
+    # Copy a ROM image on RAM location 0x200 with a single slice assignment.
+    # Raises ValueError if it doesn't fit in memory
+    def rom_load(self, rom):
+        if 0x200 + len(rom) > len(self.system_memory):
+            raise ValueError("ROM TOO LARGE: " + str(len(rom)) + " BYTES")
+        self.system_memory[0x200:0x200+len(rom)] = rom
+        self.memory_epoch += 1
 
     # CPU fetch–decode–execute cycle
     def cpu_cycle(self):
@@ -112,8 +180,7 @@ class CHIP8:
 
         # OOEO Clear the screen
         if instruction == 0x00E0:
-            self.video_memory = [0] * (64 * 32)
-            self.video_draw_flag = 1
+            self.video_clear()
 
         # 00EE Return from a subroutine
         elif instruction == 0x00EE:
@@ -153,10 +220,8 @@ class CHIP8:
         
         # 7XNN Add the value NN to register VX
         elif instruction & 0xF000 == 0x7000:
-            self.register_V[xx] += (instruction & 0x00FF)
-            
             # Truncate VX to 8 bits to ensure compatibility
-            self.register_V[xx] &= 0xFF
+            self.register_V[xx] = (self.register_V[xx] + (instruction & 0x00FF)) & 0xFF
         
         # Decode and Execute all opcodes starting with 0x8
         elif instruction & 0xF000 == 0x8000:
@@ -181,10 +246,8 @@ class CHIP8:
             # Set VF to 01 if a carry occurs
             # Set VF to 00 if a carry does not occur
             elif instruction & 0xF00F == 0x8004:
-                self.register_V[xx] += self.register_V[yy]
-
                 # Truncate VX to 8 bits to ensure compatibility
-                self.register_V[xx] &= 0xFF
+                self.register_V[xx] = (self.register_V[xx] + self.register_V[yy]) & 0xFF
 
                 if self.register_V[xx] > 0xFF:
                     self.register_V[0x0F] = 0x01
@@ -199,10 +262,9 @@ class CHIP8:
                     self.register_V[0x0F] = 0x00
                 elif self.register_V[xx] > self.register_V[yy]:
                     self.register_V[0x0F] = 0x01
-                self.register_V[xx] -= self.register_V[yy]
 
                 # Truncate VX to 8 bits to ensure compatibility
-                self.register_V[xx] &= 0xFF
+                self.register_V[xx] = (self.register_V[xx] - self.register_V[yy]) & 0xFF
                 
             # 8XY6 Store the value of register VY shifted right one bit in register
             # VX Set register VF to the least significant bit prior to the shift
@@ -221,23 +283,20 @@ class CHIP8:
                     self.register_V[0x0F] = 0x00
                 elif self.register_V[yy] > self.register_V[xx]:
                     self.register_V[0x0F] = 0x01
-                self.register_V[xx] = self.register_V[yy] - self.register_V[xx]
 
                 # Truncate VX to 8 bits to ensure compatibility
-                self.register_V[xx] &= 0xFF
+                self.register_V[xx] = (self.register_V[yy] - self.register_V[xx]) & 0xFF
                 
             # 8XYE	Store the value of register VY shifted left one bit in register
             # VX, Set register VF to the most significant bit prior to the shift
             elif instruction & 0xF00F == 0x800E:
+                # Truncate VX to 8 bits to ensure compatibility
                 if self.shift_VY == 1:
                     self.register_V[0x0F] = self.register_V[yy] & 0x80
-                    self.register_V[xx] = self.register_V[yy] << 1
+                    self.register_V[xx] = (self.register_V[yy] << 1) & 0xFF
                 else:
                     self.register_V[0x0F] = self.register_V[xx] & 0x80
-                    self.register_V[xx] = self.register_V[xx] << 1
-
-                # Truncate VX to 8 bits to ensure compatibility
-                self.register_V[xx] &= 0xFF
+                    self.register_V[xx] = (self.register_V[xx] << 1) & 0xFF
 
         # 9XY0 Skip the following instruction if the value of register VX is 
         # not equal to the value of register VY 
@@ -256,7 +315,7 @@ class CHIP8:
         # CXNN Set VX to a random number with a mask of NN
         elif instruction & 0xF000 == 0xC000:
             nn = instruction & 0x00FF
-            self.register_V[xx] = random.randrange(0, 255) & nn
+            self.register_V[xx] = self.rng.randrange(0, 255) & nn
         
         # DXYN Draw a sprite at position VX, VY with N bytes of sprite data 
         # starting at the address stored in I, Set VF to 01 if any set pixels
@@ -286,12 +345,11 @@ class CHIP8:
             
             # FX0A Wait for a keypress and store the result in register VX
             elif instruction & 0xF0FF == 0xF00A:
-                self.register_PC -= 2
-                for i in range(16):
-                    if self.keys_pressed[i] == 1:
-                        self.register_V[xx] = i
-                        self.register_PC += 2
-                        break     
+                key = self.keys_pressed.find(1)
+                if key >= 0:
+                    self.register_V[xx] = key
+                else:
+                    self.register_PC -= 2
             
             # FX15 Set the delay timer to the value of register VX
             elif instruction & 0xF0FF == 0xF015:
@@ -320,35 +378,103 @@ class CHIP8:
             # FX55 Store the values of registers V0 to VX inclusive in memory 
             # starting at address I. I is set to I + X + 1 after operation
             elif instruction & 0xF0FF == 0xF055:
-                for i in range(xx+1):
-                    self.system_memory[self.register_I+i] = self.register_V[i]
+                # A slice past the end of memory would resize it, so those
+                # stores go one by one up to the IndexError
+                if self.register_I + xx + 1 <= len(self.system_memory):
+                    self.system_memory[self.register_I:self.register_I+xx+1] = self.register_V[:xx+1]
+                else:
+                    for i in range(xx+1):
+                        self.system_memory[self.register_I+i] = self.register_V[i]
                 self.register_I += (xx + 1)
             
             # FX65 Fill registers V0 to VX inclusive with the values stored in 
             # memory starting at address I. I is set to I + X + 1 after operation
             elif instruction & 0xF0FF == 0xF065:
-                for i in range(xx+1):
-                    self.register_V[i] = self.system_memory[self.register_I+i]
+                # Like FX55, loads past the end of memory go one by one
+                if self.register_I + xx + 1 <= len(self.system_memory):
+                    self.register_V[:xx+1] = self.system_memory[self.register_I:self.register_I+xx+1]
+                else:
+                    for i in range(xx+1):
+                        self.register_V[i] = self.system_memory[self.register_I+i]
+                self.register_I += (xx + 1)
 
-                    # Truncate VX to 8 bits to ensure compatibility
-                    self.register_V[i] &= 0xFF
+        # Increment the PC register for the next cycle
+        self.register_PC += 2    
 
-                self.register_I += (xx + 1)
+    # Count down the delay and sound timer registers. It must be called once
+    # per 60 Hz frame. The tone plays during every frame the sound timer
+    # starts with a non zero value
+    def timers_tick(self):
+        if self.delay_timer > 0:
+            self.delay_timer -= 1
+    
+        playing = self.sound_timer > 0
+        if playing:
+            self.sound_timer -= 1
+        if self.audio is not None:
+            self.audio.update(playing)
 
-        # Count down the delay and sound timer registers every CPU cycle if at 
-        # least 1/60 seconds has elapsed since the last cycle. If the sound 
-        # timer isn't zero it generates a sound
-        self.cycle_end_time = time.time()   
+    # Returns a snapshot of the whole machine in the save state binary format
+    def save_state(self):
+        version, internal_state, gauss_next = self.rng.getstate()
+        return b"".join([
+            STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, self.register_PC,
+                              self.register_I, self.delay_timer,
+                              self.sound_timer, self.shift_VY, len(self.stack)),
+            bytes(self.register_V),
+            bytes(self.keys_pressed),
+            bytes(self.system_memory),
+            bytes(self.video_memory),
+            struct.pack("<%dH" % len(self.stack), *self.stack),
+            STATE_RNG.pack(*internal_state, gauss_next is not None,
+                           gauss_next or 0.0)
+        ])
 
-        if self.cycle_end_time - self.cycle_start_time >= 1/60:
-            if self.delay_timer > 0:
-                self.delay_timer -= 1
-        
-            if self.sound_timer > 0:
-                self.sound_timer -= 1
-                pygame.mixer.music.play()
-        
-            self.cycle_start_time = self.cycle_end_time
+    # Restore a snapshot created by save_state. The screen is flagged for a
+    # full redraw since it no longer matches the video memory. The state is
+    # checked whole before anything is restored, so a rejected one raises
+    # ValueError and leaves the machine untouched
+    def load_state(self, state):
+        if len(state) < STATE_HEADER.size:
+            raise ValueError("NOT A CHIP-8 SAVE STATE OR UNSUPPORTED VERSION")
+        (magic, version, register_PC, register_I, delay_timer, sound_timer,
+         shift_VY, stack_depth) = STATE_HEADER.unpack_from(state)
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise ValueError("NOT A CHIP-8 SAVE STATE OR UNSUPPORTED VERSION")
+        if len(state) != (STATE_HEADER.size + 32 + len(self.system_memory) +
+                          VIDEO_MEMORY_SIZE + 2 * stack_depth + STATE_RNG.size):
+            raise ValueError("CHIP-8 SAVE STATE OF THE WRONG SIZE")
 
-        # Increment the PC register for the next cycle
-        self.register_PC += 2    
+        state = memoryview(state)
+        offset = STATE_HEADER.size + 32 + len(self.system_memory) + VIDEO_MEMORY_SIZE
+        stack = array.array("H", struct.unpack_from("<%dH" % stack_depth, state, offset))
+        rng_state = STATE_RNG.unpack_from(state, offset + 2 * stack_depth)
+
+        # The generator state is checked on a scratch generator, setstate
+        # rejects an index or key words out of range
+        rng = random.Random()
+        try:
+            rng.setstate((3, rng_state[:625],
+                          rng_state[626] if rng_state[625] else None))
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError("CHIP-8 SAVE STATE WITH A CORRUPT RANDOM NUMBER GENERATOR")
+
+        self.register_PC = register_PC
+        self.register_I = register_I
+        self.delay_timer = delay_timer
+        self.sound_timer = sound_timer
+        self.shift_VY = shift_VY
+        offset = STATE_HEADER.size
+        self.register_V[:] = state[offset:offset+16]
+        offset += 16
+        self.keys_pressed[:] = state[offset:offset+16]
+        offset += 16
+        self.system_memory[:] = state[offset:offset+len(self.system_memory)]
+        offset += len(self.system_memory)
+        self.video_memory[:] = state[offset:offset+VIDEO_MEMORY_SIZE]
+        self.stack[:] = stack
+        self.rng.setstate(rng.getstate())
+
+        self.memory_epoch += 1
+        self.video_draw_flag = 1
+        self.video_dirty_rows = VIDEO_ROWS_ALL
@@ -0,0 +1,328 @@
+# This file contains the conformance harness. It runs every bundled ROM on
+# the reference interpreter, CHIP8.cpu_cycle, in lockstep with other engines
+# from the same seed and the same scripted key presses, comparing a hash of
+# the machine state every interval instructions. When an engine stops
+# matching, the interval is bisected down to the first instruction that
+# leaves the two machines different, which is reported with its opcode and
+# both states.
+
+import argparse
+import hashlib
+import json
+import random
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import audio
+import computer
+import engines
+import library
+
+# Engine every other one is compared against
+REFERENCE = "reference"
+
+# Registers hashed along with the memories and the stack
+STATE_REGISTERS = struct.Struct("<IIBB")
+
+# Returns a compact hash of the state of chip8. The random number generator
+# is left out, whatever it draws ends up in the registers
+def state_hash(chip8):
+    digest = hashlib.blake2b(chip8.system_memory, digest_size=8)
+    digest.update(chip8.video_memory)
+    digest.update(chip8.register_V)
+    digest.update(chip8.stack)
+    digest.update(STATE_REGISTERS.pack(chip8.register_PC, chip8.register_I,
+                                       chip8.delay_timer, chip8.sound_timer))
+    return digest.digest()
+
+# Returns a key script for frames frames, as a dictionary of the (key,
+# pressed) transitions of every frame that has some. Every frame presses a
+# random key with probability press_rate and holds it for 2 to 30 frames
+def script_create(frames, seed, press_rate=0.05):
+    rng = random.Random(seed)
+    script = {}
+    released = [0] * 16
+    for frame in range(frames):
+        if rng.random() < press_rate:
+            key = rng.randrange(16)
+            if released[key] <= frame:
+                released[key] = frame + rng.randrange(2, 31)
+                script.setdefault(frame, []).append((key, 1))
+                script.setdefault(released[key], []).append((key, 0))
+    return script
+
+# A CHIP8 instance run by an engine on a fixed frame model. Frame f runs
+# instructions f * cycles_per_frame to (f + 1) * cycles_per_frame - 1 with
+# the keys of the script applied before it and the timers ticked after it,
+# so the same script gives the same inputs to any engine no matter how its
+# runs are split
+class Machine:
+    def __init__(self, image, engine, seed, shift_VY, cycles_per_frame, script):
+        self.chip8 = computer.CHIP8(audio.NullAudio(), seed)
+        self.chip8.shift_VY = shift_VY
+        self.chip8.rom_load(image)
+        self.engine = engines.engine_create(engine, self.chip8)
+        self.cycles_per_frame = cycles_per_frame
+        self.script = script
+
+        # Instructions executed and the exception that stopped the machine
+        self.cycles = 0
+        self.exception = None
+
+    # Execute count instructions, or less when the ROM raises an exception,
+    # which is kept in exception
+    def advance(self, count):
+        chip8 = self.chip8
+        try:
+            while count > 0 and self.exception is None:
+                frame, offset = divmod(self.cycles, self.cycles_per_frame)
+                if offset == 0:
+                    for key, pressed in self.script.get(frame, ()):
+                        chip8.keys_pressed[key] = pressed
+                executed = min(count, self.cycles_per_frame - offset)
+                self.engine.run(executed)
+                self.cycles += executed
+                count -= executed
+                if offset + executed == self.cycles_per_frame:
+                    chip8.timers_tick()
+        except Exception as exception:
+            self.exception = exception
+
+    # Returns what two machines are compared on. Engines may word the same
+    # fault differently, so only the type of the exception counts
+    def outcome(self):
+        return state_hash(self.chip8), type(self.exception)
+
+    # Returns the exception that stopped the machine as text, None if it
+    # didn't stop
+    def crash(self):
+        if self.exception is None:
+            return None
+        return type(self.exception).__name__ + ": " + str(self.exception)
+
+    # Go back to a save state taken after cycles instructions
+    def restore(self, state, cycles):
+        self.chip8.load_state(state)
+        self.cycles = cycles
+        self.exception = None
+
+# Returns a dictionary with the registers of chip8
+def state_describe(chip8):
+    return {
+        "pc": format(chip8.register_PC, "04X"),
+        "register_I": format(chip8.register_I, "04X"),
+        "register_V": chip8.register_V.hex(" ").upper(),
+        "stack": [format(address, "04X") for address in chip8.stack],
+        "delay_timer": chip8.delay_timer,
+        "sound_timer": chip8.sound_timer
+    }
+
+# Returns the list of differences between the states of two machines
+def states_compare(reference, other):
+    differences = []
+    for name in ("register_PC", "register_I", "delay_timer", "sound_timer"):
+        if getattr(reference, name) != getattr(other, name):
+            differences.append(name + ": " + format(getattr(reference, name), "X") +
+                               " != " + format(getattr(other, name), "X"))
+    for i in range(16):
+        if reference.register_V[i] != other.register_V[i]:
+            differences.append("V" + format(i, "X") + ": " +
+                               format(reference.register_V[i], "02X") + " != " +
+                               format(other.register_V[i], "02X"))
+    if reference.stack != other.stack:
+        differences.append("stack: " + " ".join(format(a, "04X") for a in reference.stack) +
+                           " != " + " ".join(format(a, "04X") for a in other.stack))
+    for name, memory, stride in (("memory", "system_memory", 1),
+                                 ("video row", "video_memory", computer.VIDEO_ROW_SIZE)):
+        reference_memory = getattr(reference, memory)
+        other_memory = getattr(other, memory)
+        for offset in range(0, len(reference_memory), stride):
+            if reference_memory[offset:offset+stride] != other_memory[offset:offset+stride]:
+                differences.append(name + " " + format(offset // stride, "X") + ": " +
+                                   reference_memory[offset:offset+stride].hex().upper() +
+                                   " != " + other_memory[offset:offset+stride].hex().upper())
+    return differences
+
+# Find the first instruction after which the reference and engine differ,
+# knowing they matched after cycles instructions, saved as state, and
+# differed span instructions later. Both machines are rebuilt from state,
+# or from the start of the run when the difference doesn't show again from
+# it, since it may come from engine state a save state doesn't hold, like
+# cached blocks. Returns the divergence description
+def divergence_find(create, engine, state, cycles, span):
+    def machines_at(executed, from_start):
+        reference = create(REFERENCE)
+        other = create(engine)
+        for machine in (reference, other):
+            if from_start:
+                machine.advance(cycles)
+            else:
+                machine.restore(state, cycles)
+            machine.advance(executed)
+        return reference, other
+
+    from_start = False
+    reference, other = machines_at(span, False)
+    if reference.outcome() == other.outcome():
+        from_start = True
+
+    # The machines match after low instructions and differ after high
+    low, high = 0, span
+    while high - low > 1:
+        middle = (low + high) // 2
+        reference, other = machines_at(middle, from_start)
+        if reference.outcome() == other.outcome():
+            low = middle
+        else:
+            high = middle
+
+    # The states after high instructions come from runs split like the ones
+    # that differed, since an engine may only go wrong on some splits
+    chip8 = machines_at(low, from_start)[0].chip8
+    pc = chip8.register_PC
+    if 0 <= pc < len(chip8.system_memory) - 1:
+        instruction = format(chip8.system_memory[pc] << 8 | chip8.system_memory[pc+1], "04X")
+    else:
+        instruction = None
+    before = state_describe(chip8)
+    reference, other = machines_at(high, from_start)
+
+    return {
+        "engine": engine,
+        "cycle": cycles + low,
+        "pc": format(pc, "04X"),
+        "instruction": instruction,
+        "bisected_from_start": from_start,
+        "before": before,
+        "reference": state_describe(reference.chip8),
+        "reference_crash": reference.crash(),
+        "other": state_describe(other.chip8),
+        "other_crash": other.crash(),
+        "differences": states_compare(reference.chip8, other.chip8)
+    }
+
+# Run a single (file, shift_VY) job on the reference and every engine of
+# the job in lockstep. Top level function so the worker processes can
+# import it
+def job_run(job):
+    image = library.ROMLibrary("roms").image_get(job["file"])
+    cycles_per_frame = job["cycles_per_frame"]
+    script = script_create(-(-job["cycles"] // cycles_per_frame), job["seed"])
+
+    def create(engine):
+        return Machine(image, engine, job["seed"], job["shift_VY"], cycles_per_frame, script)
+
+    start_time = time.perf_counter()
+    reference = create(REFERENCE)
+    others = {engine: create(engine) for engine in job["engines"]}
+    divergences = []
+
+    # Save state and cycles of the last point every engine matched at
+    state = reference.chip8.save_state()
+    cycles = 0
+    while cycles < job["cycles"] and others:
+        span = min(job["interval"], job["cycles"] - cycles)
+        reference.advance(span)
+        expected = reference.outcome()
+        for engine, machine in list(others.items()):
+            machine.advance(span)
+            if machine.outcome() != expected:
+                divergences.append(divergence_find(create, engine, state, cycles, span))
+                del others[engine]
+        if reference.exception is not None:
+            break
+        cycles += span
+        state = reference.chip8.save_state()
+
+    return {
+        "file": job["file"],
+        "shift_VY": job["shift_VY"],
+        "seed": job["seed"],
+        "engines": job["engines"],
+        "cycles": reference.cycles,
+        "seconds": time.perf_counter() - start_time,
+        "crash": reference.crash(),
+        "divergences": divergences
+    }
+
+# Returns the jobs running every file in both shift modes
+def jobs_create(files, engine_names, cycles, interval, cycles_per_frame, seed):
+    return [{"file": file, "shift_VY": shift_VY, "engines": engine_names,
+             "cycles": cycles, "interval": interval,
+             "cycles_per_frame": cycles_per_frame, "seed": seed}
+            for file in files for shift_VY in (0, 1)]
+
+# Print the result of a job
+def result_print(result):
+    print(format(result["file"], "<10"), "SHIFT_VY:", result["shift_VY"],
+          "CYCLES:", format(result["cycles"], ">9"),
+          "SECONDS:", format(result["seconds"], ">6.1f"),
+          "DIVERGED" if result["divergences"] else "OK",
+          "" if result["crash"] is None else "(CRASH: " + result["crash"] + ")")
+    for divergence in result["divergences"]:
+        print("  ENGINE", divergence["engine"], "DIVERGES AT CYCLE", divergence["cycle"],
+              "PC", divergence["pc"], "INSTRUCTION", divergence["instruction"])
+        print("    BEFORE:   ", divergence["before"])
+        print("    REFERENCE:", divergence["reference"], divergence["reference_crash"] or "")
+        print("    ENGINE:   ", divergence["other"], divergence["other_crash"] or "")
+        for difference in divergence["differences"]:
+            print("    DIFFERENCE:", difference)
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that engines behave exactly like the reference interpreter")
+    parser.add_argument("files", nargs="*", help="ROMs to check, all by default")
+    parser.add_argument("--engine", action="append", dest="engines",
+                        choices=sorted(name for name in engines.engines if name != REFERENCE),
+                        help="engine to check, may be repeated, all by default")
+    parser.add_argument("--cycles", type=int, default=1000000,
+                        help="instructions executed per ROM and shift mode")
+    parser.add_argument("--interval", type=int, default=1000,
+                        help="instructions between state comparisons")
+    parser.add_argument("--cycles-per-frame", type=int, default=10,
+                        help="instructions executed per 60 Hz frame")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of CXNN and of the key script")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes, one per CPU by default")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    rom_library = library.ROMLibrary("roms")
+    files = args.files or sorted(rom_library.hashes)
+    for file in files:
+        if file not in rom_library.hashes:
+            parser.error("ROM NOT IN LIBRARY: " + file)
+    engine_names = args.engines or sorted(name for name in engines.engines if name != REFERENCE)
+    jobs = jobs_create(files, engine_names, args.cycles, args.interval,
+                       args.cycles_per_frame, args.seed)
+
+    start_time = time.perf_counter()
+    if args.processes == 1:
+        results = map(job_run, jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(args.processes)
+        results = executor.map(job_run, jobs)
+    diverged = 0
+    cycles = 0
+    report = []
+    for result in results:
+        result_print(result)
+        diverged += bool(result["divergences"])
+        cycles += result["cycles"]
+        report.append(result)
+    if executor is not None:
+        executor.shutdown()
+    elapsed = time.perf_counter() - start_time
+
+    print("RUNS:", len(report), "DIVERGED:", diverged, "CYCLES:", cycles,
+          "SECONDS:", format(elapsed, ".1f"))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if diverged:
+        sys.exit(1)
@@ -1,23 +1,19 @@
 # This module contains functions used for debugging the CPU & video
 
-# Generate a hexdump of the chip8's RAM
+# Generate a hexdump of the chip8's RAM, formatting 16 bytes per line at once
 def system_memory_dump(chip8):
-    for i in range(0, len(chip8.system_memory), 16):
-        print(format(i, '04X'),":", end=" ")
-        for j in range(8):
-            print(format(chip8.system_memory[i+j], '02X'), end=" ")
-        print(" ", end="")
-        for k in range(8,16):
-            print(format(chip8.system_memory[i+k], '02X'), end=" ")
-        print("")
-    print(len(chip8.system_memory), "bytes")
+    system_memory = chip8.system_memory
+    for i in range(0, len(system_memory), 16):
+        print(format(i, '04X'), ":", system_memory[i:i+8].hex(" ").upper(), "",
+              system_memory[i+8:i+16].hex(" ").upper())
+    print(len(system_memory), "bytes")
     print("\n")
 
 # Generate a bitmap dump of the chip8's video memory
 def video_memory_dump(chip8):
     for i in range(32):
         for j in range(64):
-            print(chip8.video_memory[i*64+j],end="")
+            print(chip8.video_pixel(j, i),end="")
         print("")
     print("\n")
 
@@ -50,6 +46,14 @@ def system_stack_dump(chip8):
         print(format(i,'04X'),end=" ")
     print("\n")
 
+# Print a dictionary of counters, like the engine's block cache hits and
+# misses or the renderer's frame times
+def stats_dump(title, stats):
+    print(title + ":")
+    for name, value in stats.items():
+        print(" ", name + ":", value)
+    print("\n")
+
 # Execute all debugging functions
 def dump(chip8):
     video_memory_dump(chip8)
@@ -0,0 +1,497 @@
+# This module contains an interactive debugger. It runs the CPU like
+# blocks.BlockEngine and stops on PC breakpoints, optionally guarded by a
+# condition on the registers, and on FX33 and FX55 writes into watched
+# memory ranges. Breakpoints are compiled into the block cache instead of
+# being checked on every instruction: the instruction at a breakpoint gets a
+# block of its own that tests the breakpoint before running it, while the
+# code around it keeps running from compiled blocks. With nothing set the
+# debugger runs the plain BlockEngine loop.
+
+import argparse
+import signal
+
+import audio
+import blocks
+import computer
+import debug
+import dispatch
+import headless
+import library
+
+# Frames per second of the CHIP-8 timers, like scheduler.FRAME_RATE
+FRAME_RATE = 60
+
+# Raised inside a run to stop it. executed tells whether the instruction
+# that stopped the run already executed, which is the case of writes into
+# a watched range
+class DebuggerStop(Exception):
+    def __init__(self, stop, executed):
+        super().__init__(stop["reason"])
+        self.stop = stop
+        self.executed = executed
+
+# Returns a dictionary describing a stop of chip8 on the instruction at pc
+def stop_describe(chip8, reason, pc):
+    instruction = chip8.system_memory[pc] << 8 | chip8.system_memory[pc+1]
+    return {
+        "reason": reason,
+        "pc": pc,
+        "instruction": format(instruction, "04X")
+    }
+
+# Runs the CPU from the block cache and stops on breakpoints and
+# watchpoints. A run that stops leaves the machine between two instructions,
+# with the description of the stop in "stop" and the instructions it didn't
+# execute in "cycles_left". Running again from a breakpoint executes its
+# instruction instead of stopping on it once more
+class Debugger(blocks.BlockEngine):
+    def __init__(self, chip8):
+        super().__init__(chip8)
+
+        # Breakpoints keyed by address. Conditional ones hold the source of
+        # the condition and its code object, the others None
+        self.breakpoints = {}
+
+        # Watched memory ranges as (start, end) pairs, end excluded
+        self.watchpoints = []
+
+        # Address of the breakpoint the next run starts from without stopping
+        self.resume_address = None
+
+        # Why the last run stopped, None if it ran to the end
+        self.stop = None
+        self.cycles_left = 0
+
+        # Counters
+        self.breaks = 0
+        self.watches = 0
+
+        self.run_select()
+
+    # Bind run to the plain BlockEngine loop while there are no breakpoints
+    # and watchpoints, and to run_stopping otherwise, so the debugger costs
+    # nothing until something is set
+    def run_select(self):
+        if self.breakpoints or self.watchpoints:
+            self.run = self.run_stopping
+        else:
+            self.run = super().run
+            self.stop = None
+            self.cycles_left = 0
+
+    # Stop before executing the instruction at address. condition is a
+    # Python expression over V, I, DT, ST and keys, like "V[3] == 0x10",
+    # and the breakpoint only stops when it's true
+    def break_set(self, address, condition=None):
+        if not 0 <= address < len(self.chip8.system_memory) - 1:
+            raise ValueError("BREAKPOINT OUTSIDE OF SYSTEM MEMORY: " + format(address, "04X"))
+        if condition is None:
+            self.breakpoints[address] = None
+        else:
+            self.breakpoints[address] = (condition, compile(condition, "<condition>", "eval"))
+        self.block_starts.add(address)
+        self.invalidate(address, address + 2)
+        self.run_select()
+
+    # Remove the breakpoint at address
+    def break_clear(self, address):
+        if address not in self.breakpoints:
+            raise KeyError("NO BREAKPOINT AT " + format(address, "04X"))
+        del self.breakpoints[address]
+        self.block_starts.discard(address)
+        self.invalidate(address, address + 2)
+        self.run_select()
+
+    # Stop after FX33 or FX55 write into memory addresses start to end - 1
+    def watch_set(self, start, end):
+        if not 0 <= start < end <= len(self.chip8.system_memory):
+            raise ValueError("WATCHPOINT OUTSIDE OF SYSTEM MEMORY: " +
+                             format(start, "04X") + "-" + format(end, "04X"))
+        if not self.watchpoints:
+            self.writes_invalidate()
+        self.watchpoints.append((start, end))
+        self.run_select()
+
+    # Remove the watchpoint on start to end - 1
+    def watch_clear(self, start, end):
+        if (start, end) not in self.watchpoints:
+            raise KeyError("NO WATCHPOINT ON " + format(start, "04X") + "-" + format(end, "04X"))
+        self.watchpoints.remove((start, end))
+        if not self.watchpoints:
+            self.writes_invalidate()
+        self.run_select()
+
+    # Drop every cached block holding FX33 or FX55, so they are decoded
+    # again with or without the watchpoint checks
+    def writes_invalidate(self):
+        for block in list(self.blocks.values()):
+            for pc, (function, instruction) in zip(block[3], block[2]):
+                handler = dispatch.instruction_handlers[instruction]
+                if handler is dispatch.op_fx33 or handler is dispatch.op_fx55:
+                    self.invalidate(pc, pc + 2)
+
+    # Returns the (handler, instruction) pair run for instruction. Writes
+    # check the watchpoints only while there are some
+    def op_get(self, instruction):
+        if self.watchpoints:
+            handler = dispatch.instruction_handlers[instruction]
+            if handler is dispatch.op_fx33:
+                return (self.op_fx33_watched, instruction)
+            elif handler is dispatch.op_fx55:
+                return (self.op_fx55_watched, instruction)
+        return super().op_get(instruction)
+
+    # Decode the block starting at address. A breakpoint gets a block of
+    # its own, a single instruction run through op_break
+    def block_translate(self, address):
+        if address not in self.breakpoints:
+            return super().block_translate(address)
+        self.misses += 1
+        system_memory = self.chip8.system_memory
+        instruction = system_memory[address] << 8 | system_memory[address+1]
+        return self.block_add(address, [None, 1, [(self.op_break, instruction)],
+                                        [address], 0, None])
+
+    # Imported blocks may run through breakpoints set before the import
+    def program_import(self, program):
+        super().program_import(program)
+        for address in self.breakpoints:
+            self.invalidate(address, address + 2)
+
+    # Execute count instructions, or less if a breakpoint or a watchpoint
+    # stops the run
+    def run_stopping(self, count):
+        chip8 = self.chip8
+        self.stop = None
+        self.cycles_left = 0
+        if self.resume_address != chip8.register_PC:
+            self.resume_address = None
+
+        # Same loop as BlockEngine.run, keeping the length of the running
+        # block to count the instructions a stop left unexecuted
+        if chip8.memory_epoch != self.memory_epoch:
+            self.clear()
+        cache = self.blocks
+        length = 0
+        try:
+            while count > 0:
+                block = cache.get(chip8.register_PC)
+                if block is None:
+                    block = self.block_translate(chip8.register_PC)
+                else:
+                    self.hits += 1
+
+                function = block[0]
+                if function is not None and block[1] <= count:
+                    length = block[1]
+                    function(chip8)
+                elif block[1] == 1:
+                    length = 1
+                    handler, instruction = block[2][0]
+                    handler(chip8, instruction)
+                    chip8.register_PC += 2
+                else:
+                    ops = block[2]
+                    if len(ops) > count:
+                        ops = ops[:count]
+                    length = len(ops)
+                    for handler, instruction in ops:
+                        handler(chip8, instruction)
+                        chip8.register_PC += 2
+
+                    block[4] += 1
+                    if block[4] == blocks.BLOCK_HOT_RUNS and block[1] > 1:
+                        source, namespace = self.block_source(block[2], block[3])
+                        block[5] = compile(source, "<block>", "exec")
+                        exec(block[5], namespace)
+                        block[0] = namespace["block"]
+                count -= length
+        except DebuggerStop as exception:
+            # Writes are the last instruction of their block, so a watchpoint
+            # stops the run right after the whole block executed
+            if exception.executed:
+                count -= length
+            else:
+                self.resume_address = chip8.register_PC
+            self.stop = exception.stop
+            self.cycles_left = count
+
+    # Execute the instruction at the PC, even if it has a breakpoint
+    def step(self):
+        self.resume_address = self.chip8.register_PC
+        self.run(1)
+
+    # Test the breakpoint of the PC and run the instruction when it doesn't
+    # stop
+    def op_break(self, chip8, instruction):
+        pc = chip8.register_PC
+        if pc == self.resume_address:
+            self.resume_address = None
+        else:
+            condition = self.breakpoints[pc]
+            if condition is None or eval(condition[1], {"__builtins__": {}}, {
+                    "V": chip8.register_V, "I": chip8.register_I,
+                    "DT": chip8.delay_timer, "ST": chip8.sound_timer,
+                    "keys": chip8.keys_pressed}):
+                self.breaks += 1
+                stop = stop_describe(chip8, "breakpoint", pc)
+                stop["condition"] = None if condition is None else condition[0]
+                raise DebuggerStop(stop, False)
+        handler, instruction = self.op_get(instruction)
+        handler(chip8, instruction)
+
+    # FX33 followed by the watchpoint check of the 3 written bytes
+    def op_fx33_watched(self, chip8, instruction):
+        start = chip8.register_I
+        previous = bytes(chip8.system_memory[start:start+3])
+        self.op_fx33(chip8, instruction)
+        self.watch_check(chip8, start, previous)
+
+    # FX55 followed by the watchpoint check of the V0 to VX written bytes
+    def op_fx55_watched(self, chip8, instruction):
+        start = chip8.register_I
+        previous = bytes(chip8.system_memory[start:start+((instruction & 0x0F00) >> 8)+1])
+        self.op_fx55(chip8, instruction)
+        self.watch_check(chip8, start, previous)
+
+    # Stop after the write at the PC when it touched a watched range. previous
+    # holds the bytes written from start as they were before the write
+    def watch_check(self, chip8, start, previous):
+        end = start + len(previous)
+        for watch_start, watch_end in self.watchpoints:
+            if start < watch_end and watch_start < end:
+                self.watches += 1
+                stop = stop_describe(chip8, "watchpoint", chip8.register_PC)
+                stop["watchpoint"] = (watch_start, watch_end)
+                stop["address"] = start
+                stop["previous"] = previous.hex(" ").upper()
+                stop["written"] = chip8.system_memory[start:end].hex(" ").upper()
+                chip8.register_PC += 2
+                raise DebuggerStop(stop, True)
+
+    # Engine specific counters
+    def stats(self):
+        stats = super().stats()
+        stats["breakpoints"] = len(self.breakpoints)
+        stats["watchpoints"] = len(self.watchpoints)
+        stats["breaks"] = self.breaks
+        stats["watches"] = self.watches
+        return stats
+
+# Returns a line with the registers of chip8
+def registers_format(chip8):
+    return ("PC:" + format(chip8.register_PC, "04X") +
+            " I:" + format(chip8.register_I, "04X") +
+            " V:" + chip8.register_V.hex(" ").upper() +
+            " DT:" + format(chip8.delay_timer, "02X") +
+            " ST:" + format(chip8.sound_timer, "02X") +
+            " SP:" + str(len(chip8.stack)))
+
+# Returns a line describing a stop of the debugger
+def stop_format(stop):
+    if stop["reason"] == "breakpoint":
+        line = "BREAKPOINT AT " + format(stop["pc"], "04X") + ": " + stop["instruction"]
+        if stop["condition"] is not None:
+            line += " IF " + stop["condition"]
+        return line
+    start, end = stop["watchpoint"]
+    return ("WATCHPOINT " + format(start, "04X") + "-" + format(end, "04X") +
+            " WRITTEN AT " + format(stop["pc"], "04X") + ": " + stop["instruction"] +
+            ", " + format(stop["address"], "04X") + ": " + stop["previous"] +
+            " -> " + stop["written"])
+
+# Interactive commands, by their full name and shortcut
+COMMANDS = """COMMANDS:
+  break ADDRESS [CONDITION]  b   stop at ADDRESS, when CONDITION is true
+  delete ADDRESS             d   remove the breakpoint at ADDRESS
+  watch START [END]          w   stop after FX33/FX55 write into START to END - 1
+  unwatch START [END]        u   remove a watchpoint
+  step [COUNT]               s   execute COUNT instructions
+  continue [FRAMES]          c   run until a stop, or for FRAMES frames
+  registers                  r   show the registers and the stack
+  memory ADDRESS [LENGTH]    m   show LENGTH bytes of memory from ADDRESS
+  video                      v   show the video memory
+  list                       l   show the breakpoints and watchpoints
+  key KEY 1|0                k   press or release a hex key
+  quit                       q   exit the debugger
+Addresses are hexadecimal. Conditions are Python expressions over V, I, DT,
+ST and keys, like V[0xA] == 3 and I > 0x300"""
+
+# A debugging session of a ROM. Instructions run frame by frame and the
+# timers tick at the end of every frame, like in scheduler.FrameScheduler,
+# wherever the debugger stops in between
+class Console:
+    def __init__(self, chip8, instructions_per_second):
+        self.chip8 = chip8
+        self.debugger = Debugger(chip8)
+        self.instructions_per_second = instructions_per_second
+
+        # Counters and the instructions left to run in the current frame
+        self.frames = 0
+        self.cycles = 0
+        self.frame_left = self.frame_cycles()
+
+        # Set by Ctrl+C to stop continuing at the end of the frame
+        self.interrupted = False
+
+    # Instructions to execute on the current frame
+    def frame_cycles(self):
+        ips = self.instructions_per_second
+        return ((self.frames + 1) * ips // FRAME_RATE) - (self.frames * ips // FRAME_RATE)
+
+    # Count executed instructions, ending the frame when none are left
+    def cycles_count(self, executed):
+        self.cycles += executed
+        self.frame_left -= executed
+        if self.frame_left == 0:
+            self.chip8.timers_tick()
+            self.frames += 1
+            self.frame_left = self.frame_cycles()
+
+    # Run the rest of the current frame, or a single instruction when
+    # stepping. Returns the stop of the debugger, if any. A crash is printed
+    # and returned as a stop
+    def execute(self, step=False):
+        debugger = self.debugger
+        budget = 1 if step else self.frame_left
+        try:
+            if step:
+                debugger.step()
+            else:
+                debugger.run(budget)
+        except Exception as exception:
+            crash = headless.crash_describe(self.chip8, exception)
+            print("CRASH:", crash["reason"], "AT", format(crash["pc"], "04X"),
+                  "(" + crash["exception"] + ")")
+            return crash
+        self.cycles_count(budget - debugger.cycles_left)
+        if debugger.stop is not None:
+            print(stop_format(debugger.stop))
+        return debugger.stop
+
+    # Execute count instructions, stopping early on watchpoints
+    def step(self, count):
+        for _ in range(count):
+            if self.execute(True) is not None:
+                break
+        print(registers_format(self.chip8))
+
+    # Run until a stop, Ctrl+C or the end of frames frames
+    def resume(self, frames=None):
+        end = None if frames is None else self.frames + frames
+        self.interrupted = False
+        handler = signal.signal(signal.SIGINT, self.interrupt)
+        try:
+            while end is None or self.frames < end:
+                if self.execute() is not None or self.interrupted:
+                    break
+        finally:
+            signal.signal(signal.SIGINT, handler)
+        print("FRAME:", self.frames, "CYCLES:", self.cycles)
+        print(registers_format(self.chip8))
+
+    # SIGINT handler of resume()
+    def interrupt(self, signal_number, frame):
+        self.interrupted = True
+
+    # Print memory addresses start to start + length - 1, 16 bytes per line
+    def memory_print(self, start, length):
+        system_memory = self.chip8.system_memory
+        end = min(start + length, len(system_memory))
+        for address in range(start, end, 16):
+            print(format(address, "04X"), ":",
+                  system_memory[address:min(address+16, end)].hex(" ").upper())
+
+    # Print the breakpoints and watchpoints
+    def points_print(self):
+        for address, condition in sorted(self.debugger.breakpoints.items()):
+            if condition is None:
+                print("BREAKPOINT", format(address, "04X"))
+            else:
+                print("BREAKPOINT", format(address, "04X"), "IF", condition[0])
+        for start, end in self.debugger.watchpoints:
+            print("WATCHPOINT", format(start, "04X") + "-" + format(end, "04X"))
+
+    # Execute a command line. Returns False when the session should end
+    def command_run(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command, arguments = words[0].lower(), words[1:]
+        debugger = self.debugger
+        if command in ("break", "b") and arguments:
+            condition = " ".join(arguments[1:]) or None
+            debugger.break_set(int(arguments[0], 16), condition)
+        elif command in ("delete", "d") and len(arguments) == 1:
+            debugger.break_clear(int(arguments[0], 16))
+        elif command in ("watch", "w", "unwatch", "u") and 1 <= len(arguments) <= 2:
+            start = int(arguments[0], 16)
+            end = int(arguments[1], 16) if len(arguments) == 2 else start + 1
+            if command in ("watch", "w"):
+                debugger.watch_set(start, end)
+            else:
+                debugger.watch_clear(start, end)
+        elif command in ("step", "s") and len(arguments) <= 1:
+            self.step(int(arguments[0]) if arguments else 1)
+        elif command in ("continue", "c") and len(arguments) <= 1:
+            self.resume(int(arguments[0]) if arguments else None)
+        elif command in ("registers", "r") and not arguments:
+            print(registers_format(self.chip8))
+            debug.system_stack_dump(self.chip8)
+        elif command in ("memory", "m") and 1 <= len(arguments) <= 2:
+            self.memory_print(int(arguments[0], 16),
+                              int(arguments[1], 16) if len(arguments) == 2 else 0x40)
+        elif command in ("video", "v") and not arguments:
+            debug.video_memory_dump(self.chip8)
+        elif command in ("list", "l") and not arguments:
+            self.points_print()
+        elif command in ("key", "k") and len(arguments) == 2:
+            self.chip8.keys_pressed[int(arguments[0], 16) & 0xF] = int(arguments[1] != "0")
+        elif command in ("quit", "q"):
+            return False
+        else:
+            print(COMMANDS)
+        return True
+
+    # Read and execute commands until quit or the end of the input
+    def loop(self):
+        print(registers_format(self.chip8))
+        while True:
+            try:
+                line = input("(chip8) ")
+            except EOFError:
+                break
+            try:
+                if not self.command_run(line):
+                    break
+            except KeyError as exception:
+                print(exception.args[0])
+            except (ValueError, SyntaxError) as exception:
+                print("WRONG COMMAND:", exception)
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Debug a CHIP-8 ROM from the command line")
+    parser.add_argument("file", help="ROM name inside the roms directory")
+    parser.add_argument("--ips", type=int, default=600,
+                        help="instructions executed per second of emulated time")
+    parser.add_argument("--shift-vy", action="store_true",
+                        help="shift VY instead of VX in 8XY6 and 8XYE")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the CXNN random number generator")
+    parser.add_argument("--break", dest="breakpoints", action="append", default=[],
+                        metavar="ADDRESS", help="hexadecimal address to stop at, "
+                                                "may be repeated")
+    args = parser.parse_args()
+
+    chip8 = computer.CHIP8(audio.NullAudio(), args.seed)
+    chip8.shift_VY = int(args.shift_vy)
+    try:
+        library.ROMLibrary("roms").chip8_load(chip8, args.file)
+    except KeyError as exception:
+        parser.error(exception.args[0])
+    console = Console(chip8, args.ips)
+    for address in args.breakpoints:
+        console.debugger.break_set(int(address, 16))
+    console.loop()
@@ -0,0 +1,323 @@
+# This module contains a table driven implementation of the CHIP-8 CPU.
+# Instructions are decoded by their high nibble, and by a sub-nibble for the
+# 0___, 8XY_, EX__ and FX__ groups, through handler tables instead of the
+# if/elif chain used by CHIP8.cpu_cycle. Every handler reproduces the exact
+# behaviour of its cpu_cycle counterpart, quirks included.
+
+# Unknown or unsupported instructions are ignored like in CHIP8.cpu_cycle
+def op_nop(chip8, instruction):
+    pass
+
+# OOEO Clear the screen
+def op_00e0(chip8, instruction):
+    chip8.video_clear()
+
+# 00EE Return from a subroutine
+def op_00ee(chip8, instruction):
+    chip8.register_PC = chip8.stack.pop()
+
+# 1NNN Jump to address NNN
+def op_1nnn(chip8, instruction):
+    # The -2 is to account for the +2 add the end of the cycle
+    chip8.register_PC = (instruction & 0x0FFF) - 2
+
+# 2NNN Execute subroutine starting at address NNN
+def op_2nnn(chip8, instruction):
+    chip8.stack.append(chip8.register_PC)
+    chip8.register_PC = (instruction & 0x0FFF) - 2
+
+# 3XNN Skip the following instruction if the value of register VX equals NN
+def op_3xnn(chip8, instruction):
+    if chip8.register_V[(instruction & 0x0F00) >> 8] == (instruction & 0x00FF):
+        chip8.register_PC += 2
+
+# 4XNN Skip the following instruction if the value of register VX is not
+# equal to NN
+def op_4xnn(chip8, instruction):
+    if chip8.register_V[(instruction & 0x0F00) >> 8] != (instruction & 0x00FF):
+        chip8.register_PC += 2
+
+# 5XY0 Skip the following instruction if the value of register VX is equal to
+# the value of register VY
+def op_5xy0(chip8, instruction):
+    register_V = chip8.register_V
+    if register_V[(instruction & 0x0F00) >> 8] == register_V[(instruction & 0x00F0) >> 4]:
+        chip8.register_PC += 2
+
+# 6XNN Store number NN in register VX
+def op_6xnn(chip8, instruction):
+    chip8.register_V[(instruction & 0x0F00) >> 8] = instruction & 0x00FF
+
+# 7XNN Add the value NN to register VX, truncated to 8 bits
+def op_7xnn(chip8, instruction):
+    xx = (instruction & 0x0F00) >> 8
+    chip8.register_V[xx] = (chip8.register_V[xx] + (instruction & 0x00FF)) & 0xFF
+
+# 8XY0 Store the value of register VY in register VX
+def op_8xy0(chip8, instruction):
+    register_V = chip8.register_V
+    register_V[(instruction & 0x0F00) >> 8] = register_V[(instruction & 0x00F0) >> 4]
+
+# 8XY1 Set VX to VX OR VY
+def op_8xy1(chip8, instruction):
+    register_V = chip8.register_V
+    register_V[(instruction & 0x0F00) >> 8] |= register_V[(instruction & 0x00F0) >> 4]
+
+# 8XY2 Set VX to VX AND VY
+def op_8xy2(chip8, instruction):
+    register_V = chip8.register_V
+    register_V[(instruction & 0x0F00) >> 8] &= register_V[(instruction & 0x00F0) >> 4]
+
+# 8XY3 Set VX to VX XOR VY
+def op_8xy3(chip8, instruction):
+    register_V = chip8.register_V
+    register_V[(instruction & 0x0F00) >> 8] ^= register_V[(instruction & 0x00F0) >> 4]
+
+# 8XY4 Add the value of register VY to register VX. VX is truncated to 8 bits
+# before the carry test, so like in CHIP8.cpu_cycle VF always ends up as 00
+def op_8xy4(chip8, instruction):
+    register_V = chip8.register_V
+    xx = (instruction & 0x0F00) >> 8
+    register_V[xx] = (register_V[xx] + register_V[(instruction & 0x00F0) >> 4]) & 0xFF
+    register_V[0x0F] = 0x00
+
+# 8XY5 Subtract the value of register VY from register VX
+# Set VF to 00 if a borrow occurs (VX < VY)
+# Set VF to 01 if a borrow does not occur (VX > VY)
+def op_8xy5(chip8, instruction):
+    register_V = chip8.register_V
+    xx = (instruction & 0x0F00) >> 8
+    yy = (instruction & 0x00F0) >> 4
+    if register_V[xx] < register_V[yy]:
+        register_V[0x0F] = 0x00
+    elif register_V[xx] > register_V[yy]:
+        register_V[0x0F] = 0x01
+    register_V[xx] = (register_V[xx] - register_V[yy]) & 0xFF
+
+# 8XY6 Store the value of register VY (or VX if shift_VY is off) shifted right
+# one bit in register VX. Set register VF to the least significant bit prior
+# to the shift
+def op_8xy6(chip8, instruction):
+    register_V = chip8.register_V
+    xx = (instruction & 0x0F00) >> 8
+    if chip8.shift_VY == 1:
+        yy = (instruction & 0x00F0) >> 4
+        register_V[0x0F] = register_V[yy] & 0x01
+        register_V[xx] = register_V[yy] >> 1
+    else:
+        register_V[0x0F] = register_V[xx] & 0x01
+        register_V[xx] = register_V[xx] >> 1
+
+# 8XY7 Set register VX to the value of VY minus VX. Set VF to 00 if a borrow
+# occurs. Set VF to 01 if a borrow does not occur
+def op_8xy7(chip8, instruction):
+    register_V = chip8.register_V
+    xx = (instruction & 0x0F00) >> 8
+    yy = (instruction & 0x00F0) >> 4
+    if register_V[yy] < register_V[xx]:
+        register_V[0x0F] = 0x00
+    elif register_V[yy] > register_V[xx]:
+        register_V[0x0F] = 0x01
+    register_V[xx] = (register_V[yy] - register_V[xx]) & 0xFF
+
+# 8XYE Store the value of register VY (or VX if shift_VY is off) shifted left
+# one bit in register VX. Set register VF to the most significant bit prior to
+# the shift
+def op_8xye(chip8, instruction):
+    register_V = chip8.register_V
+    xx = (instruction & 0x0F00) >> 8
+    if chip8.shift_VY == 1:
+        yy = (instruction & 0x00F0) >> 4
+        register_V[0x0F] = register_V[yy] & 0x80
+        register_V[xx] = (register_V[yy] << 1) & 0xFF
+    else:
+        register_V[0x0F] = register_V[xx] & 0x80
+        register_V[xx] = (register_V[xx] << 1) & 0xFF
+
+# 9XY0 Skip the following instruction if the value of register VX is not
+# equal to the value of register VY
+def op_9xy0(chip8, instruction):
+    register_V = chip8.register_V
+    if register_V[(instruction & 0x0F00) >> 8] != register_V[(instruction & 0x00F0) >> 4]:
+        chip8.register_PC += 2
+
+# ANNN Store memory address NNN in register I
+def op_annn(chip8, instruction):
+    chip8.register_I = instruction & 0x0FFF
+
+# BNNN Jump to address NNN + V0
+def op_bnnn(chip8, instruction):
+    chip8.register_PC = ((instruction & 0x0FFF) + chip8.register_V[0]) - 2
+
+# CXNN Set VX to a random number with a mask of NN
+def op_cxnn(chip8, instruction):
+    chip8.register_V[(instruction & 0x0F00) >> 8] = chip8.rng.randrange(0, 255) & (instruction & 0x00FF)
+
+# DXYN Draw a sprite at position VX, VY with N bytes of sprite data starting
+# at the address stored in I
+def op_dxyn(chip8, instruction):
+    register_V = chip8.register_V
+    chip8.dxyn(register_V[(instruction & 0x0F00) >> 8],
+               register_V[(instruction & 0x00F0) >> 4], instruction & 0x000F)
+
+# EX9E Skip the following instruction if the key corresponding to the hex
+# value currently stored in register VX is pressed
+def op_ex9e(chip8, instruction):
+    if chip8.keys_pressed[chip8.register_V[(instruction & 0x0F00) >> 8]] == 1:
+        chip8.register_PC += 2
+
+# EXA1 Skip the following instruction if the key corresponding to the hex
+# value currently stored in register VX is not pressed
+def op_exa1(chip8, instruction):
+    if chip8.keys_pressed[chip8.register_V[(instruction & 0x0F00) >> 8]] == 0:
+        chip8.register_PC += 2
+
+# FX07 Store the current value of the delay timer in register VX
+def op_fx07(chip8, instruction):
+    chip8.register_V[(instruction & 0x0F00) >> 8] = chip8.delay_timer
+
+# FX0A Wait for a keypress and store the result in register VX
+def op_fx0a(chip8, instruction):
+    key = chip8.keys_pressed.find(1)
+    if key >= 0:
+        chip8.register_V[(instruction & 0x0F00) >> 8] = key
+    else:
+        chip8.register_PC -= 2
+
+# FX15 Set the delay timer to the value of register VX
+def op_fx15(chip8, instruction):
+    chip8.delay_timer = chip8.register_V[(instruction & 0x0F00) >> 8]
+
+# FX18 Set the sound timer to the value of register VX
+def op_fx18(chip8, instruction):
+    chip8.sound_timer = chip8.register_V[(instruction & 0x0F00) >> 8]
+
+# FX1E Add the value stored in register VX to register I
+def op_fx1e(chip8, instruction):
+    chip8.register_I += chip8.register_V[(instruction & 0x0F00) >> 8]
+
+# FX29 Set I to the memory address of the sprite data corresponding to the
+# hexadecimal digit stored in register VX
+def op_fx29(chip8, instruction):
+    chip8.register_I = chip8.register_V[(instruction & 0x0F00) >> 8] * 5
+
+# FX33 Store the binary-coded decimal equivalent of the value stored in
+# register VX at addresses I, I+1, and I+2
+def op_fx33(chip8, instruction):
+    value = chip8.register_V[(instruction & 0x0F00) >> 8]
+    system_memory = chip8.system_memory
+    register_I = chip8.register_I
+    system_memory[register_I] = value // 100
+    system_memory[register_I+1] = (value % 100) // 10
+    system_memory[register_I+2] = value % 10
+
+# FX55 Store the values of registers V0 to VX inclusive in memory starting at
+# address I. I is set to I + X + 1 after operation. A slice past the end of
+# memory would resize it, so those stores go one by one up to the IndexError
+def op_fx55(chip8, instruction):
+    xx = (instruction & 0x0F00) >> 8
+    system_memory = chip8.system_memory
+    register_V = chip8.register_V
+    register_I = chip8.register_I
+    if register_I + xx + 1 <= len(system_memory):
+        system_memory[register_I:register_I+xx+1] = register_V[:xx+1]
+    else:
+        for i in range(xx+1):
+            system_memory[register_I+i] = register_V[i]
+    chip8.register_I += (xx + 1)
+
+# FX65 Fill registers V0 to VX inclusive with the values stored in memory
+# starting at address I. I is set to I + X + 1 after operation. Like FX55,
+# loads past the end of memory go one by one
+def op_fx65(chip8, instruction):
+    xx = (instruction & 0x0F00) >> 8
+    system_memory = chip8.system_memory
+    register_V = chip8.register_V
+    register_I = chip8.register_I
+    if register_I + xx + 1 <= len(system_memory):
+        register_V[:xx+1] = system_memory[register_I:register_I+xx+1]
+    else:
+        for i in range(xx+1):
+            register_V[i] = system_memory[register_I+i]
+    chip8.register_I += (xx + 1)
+
+# Handler tables. Opcodes are indexed by their high nibble, the FX__ and EX__
+# groups by their low byte, the 8XY_ group by its low nibble and the 0___ group
+# by the full instruction. Grouped entries are None in the high nibble table
+handlers = [None, op_1nnn, op_2nnn, op_3xnn, op_4xnn, op_5xy0, op_6xnn,
+            op_7xnn, None, op_9xy0, op_annn, op_bnnn, op_cxnn, op_dxyn,
+            None, None]
+
+handlers_0 = {0x00E0: op_00e0, 0x00EE: op_00ee}
+
+handlers_8 = [op_8xy0, op_8xy1, op_8xy2, op_8xy3, op_8xy4, op_8xy5, op_8xy6,
+              op_8xy7, op_nop, op_nop, op_nop, op_nop, op_nop, op_nop,
+              op_8xye, op_nop]
+
+handlers_E = [op_nop] * 256
+handlers_E[0x9E] = op_ex9e
+handlers_E[0xA1] = op_exa1
+
+handlers_F = [op_nop] * 256
+handlers_F[0x07] = op_fx07
+handlers_F[0x0A] = op_fx0a
+handlers_F[0x15] = op_fx15
+handlers_F[0x18] = op_fx18
+handlers_F[0x1E] = op_fx1e
+handlers_F[0x29] = op_fx29
+handlers_F[0x33] = op_fx33
+handlers_F[0x55] = op_fx55
+handlers_F[0x65] = op_fx65
+
+# Decode an instruction into its handler using the high nibble and, for the
+# grouped opcodes, the sub-nibble tables above
+def handler_get(instruction):
+    nibble = instruction >> 12
+    if nibble == 0x0:
+        return handlers_0.get(instruction, op_nop)
+    elif nibble == 0x8:
+        return handlers_8[instruction & 0x000F]
+    elif nibble == 0xE:
+        return handlers_E[instruction & 0x00FF]
+    elif nibble == 0xF:
+        return handlers_F[instruction & 0x00FF]
+    return handlers[nibble]
+
+# The tables are flattened once into a 64K entry table indexed by the whole
+# instruction, so the hot loop resolves any opcode with a single lookup
+instruction_handlers = [handler_get(instruction) for instruction in range(0x10000)]
+
+# Runs the CPU using the original if/elif interpreter in CHIP8.cpu_cycle
+class ReferenceEngine:
+    def __init__(self, chip8):
+        self.chip8 = chip8
+
+    # Execute count instructions
+    def run(self, count):
+        cpu_cycle = self.chip8.cpu_cycle
+        for _ in range(count):
+            cpu_cycle()
+
+    # Engine specific counters
+    def stats(self):
+        return {}
+
+# Runs the CPU using the handler tables
+class TableEngine:
+    def __init__(self, chip8):
+        self.chip8 = chip8
+
+    # Execute count instructions
+    def run(self, count):
+        chip8 = self.chip8
+        system_memory = chip8.system_memory
+        table = instruction_handlers
+        for _ in range(count):
+            pc = chip8.register_PC
+            instruction = system_memory[pc] << 8 | system_memory[pc+1]
+            table[instruction](chip8, instruction)
+            chip8.register_PC += 2
+
+    # Engine specific counters
+    def stats(self):
+        return {}
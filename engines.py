@@ -0,0 +1,21 @@
+# This module contains the registry of CPU engines. An engine executes
+# instructions on a CHIP8 instance and every engine must leave the machine in
+# the same state. New engines may be added to the dictionary as needed
+
+import blocks
+import dispatch
+import idle
+
+engines = {
+    "reference": dispatch.ReferenceEngine,
+    "table": dispatch.TableEngine,
+    "block": blocks.BlockEngine,
+    "idle": idle.IdleEngine
+}
+
+# Returns a new engine bound to chip8 if its name is provided as a string
+def engine_create(name, chip8):
+    if name not in engines:
+        raise ValueError("UNKNOWN ENGINE " + repr(name) + ", AVAILABLE: " +
+                         ", ".join(engines))
+    return engines[name](chip8)
@@ -0,0 +1,161 @@
+# This module contains a Gym style environment to drive ROMs from training
+# code. Every step holds a set of hex keys down for a few frames and returns
+# the framebuffer, the reward and whether the episode is over. The
+# framebuffer is returned as a read-only NumPy view of the video memory, so
+# no pixels are copied. VectorEnvironment steps many instances per call on
+# top of vector.VectorCHIP8.
+
+import numpy as np
+
+import computer
+import engines
+import headless
+import vector
+
+# Runs a ROM one step at a time. rewards maps system memory addresses to a
+# scale, and the reward of a step is the sum of the scaled changes of those
+# bytes. done_when maps addresses to a value that ends the episode. An
+# episode also ends when the ROM crashes or after frames_max frames
+class Environment:
+    def __init__(self, file, frame_skip=4, cycles_per_frame=10, engine="table",
+                 shift_VY=0, rewards=None, done_when=None, frames_max=None):
+        self.frame_skip = frame_skip
+        self.cycles_per_frame = cycles_per_frame
+        self.rewards = rewards or {}
+        self.done_when = done_when or {}
+        self.frames_max = frames_max
+
+        # Every episode starts from the state right after the ROM is loaded
+        self.chip8 = computer.CHIP8(seed=0)
+        self.chip8.shift_VY = shift_VY
+        self.chip8.file_open(file)
+        self.initial_state = self.chip8.save_state()
+        self.engine = engines.engine_create(engine, self.chip8)
+
+        # The video memory is updated in place, so this view always shows the
+        # current framebuffer: 32 rows of 8 bytes, most significant bit first
+        self.observation = np.frombuffer(self.chip8.video_memory, dtype=np.uint8).reshape(32, 8)
+        self.observation.flags.writeable = False
+
+        # Read-only view of the system memory, for rewards computed outside
+        self.memory = np.frombuffer(self.chip8.system_memory, dtype=np.uint8)
+        self.memory.flags.writeable = False
+
+        self.frames = 0
+        self.crash = None
+
+    # Start a new episode seeding the CXNN random number generator. Returns
+    # the observation
+    def reset(self, seed=0):
+        self.chip8.load_state(self.initial_state)
+        self.chip8.rng.seed(seed)
+        self.frames = 0
+        self.crash = None
+        return self.observation
+
+    # Hold the keys in action_keys down, release the rest and run frame_skip
+    # frames. Returns the observation, the reward, the done flag and a
+    # dictionary with the frame count and the crash description, if any
+    def step(self, action_keys, frame_skip=None):
+        chip8 = self.chip8
+        keys_pressed = chip8.keys_pressed
+        for key in range(16):
+            keys_pressed[key] = 0
+        for key in action_keys:
+            keys_pressed[key] = 1
+
+        system_memory = chip8.system_memory
+        values = [system_memory[address] for address in self.rewards]
+        try:
+            for _ in range(frame_skip or self.frame_skip):
+                self.engine.run(self.cycles_per_frame)
+                chip8.timers_tick()
+                self.frames += 1
+        except Exception as exception:
+            self.crash = headless.crash_describe(chip8, exception)
+
+        reward = sum(scale * (system_memory[address] - value) for (address, scale), value
+                     in zip(self.rewards.items(), values))
+        done = (self.crash is not None or
+                any(system_memory[address] == value for address, value in self.done_when.items()) or
+                (self.frames_max is not None and self.frames >= self.frames_max))
+        return self.observation, reward, done, {"frames": self.frames, "crash": self.crash}
+
+    # Returns the 64x32 pixels, one byte per pixel set to 0 or 1, as a copy
+    def pixels(self):
+        return np.unpackbits(self.observation, axis=1)
+
+# count environments running the same ROM in lockstep. Works like
+# Environment with arrays of one entry per instance: actions are a count x 16
+# array of key states and observations a read-only count x 32 x 8 view of the
+# video memory. Instance i of an episode seeded with seed uses seed + i.
+# Instances that are done keep running, or stop if they crashed, until they
+# are reset
+class VectorEnvironment:
+    def __init__(self, file, count, frame_skip=4, cycles_per_frame=10,
+                 shift_VY=0, rewards=None, done_when=None, frames_max=None):
+        self.count = count
+        self.frame_skip = frame_skip
+        self.cycles_per_frame = cycles_per_frame
+        self.frames_max = frames_max
+
+        self.reward_addresses = np.array(list((rewards or {}).keys()), dtype=np.intp)
+        self.reward_scales = np.array(list((rewards or {}).values()), dtype=np.float64)
+        self.done_addresses = np.array(list((done_when or {}).keys()), dtype=np.intp)
+        self.done_values = np.array(list((done_when or {}).values()), dtype=np.uint8)
+
+        self.machines = vector.VectorCHIP8(count, 0, shift_VY)
+        self.machines.file_open(file)
+        self.initial_memory = self.machines.system_memory[0].copy()
+
+        self.observations = self.machines.video_memory.view(np.uint8).reshape(count, 32, 8)
+        self.observations.flags.writeable = False
+
+        self.frames = np.zeros(count, dtype=np.int64)
+
+    # Start a new episode on every instance, or on the listed instances.
+    # Returns the observations
+    def reset(self, seed=0, instances=None):
+        machines = self.machines
+        if instances is None:
+            instances = np.arange(self.count)
+        machines.system_memory[instances] = self.initial_memory
+        for array in (machines.video_memory, machines.stack_depth,
+                      machines.register_V, machines.delay_timer,
+                      machines.sound_timer, machines.register_I,
+                      machines.video_draw_flag, machines.keys_pressed,
+                      machines.faults, self.frames):
+            array[instances] = 0
+        machines.register_PC[instances] = 0x0200
+        for instance in np.asarray(instances).tolist():
+            machines.seeds[instance] = seed + instance
+            machines.rngs[instance].seed(seed + instance)
+        return self.observations
+
+    # Set the keys of every instance from actions and run frame_skip frames.
+    # Returns the observations, the rewards and done flags as arrays, and a
+    # dictionary with the frame counts
+    def step(self, actions, frame_skip=None):
+        machines = self.machines
+        machines.keys_pressed[:] = actions
+
+        values = machines.system_memory[:, self.reward_addresses].astype(np.int64)
+        for _ in range(frame_skip or self.frame_skip):
+            running = ~machines.faults
+            machines.run(self.cycles_per_frame)
+            machines.timers_tick()
+            self.frames += running
+
+        changes = machines.system_memory[:, self.reward_addresses].astype(np.int64) - values
+        rewards = changes @ self.reward_scales
+        dones = machines.faults.copy()
+        if len(self.done_addresses):
+            dones |= (machines.system_memory[:, self.done_addresses] == self.done_values).any(axis=1)
+        if self.frames_max is not None:
+            dones |= self.frames >= self.frames_max
+        return self.observations, rewards, dones, {"frames": self.frames}
+
+    # Returns the 64x32 pixels of every instance, one byte per pixel set to 0
+    # or 1, as a copy
+    def pixels(self):
+        return self.machines.video_pixels()
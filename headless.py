@@ -0,0 +1,210 @@
+# This file contains the headless entry point. It runs a ROM without a window
+# or audio for a fixed amount of cycles or frames and reports the throughput
+# and a hash of the final framebuffer.
+
+import argparse
+import hashlib
+import time
+
+import audio
+import capture
+import computer
+import engines
+import library
+
+# Returns a hex digest identifying the contents of the video memory
+def framebuffer_hash(chip8):
+    return hashlib.sha1(bytes(chip8.video_memory)).hexdigest()
+
+# Returns a dictionary describing why chip8 stopped with exception. The PC
+# register still points at the instruction that failed
+def crash_describe(chip8, exception):
+    pc = chip8.register_PC
+    if 0 <= pc < len(chip8.system_memory) - 1:
+        instruction = chip8.system_memory[pc] << 8 | chip8.system_memory[pc+1]
+    else:
+        instruction = None
+
+    if instruction is None:
+        reason = "PC outside of system memory"
+    elif instruction == 0x00EE and len(chip8.stack) == 0:
+        reason = "stack underflow"
+    elif isinstance(exception, IndexError):
+        reason = "memory access out of range"
+    else:
+        reason = "unexpected error"
+
+    return {
+        "reason": reason,
+        "exception": type(exception).__name__ + ": " + str(exception),
+        "pc": pc,
+        "instruction": None if instruction is None else format(instruction, "04X"),
+        "register_I": chip8.register_I,
+        "stack_depth": len(chip8.stack)
+    }
+
+# Returns a CHIP8 running file, from state when it isn't None, and the
+# SHA-1 of the ROM. See run for seed
+def machine_create(rom_library, file, shift_VY, seed, state):
+    chip8 = computer.CHIP8(audio.NullAudio(), seed)
+    chip8.shift_VY = shift_VY
+    sha1 = rom_library.chip8_load(chip8, file)
+    if state is not None:
+        chip8.load_state(state)
+        if seed is not None:
+            chip8.rng.seed(seed)
+    return chip8, sha1
+
+# Frames between the save states a crash is counted from
+CHECKPOINT_FRAMES = 600
+
+# Returns how many instructions of the frame that raised an exception ran
+# before it, out of the count it was given. Engines run whole frames and
+# can't tell, so the reference interpreter resumes from checkpoint, a save
+# state taken frames whole frames earlier, and steps through the last one.
+# Returns None if the exception doesn't happen again
+def crash_cycles(checkpoint, frames, count, cycles_per_frame):
+    chip8 = computer.CHIP8(audio.NullAudio())
+    chip8.load_state(checkpoint)
+    cpu = engines.engine_create("reference", chip8)
+    for _ in range(frames):
+        cpu.run(cycles_per_frame)
+        chip8.timers_tick()
+    try:
+        for ran in range(count):
+            cpu.run(1)
+    except Exception:
+        return ran
+    return None
+
+# Run file for the given amount of cycles. The delay and sound timers tick
+# once every cycles_per_frame instructions, which keeps runs deterministic
+# instead of depending on the host's wall clock. An exception raised by the
+# ROM stops the run and is reported in the "crash" entry of the result.
+# state resumes the run from a save state. Its random number generator is
+# kept when seed is None and reseeded otherwise, so many runs can fan out
+# from the same checkpoint. cache_directory enables the ROM library's program
+# cache, which the block engine reads at the start and updates at the end.
+# capture, a capture.FrameCapture, stores the framebuffer of every frame.
+# After a crash "cycles" still counts exactly the instructions that ran,
+# those of the frame that raised included
+def run(file, cycles, cycles_per_frame=10, engine="table", shift_VY=0,
+        seed=0, state=None, cache_directory=None, capture=None):
+    rom_library = library.ROMLibrary("roms", cache_directory)
+    chip8, sha1 = machine_create(rom_library, file, shift_VY, seed, state)
+    cpu = engines.engine_create(engine, chip8)
+    rom_library.program_load(cpu, sha1)
+
+    start_time = time.perf_counter()
+    executed = 0
+    frames = 0
+    crash = None
+    checkpoint = chip8.save_state()
+    try:
+        while executed < cycles:
+            count = min(cycles_per_frame, cycles - executed)
+            cpu.run(count)
+            executed += count
+            if count == cycles_per_frame:
+                chip8.timers_tick()
+                frames += 1
+                if capture is not None:
+                    capture.frame_capture(chip8)
+                if frames % CHECKPOINT_FRAMES == 0:
+                    checkpoint = chip8.save_state()
+    except Exception as exception:
+        crash = crash_describe(chip8, exception)
+        crash["frame"] = frames
+    elapsed = time.perf_counter() - start_time
+    rom_library.program_save(cpu, sha1)
+    if crash is not None:
+        ran = crash_cycles(checkpoint, frames % CHECKPOINT_FRAMES, count,
+                           cycles_per_frame)
+        if ran is not None:
+            executed += ran
+
+    return {
+        "file": file,
+        "engine": engine,
+        "seed": seed,
+        "cycles": executed,
+        "frames": frames,
+        "seconds": elapsed,
+        "ips": executed / elapsed if elapsed > 0 else 0.0,
+        "framebuffer_hash": framebuffer_hash(chip8),
+        "engine_stats": cpu.stats(),
+        "audio_stats": chip8.audio.stats(),
+        "crash": crash,
+        "state": chip8.save_state()
+    }
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a CHIP-8 ROM without a window or audio")
+    parser.add_argument("file", help="ROM name inside the roms directory")
+    budget = parser.add_mutually_exclusive_group()
+    budget.add_argument("--cycles", type=int, help="instructions to execute")
+    budget.add_argument("--frames", type=int, help="60 Hz frames to execute")
+    parser.add_argument("--cycles-per-frame", type=int, default=10,
+                        help="instructions executed per 60 Hz frame")
+    parser.add_argument("--engine", default="table",
+                        choices=sorted(engines.engines))
+    parser.add_argument("--shift-vy", action="store_true",
+                        help="shift VY instead of VX in 8XY6 and 8XYE")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the CXNN random number generator, 0 by "
+                             "default or kept from the loaded state")
+    parser.add_argument("--load-state", default=None,
+                        help="save state file to resume the run from")
+    parser.add_argument("--save-state", default=None,
+                        help="file to write the final save state to")
+    parser.add_argument("--cache", default=None,
+                        help="directory of the block engine's program cache")
+    parser.add_argument("--capture", default=None,
+                        help="file to write the framebuffer of every frame to, "
+                             "see capture.py to export it")
+    args = parser.parse_args()
+
+    state = None
+    seed = args.seed
+    if args.load_state is not None:
+        with open(args.load_state, "rb") as f:
+            state = f.read()
+    elif seed is None:
+        seed = 0
+
+    if args.cycles is not None:
+        cycles = args.cycles
+    elif args.frames is not None:
+        cycles = args.frames * args.cycles_per_frame
+    else:
+        cycles = 60 * 60 * args.cycles_per_frame
+
+    frame_capture = None if args.capture is None else capture.FrameCapture()
+    result = run(args.file, cycles, args.cycles_per_frame, args.engine,
+                 int(args.shift_vy), seed, state, args.cache, frame_capture)
+    if frame_capture is not None:
+        frame_capture.save(args.capture)
+    if args.save_state is not None:
+        with open(args.save_state, "wb") as f:
+            f.write(result["state"])
+
+    print("FILE:", result["file"])
+    print("ENGINE:", result["engine"])
+    print("CYCLES:", result["cycles"])
+    print("FRAMES:", result["frames"])
+    print("SECONDS:", format(result["seconds"], ".3f"))
+    print("IPS:", format(result["ips"], ".0f"))
+    print("FRAMEBUFFER:", result["framebuffer_hash"])
+    for name, value in result["engine_stats"].items():
+        print(name.upper() + ":", value)
+    for name, value in result["audio_stats"].items():
+        print(name.upper() + ":", value)
+    if frame_capture is not None:
+        for name, value in frame_capture.stats().items():
+            print(name.upper() + ":", value)
+    if result["crash"] is not None:
+        print("CRASH:", result["crash"]["reason"], "AT",
+              format(result["crash"]["pc"], "04X"),
+              "(" + result["crash"]["exception"] + ")")
@@ -0,0 +1,127 @@
+# This module contains a CPU engine that skips busy-wait loops. ROMs wait for
+# the next frame polling the delay timer with loops like FX07, 3XNN, 1NNN, or
+# wait for a key with FX0A. The timers and keys only change between frames,
+# so once an iteration of such a loop leaves the machine exactly as it found
+# it, every iteration left in the frame will do the same and they can be
+# counted as executed without running them.
+
+import blocks
+import dispatch
+
+# Instructions that only change the PC, the V registers or I. A loop made of
+# them that leaves those registers unchanged has no other visible effect
+idle_handlers = {
+    dispatch.op_nop, dispatch.op_1nnn, dispatch.op_3xnn, dispatch.op_4xnn,
+    dispatch.op_5xy0, dispatch.op_6xnn, dispatch.op_7xnn, dispatch.op_8xy0,
+    dispatch.op_8xy1, dispatch.op_8xy2, dispatch.op_8xy3, dispatch.op_8xy4,
+    dispatch.op_8xy5, dispatch.op_8xy6, dispatch.op_8xy7, dispatch.op_8xye,
+    dispatch.op_9xy0, dispatch.op_annn, dispatch.op_bnnn, dispatch.op_ex9e,
+    dispatch.op_exa1, dispatch.op_fx07, dispatch.op_fx0a, dispatch.op_fx1e,
+    dispatch.op_fx29, dispatch.op_fx65
+}
+
+# Runs the CPU like blocks.BlockEngine. Every loop goes back to a block that
+# starts at or before the previous one. When such a block is made of
+# idle_handlers the V registers and I are recorded on entry, and reaching it
+# again with the same registers, with only those blocks running in between,
+# means the machine is going around a loop it can't leave before the end of
+# the run. Loops that keep coming back with other registers are not checked
+# again until the next run, so busy loops doing real work pay almost nothing
+
+# Mismatched iterations after which a loop isn't checked again in the run.
+# The first iteration of a wait loop usually loads the polled register
+LOOP_MISMATCHES_MAX = 2
+
+class IdleEngine(blocks.BlockEngine):
+    def __init__(self, chip8):
+        super().__init__(chip8)
+
+        # Skip counters
+        self.cycles_skipped = 0
+        self.idle_loops = 0
+
+    # Add a block to the cache, flagging whether it can be an idle loop as
+    # its seventh entry
+    def block_add(self, address, block):
+        block.append(all(dispatch.instruction_handlers[instruction] in idle_handlers
+                         for handler, instruction in block[2]))
+        return super().block_add(address, block)
+
+    # Execute count instructions
+    def run(self, count):
+        chip8 = self.chip8
+        if chip8.memory_epoch != self.memory_epoch:
+            self.clear()
+        cache = self.blocks
+        register_V = chip8.register_V
+
+        # Registers and instructions left to run when each loop head was
+        # entered, keyed by start address, and the mismatched iterations of
+        # each loop head in this run
+        entries = {}
+        mismatches = {}
+        previous = -1
+
+        while count > 0:
+            start = chip8.register_PC
+            block = cache.get(start)
+            if block is None:
+                block = self.block_translate(start)
+            else:
+                self.hits += 1
+
+            if block[6]:
+                if start <= previous and mismatches.get(start, 0) < LOOP_MISMATCHES_MAX:
+                    entry = entries.get(start)
+                    state = (chip8.register_I, *register_V)
+                    if entry is None:
+                        entries[start] = (state, count)
+                    elif entry[0] == state:
+                        # Whole iterations left in the run are skipped and
+                        # the remainder runs from the head again, so the PC
+                        # ends where it would
+                        length = entry[1] - count
+                        skipped = count - count % length
+                        count -= skipped
+                        self.cycles_skipped += skipped
+                        self.idle_loops += 1
+                        entries = {}
+                        continue
+                    else:
+                        entries[start] = (state, count)
+                        mismatches[start] = mismatches.get(start, 0) + 1
+            elif entries:
+                entries = {}
+            previous = start
+
+            function = block[0]
+            if function is not None and block[1] <= count:
+                function(chip8)
+                count -= block[1]
+            elif block[1] == 1:
+                handler, instruction = block[2][0]
+                handler(chip8, instruction)
+                chip8.register_PC += 2
+                count -= 1
+            else:
+                ops = block[2]
+                if len(ops) > count:
+                    ops = ops[:count]
+                for handler, instruction in ops:
+                    handler(chip8, instruction)
+                    chip8.register_PC += 2
+                count -= len(ops)
+
+                block[4] += 1
+                if block[4] == blocks.BLOCK_HOT_RUNS and block[1] > 1:
+                    source, namespace = self.block_source(block[2], block[3])
+                    block[5] = compile(source, "<block>", "exec")
+                    exec(block[5], namespace)
+                    block[0] = namespace["block"]
+
+    # Engine specific counters
+    def stats(self):
+        stats = super().stats()
+        stats["cycles_skipped"] = self.cycles_skipped
+        stats["idle_loops"] = self.idle_loops
+        return stats
@@ -1,22 +1,83 @@
 # This module contains functions to use the PC keyboard as a
 # CHIP-8 hex keyboard
 
+import collections
+
 import pygame
 
-# Get the hex value of the key pressed
-def key_pressed(chip8, event):
+# Hex values of the 16 keys of the 1977 COSMAC VIP's keyboard, listed row by
+# row from the top left. Profiles name the PC keys in this same order
+COSMAC_VIP_KEYS = [0x1, 0x2, 0x3, 0xC,
+                   0x4, 0x5, 0x6, 0xD,
+                   0x7, 0x8, 0x9, 0xE,
+                   0xA, 0x0, 0xB, 0xF]
 
-    # This dictionary is organized to resemble the 1977 COSMAC VIP's keyboard
-    keys = { 
-        pygame.K_1: 0x1, pygame.K_2: 0x2, pygame.K_3: 0x3, pygame.K_4: 0xC,
-        pygame.K_q: 0x4, pygame.K_w: 0x5, pygame.K_e: 0x6, pygame.K_r: 0xD,
-        pygame.K_a: 0x7, pygame.K_s: 0x8, pygame.K_d: 0x9, pygame.K_f: 0xE,
-        pygame.K_z: 0xA, pygame.K_x: 0x0, pygame.K_c: 0xB, pygame.K_v: 0xF 
-        }
+# Amount of recent latency samples kept to compute percentiles
+LATENCY_SAMPLES_MAX = 1000
+
+# Returns a dictionary mapping PyGame key codes to hex key values. keys is a
+# string with the 16 PC keys laid out like the COSMAC VIP's keyboard, like
+# "1234qwerasdfzxcv". Built once so events only need a dictionary lookup
+def keymap_create(keys):
+    return {pygame.key.key_code(name): value
+            for name, value in zip(keys, COSMAC_VIP_KEYS)}
+
+# Update the hex key state from a KEYDOWN or KEYUP event. Returns True if the
+# event changed a CHIP-8 key
+def key_pressed(chip8, event, keymap):
+    key = keymap.get(event.key)
+    if key is None:
+        return False
+    if event.type == pygame.KEYDOWN:
+        chip8.keys_pressed[key] = 1
+    else:
+        chip8.keys_pressed[key] = 0
+    return True
+
+# Process every pending PyGame event once. Meant to be called once per frame.
+# Returns False when the window was closed
+def events_process(chip8, keymap, latency=None):
+    running = True
+    for event in pygame.event.get():
+        if event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
+            if key_pressed(chip8, event, keymap) and latency is not None:
+                latency.key_event()
+        elif event.type == pygame.QUIT:
+            running = False
+    return running
 
-    if event.key in keys:
-        key = keys[event.key]
-        if event.type == pygame.KEYDOWN:
-            chip8.keys_pressed[key] = 1
-        elif event.type == pygame.KEYUP:
-            chip8.keys_pressed[key] = 0
+# Measures the input to display latency in frames, from the frame a key
+# event is processed on to the first frame that updates the display after it.
+# The first redraw may not be caused by the key, so this is a lower bound of
+# how long the ROM takes to react
+class InputLatency:
+    def __init__(self, frame_scheduler):
+        self.frame_scheduler = frame_scheduler
+
+        # Frame of the oldest key event not followed by a redraw yet
+        self.key_frame = None
+        self.samples = collections.deque(maxlen=LATENCY_SAMPLES_MAX)
+
+    # Called when a key event is processed, before the frame runs
+    def key_event(self):
+        if self.key_frame is None:
+            self.key_frame = self.frame_scheduler.frames
+
+    # Called when a frame updates the display, after the frame ran
+    def frame_drawn(self):
+        if self.key_frame is not None:
+            self.samples.append(self.frame_scheduler.frames - self.key_frame)
+            self.key_frame = None
+
+    # Latency statistics in frames
+    def stats(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+        return {
+            "samples": len(samples),
+            "latency_frames_mean": sum(samples) / len(samples),
+            "latency_frames_p50": samples[len(samples) // 2],
+            "latency_frames_p95": samples[int(len(samples) * 0.95)],
+            "latency_frames_max": samples[-1]
+        }
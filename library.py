@@ -0,0 +1,116 @@
+# This module contains the ROM library. It indexes a directory of ROMs by
+# the SHA-1 of their contents, loads them into a CHIP8 with a single copy and
+# keeps an on-disk cache of the blocks the block engine decoded and compiled
+# for each ROM, keyed by its hash, so later runs of the same ROM start with a
+# warm cache instead of decoding it again.
+
+import hashlib
+import inspect
+import marshal
+import os
+import sys
+
+import blocks
+import computer
+import dispatch
+
+# Program cache file format. The marshalled tuple holds the magic, the
+# format version, the interpreter's cache tag, since compiled code only
+# loads on the Python version that produced it, the compiler hash and the
+# exported program
+PROGRAM_MAGIC = "CH8P"
+PROGRAM_VERSION = 2
+
+# Hash of the source of the block compiler and of the handlers its code
+# calls or inlines. Cached code translated by any other version of them is
+# ignored instead of run
+PROGRAM_COMPILER = hashlib.sha1((inspect.getsource(blocks) +
+                                 inspect.getsource(dispatch)).encode()).hexdigest()
+
+# Indexes the ROMs inside directory. Cache files are written to
+# cache_directory, None disables the program cache
+class ROMLibrary:
+    def __init__(self, directory="roms", cache_directory=None):
+        self.directory = directory
+        self.cache_directory = cache_directory
+
+        # ROM names keyed by SHA-1 hex digest and the other way around
+        self.names = {}
+        self.hashes = {}
+        self.scan()
+
+    # Hash every file of the directory
+    def scan(self):
+        self.names = {}
+        self.hashes = {}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    sha1 = hashlib.sha1(f.read()).hexdigest()
+                self.names.setdefault(sha1, name)
+                self.hashes[name] = sha1
+
+    # Returns the SHA-1 of a ROM given by name or by hash. Raises KeyError
+    # if the library doesn't have it
+    def sha1_get(self, rom):
+        if rom in self.hashes:
+            return self.hashes[rom]
+        elif rom in self.names:
+            return rom
+        raise KeyError("ROM NOT IN LIBRARY: " + rom)
+
+    # Returns the image of a ROM given by name or by hash. The file is read
+    # again and checked, so a ROM changed since the scan raises ValueError
+    def image_get(self, rom):
+        sha1 = self.sha1_get(rom)
+        with open(os.path.join(self.directory, self.names[sha1]), "rb") as f:
+            image = f.read()
+        if hashlib.sha1(image).hexdigest() != sha1:
+            raise ValueError("ROM CHANGED SINCE THE LAST SCAN: " + self.names[sha1])
+        return image
+
+    # Load a ROM given by name or by hash into chip8. Returns its SHA-1
+    def chip8_load(self, chip8, rom):
+        sha1 = self.sha1_get(rom)
+        chip8.rom_load(self.image_get(sha1))
+        return sha1
+
+    # Path of the program cache file of a ROM
+    def program_path(self, sha1):
+        return os.path.join(self.cache_directory, sha1 + ".ch8p")
+
+    # Warm up a block engine with the cached program of a ROM, which must be
+    # freshly loaded in its machine. Returns False when there is no usable
+    # cache for it
+    def program_load(self, engine, sha1):
+        if self.cache_directory is None or not isinstance(engine, blocks.BlockEngine):
+            return False
+        try:
+            with open(self.program_path(sha1), "rb") as f:
+                magic, version, cache_tag, compiler, program = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        if (magic != PROGRAM_MAGIC or version != PROGRAM_VERSION or
+                cache_tag != sys.implementation.cache_tag or
+                compiler != PROGRAM_COMPILER):
+            return False
+        engine.program_import(program)
+        return True
+
+    # Write the blocks a block engine decoded for a ROM to the cache. The
+    # file is replaced atomically so parallel runs never read a partial one
+    def program_save(self, engine, sha1):
+        if self.cache_directory is None or not isinstance(engine, blocks.BlockEngine):
+            return
+        memory = computer.CHIP8()
+        memory.rom_load(self.image_get(sha1))
+        program = engine.program_export(memory.system_memory)
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        path = self.program_path(sha1)
+        temporary_path = path + "." + str(os.getpid())
+        with open(temporary_path, "wb") as f:
+            marshal.dump((PROGRAM_MAGIC, PROGRAM_VERSION,
+                          sys.implementation.cache_tag, PROGRAM_COMPILER, program), f)
+        os.replace(temporary_path, path)
@@ -0,0 +1,238 @@
+# This module contains the load test client of server.py. It opens a growing
+# amount of sessions, presses random keys on all of them and reports the
+# deltas received, the key to delta latency seen by the clients and how
+# loaded the server's 60 Hz tick was, the fraction of the wall time spent
+# running frames, to find how many sessions one server process sustains in
+# real time.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import computer
+import profiler
+import server
+
+# Fraction of late ticks above which the server isn't keeping up
+TICKS_LATE_MAX = 0.01
+
+# Seconds a spawned server gets to create its socket
+SPAWN_TIMEOUT = 10
+
+# Connect to the server on the Unix socket path, or on host and port when
+# it's None. Returns the reader and writer
+async def connection_open(path, host, port):
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+# A client running one session. It keeps a copy of the framebuffer updated
+# from the deltas and presses a random key every key_interval seconds
+class Client:
+    def __init__(self, reader, writer, rng):
+        self.reader = reader
+        self.writer = writer
+        self.rng = rng
+        self.video_memory = bytearray(computer.VIDEO_MEMORY_SIZE)
+
+        # perf_counter time of the oldest key sent and not followed by a
+        # delta yet, and the time from keys to deltas
+        self.key_time = None
+        self.latencies = []
+
+        # Counters
+        self.deltas = 0
+        self.delta_bytes = 0
+        self.errors = []
+
+    # Read the server's messages until the connection closes. Statistics
+    # answers are put in the stats queue
+    async def messages_read(self, stats):
+        try:
+            while True:
+                kind, payload = await server.message_read(self.reader)
+                if kind == server.MESSAGE_DELTA:
+                    server.delta_apply(self.video_memory, payload)
+                    self.deltas += 1
+                    self.delta_bytes += server.MESSAGE.size + len(payload)
+                    if self.key_time is not None:
+                        self.latencies.append(time.perf_counter() - self.key_time)
+                        self.key_time = None
+                elif kind == server.MESSAGE_STATS:
+                    stats.put_nowait(json.loads(payload))
+                elif kind == server.MESSAGE_ERROR:
+                    self.errors.append(payload.decode(errors="replace"))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    # Press and release random keys until cancelled
+    async def keys_send(self, key_interval):
+        while True:
+            await asyncio.sleep(key_interval * (0.5 + self.rng.random()))
+            key = self.rng.randrange(16)
+            if self.key_time is None:
+                self.key_time = time.perf_counter()
+            self.writer.write(server.message_pack(server.MESSAGE_KEY, bytes((key, 1))))
+            await asyncio.sleep(key_interval / 4)
+            self.writer.write(server.message_pack(server.MESSAGE_KEY, bytes((key, 0))))
+
+    # Reset the counters
+    def counters_reset(self):
+        self.latencies = []
+        self.deltas = 0
+        self.delta_bytes = 0
+
+# Returns the server statistics, asked through client
+async def server_stats(client, stats):
+    client.writer.write(server.message_pack(server.MESSAGE_STATS))
+    return await stats.get()
+
+# Add clients until there are sessions of them, running roms in turn, then
+# measure them for duration seconds. Returns the results of the level
+async def level_run(clients, sessions, roms, duration, key_interval, address, rng):
+    while len(clients) < sessions:
+        reader, writer = await connection_open(*address)
+        client = Client(reader, writer, random.Random(rng.random()))
+        client.stats = asyncio.Queue()
+        client.tasks = [asyncio.ensure_future(client.messages_read(client.stats)),
+                        asyncio.ensure_future(client.keys_send(key_interval))]
+        writer.write(server.message_pack(server.MESSAGE_OPEN,
+                                         roms[len(clients) % len(roms)].encode()))
+        clients.append(client)
+
+    # Let the new sessions start before measuring
+    await asyncio.sleep(1)
+    for client in clients:
+        client.counters_reset()
+    before = await server_stats(clients[0], clients[0].stats)
+    await asyncio.sleep(duration)
+    after = await server_stats(clients[0], clients[0].stats)
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    ticks = after["ticks"] - before["ticks"]
+    ticks_late = after["ticks_late"] - before["ticks_late"]
+    return {
+        "sessions": sessions,
+        "deltas_per_second": sum(client.deltas for client in clients) / duration / sessions,
+        "delta_bytes_per_second": sum(client.delta_bytes for client in clients) / duration,
+        "key_to_delta_ms_p50": 1000 * profiler.percentile(latencies, 0.50) if latencies else None,
+        "key_to_delta_ms_p95": 1000 * profiler.percentile(latencies, 0.95) if latencies else None,
+        "ticks_per_second": ticks / duration,
+        "ticks_late": ticks_late,
+        "tick_ms_p95": after.get("tick_ms_p95"),
+        "load": (after["tick_seconds"] - before["tick_seconds"]) / duration,
+        "errors": sorted(set(error for client in clients for error in client.errors)),
+        "sustained": ticks > 0 and ticks_late / ticks <= TICKS_LATE_MAX
+    }
+
+# Run every level of sessions against the server. Returns the results
+async def load_test(levels, roms, duration, key_interval, address, seed=0):
+    rng = random.Random(seed)
+    clients = []
+    results = []
+    try:
+        for sessions in levels:
+            result = await level_run(clients, sessions, roms, duration, key_interval,
+                                     address, rng)
+            results.append(result)
+            print(format(result["sessions"], ">8"),
+                  format(result["deltas_per_second"], ">10.1f"),
+                  format(result["key_to_delta_ms_p50"] or 0.0, ">8.1f"),
+                  format(result["key_to_delta_ms_p95"] or 0.0, ">8.1f"),
+                  format(result["ticks_per_second"], ">7.1f"),
+                  format(result["tick_ms_p95"] or 0.0, ">9.2f"),
+                  format(result["load"], ">6.2f"),
+                  "YES" if result["sustained"] else "NO")
+            for error in result["errors"]:
+                print("ERROR:", error)
+    finally:
+        for client in clients:
+            for task in client.tasks:
+                task.cancel()
+            client.writer.close()
+    return results
+
+# Start server.py on a temporary Unix socket. Returns the process and the
+# socket path once it accepts connections. Raises RuntimeError with the
+# server's stderr if it exits first or doesn't create the socket within
+# SPAWN_TIMEOUT seconds
+async def server_spawn(engine, ips):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "chip8.sock")
+
+    # stderr goes to a file, a pipe nobody reads could fill and block it
+    with open(os.path.join(directory, "stderr.txt"), "w+b") as stderr:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "server.py", "--unix", path, "--engine", engine,
+            "--ips", str(ips), stderr=stderr)
+        deadline = time.perf_counter() + SPAWN_TIMEOUT
+        while not os.path.exists(path):
+            if process.returncode is not None:
+                error = "SERVER EXITED WITH STATUS " + str(process.returncode)
+            elif time.perf_counter() > deadline:
+                process.terminate()
+                await process.wait()
+                error = "SERVER DIDN'T OPEN ITS SOCKET IN " + str(SPAWN_TIMEOUT) + " SECONDS"
+            else:
+                await asyncio.sleep(0.05)
+                continue
+            stderr.seek(0)
+            raise RuntimeError(error + "\n" + stderr.read().decode(errors="replace"))
+    return process, path
+
+# Spawn the server if asked, run the load test and stop the server
+async def main(args):
+    process = None
+    address = (args.unix, args.host, args.port)
+    if args.spawn:
+        process, path = await server_spawn(args.engine, args.ips)
+        address = (path, None, None)
+
+    print(format("SESSIONS", ">8"), format("DELTAS/S", ">10"), format("KEY P50", ">8"),
+          format("KEY P95", ">8"), format("TICKS/S", ">7"), format("TICK P95", ">9"),
+          format("LOAD", ">6"), "SUSTAINED")
+    try:
+        results = await load_test(args.sessions, args.roms, args.duration,
+                                  args.key_interval, address, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            await process.wait()
+
+    sustained = [result["sessions"] for result in results if result["sustained"]]
+    print("SESSIONS SUSTAINED:", max(sustained) if sustained else 0)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure how many sessions server.py sustains")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50, 100, 200],
+                        help="amounts of sessions to measure, in increasing order")
+    parser.add_argument("--roms", nargs="+", default=["INVADERS", "PONG", "BRIX", "TETRIS"],
+                        help="ROMs opened by the sessions in turn")
+    parser.add_argument("--duration", type=float, default=5,
+                        help="seconds measured per amount of sessions")
+    parser.add_argument("--key-interval", type=float, default=0.5,
+                        help="mean seconds between key presses of every session")
+    parser.add_argument("--unix", default=None, help="Unix socket path of the server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--spawn", action="store_true",
+                        help="start server.py on a temporary Unix socket")
+    parser.add_argument("--engine", default="table",
+                        help="engine of the spawned server")
+    parser.add_argument("--ips", type=int, default=600,
+                        help="instructions per second of the spawned server's sessions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
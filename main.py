@@ -6,24 +6,39 @@ environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
 
 # Module's imports
 import pygame
+import random
 import sys
 import time
 
+import audio
 import computer
+import engines
 import screen
 import keyboard
 import debug
+import profiler
 import profiles
+import replay
+import rewind
+import scheduler
 
-# Exit CHIP-8 and PyGame 
-def exit(chip8, profile):
+# Exit CHIP-8 and PyGame. components maps a title to every object whose
+# stats() are dumped when debugging
+def exit(chip8, profile, components):
+    if "PROFILER" in components:
+        components["PROFILER"].export(profile["profile_file"])
+    if "RECORDER" in components:
+        components["RECORDER"].save()
     if profile["debugging"] == "True":
         debug.dump(chip8)
+        for title, component in components.items():
+            debug.stats_dump(title, component.stats())
     pygame.quit()
     sys.exit()
 
-# Create the main window with a "canvas"
-def main(file, profile):
+# Create the main window with a "canvas". When recording is a file name the
+# key transitions of the session are written to it at exit
+def main(file, profile, recording=None):
     
     # PyGame and CHIP-8 initialization
     pygame.init()
@@ -32,48 +47,122 @@ def main(file, profile):
     canvas.fill(profile["background_color"])
     pygame.display.update()
 
-    chip8 = computer.CHIP8()
-    chip8.file_open(file)
+    # Initialize sound
+    audio_engine = audio.PygameAudio(profile["sound_frequency"],
+                                     profile["sound_volume"])
 
-    # cycles is used to store how many CPU cycles has been counted
-    cycles = 0
+    # A recorded session needs a known seed so replay.py can reproduce CXNN
+    seed = None
+    if recording is not None:
+        seed = random.getrandbits(32)
+
+    chip8 = computer.CHIP8(audio_engine, seed)
+    try:
+        chip8.file_open(file)
+    except (OSError, ValueError):
+        print("WRONG FILE NAME, USE SYNTAX: python main.py <FILE>, <profile>")
+        print("EXAMPLE: python main.py INVADERS, normal")
+
+        pygame.quit()
+        sys.exit()
+
+    # The profiler replaces the profile's engine with an instrumented one
+    execution_profiler = None
+    engine_name = profile["engine"]
+    if profile["profiling"] == "True":
+        engine_name = "profiling"
+        engine = profiler.ProfilingEngine(chip8)
+        execution_profiler = profiler.Profiler(engine)
+    else:
+        engine = engines.engine_create(engine_name, chip8)
+    renderer = screen.Renderer(canvas, profile)
+    frame_scheduler = scheduler.FrameScheduler(chip8, engine, profile["ips"],
+                                               profile["throttle"] == "True")
+    keymap = keyboard.keymap_create(profile["keys"])
+    latency = keyboard.InputLatency(frame_scheduler)
+    components = {"ENGINE " + engine_name: engine,
+                  "RENDERER": renderer, "SCHEDULER": frame_scheduler,
+                  "INPUT LATENCY": latency, "AUDIO": audio_engine}
+    if execution_profiler is not None:
+        components["PROFILER"] = execution_profiler
+
+    recorder = None
+    if recording is not None:
+        recorder = replay.InputRecorder(chip8, file, profile["ips"], recording)
+        components["RECORDER"] = recorder
+
+    # Rewind buffer, stepped back one frame per frame while its key is held.
+    # Recorded sessions can't rewind, the replay would not match
+    rewind_buffer = None
+    if profile["rewind_seconds"] > 0 and recorder is None:
+        rewind_buffer = rewind.RewindBuffer(chip8, profile["rewind_seconds"])
+        rewind_key = pygame.key.key_code(profile["rewind_key"])
+        components["REWIND"] = rewind_buffer
    
-    # Main loop
+    # Main loop, one iteration per 60 Hz frame
     while chip8.register_PC < len(chip8.system_memory):
 
-        # Execute an instruction 
-        chip8.cpu_cycle()
-    
-        # Check for keyboard input
-        for event in pygame.event.get():
-            if event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
-                keyboard.key_pressed(chip8, event)
-            elif event.type == pygame.QUIT:
-                exit(chip8, profile)
+        if execution_profiler is not None:
+            execution_profiler.frame_begin()
+            section_start = time.perf_counter()
+
+        # Check for keyboard input once per frame
+        if not keyboard.events_process(chip8, keymap, latency):
+            exit(chip8, profile, components)
+
+        if recorder is not None:
+            recorder.frame_record(frame_scheduler.frames)
+
+        if execution_profiler is not None:
+            section_end = time.perf_counter()
+            execution_profiler.section_add("events", section_end - section_start)
+            section_start = section_end
+
+        if rewind_buffer is not None and pygame.key.get_pressed()[rewind_key]:
+            if rewind_buffer.step_back():
+                pygame.display.update(renderer.frame_draw(chip8))
+            frame_scheduler.wait()
+            continue
+
+        # Execute the frame's instructions and tick the timers. Running past
+        # the system's memory last location ends the loop
+        try:
+            frame_scheduler.frame()
+        except IndexError:
+            if chip8.register_PC < len(chip8.system_memory) - 1:
+                raise
+            break
+
+        if execution_profiler is not None:
+            section_end = time.perf_counter()
+            execution_profiler.section_add("cpu", section_end - section_start)
+
+        if rewind_buffer is not None:
+            rewind_buffer.capture()
 
         # Update the screen
         if chip8.video_draw_flag == 1:
-            screen.frame_draw(chip8,canvas,profile)
-            pygame.display.update()
-            
-        # Increase the loop cycles counter
-        cycles += 1
-
-        # A speed delay of 10/1000 seconds happens every time an amount of loops
-        # equal to profile["speed"] is reached
-        if cycles == profile["speed"]:
-            time.sleep(10/1000)
-            cycles = 0
+            if execution_profiler is not None:
+                section_start = time.perf_counter()
+            pygame.display.update(renderer.frame_draw(chip8))
+            latency.frame_drawn()
+            if execution_profiler is not None:
+                execution_profiler.section_add("render", time.perf_counter() - section_start)
+
+        # Wait for the next frame
+        frame_scheduler.wait()
 
     # Exit CHIP-8 if system's memory last location is reached
-    exit(chip8, profile)
+    exit(chip8, profile, components)
     
 # Entry point
 if __name__ == "__main__":
     if len(sys.argv) == 3:
         main(sys.argv[1], profiles.profile_get(sys.argv[2]))
+    elif len(sys.argv) == 4:
+        main(sys.argv[1], profiles.profile_get(sys.argv[2]), sys.argv[3])
     else:
-        print("USE SYNTAX: python main.py <FILE>, <profile>")
+        print("USE SYNTAX: python main.py <FILE>, <profile> [<RECORDING>]")
         print("EXECUTING DEFAULT: python main.py INVADERS, normal")
 
         main("INVADERS", profiles.profile_get("normal"))
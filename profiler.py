@@ -0,0 +1,118 @@
+# This module contains the execution profiler. It runs the CPU through an
+# instrumented copy of the table engine that counts every executed
+# instruction and program counter, and measures how the main loop splits each
+# frame between the CPU, the renderer and the event handling. Everything is
+# exported as JSON at exit. Nothing here runs unless the profile enables it.
+
+import collections
+import json
+import time
+
+import dispatch
+
+# Amount of recent frames kept to compute the frame time percentiles
+FRAME_TIMES_MAX = 3600
+
+# Amount of entries listed in the summaries of the hottest opcodes and PCs
+HOT_ENTRIES = 10
+
+# Opcode class of every instruction, the name of its handler without the
+# "op_" prefix, like "8XY4", "DXYN" or "NOP" for unsupported instructions
+opcode_classes = [handler.__name__[3:].upper() for handler in dispatch.instruction_handlers]
+
+# Returns the value at fraction of an already sorted list
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+# Runs the CPU like dispatch.TableEngine, counting executed instructions and
+# the program counter of each one
+class ProfilingEngine:
+    def __init__(self, chip8):
+        self.chip8 = chip8
+
+        # Hits per instruction, folded into opcode classes on export, and per
+        # address of the 4 KB system memory
+        self.instruction_counts = [0] * 0x10000
+        self.pc_counts = [0] * len(chip8.system_memory)
+
+    # Execute count instructions
+    def run(self, count):
+        chip8 = self.chip8
+        system_memory = chip8.system_memory
+        table = dispatch.instruction_handlers
+        instruction_counts = self.instruction_counts
+        pc_counts = self.pc_counts
+        for _ in range(count):
+            pc = chip8.register_PC
+            instruction = system_memory[pc] << 8 | system_memory[pc+1]
+            instruction_counts[instruction] += 1
+            pc_counts[pc] += 1
+            table[instruction](chip8, instruction)
+            chip8.register_PC += 2
+
+    # Executed instructions per opcode class, most executed first
+    def opcode_counts(self):
+        counts = collections.Counter()
+        for instruction, hits in enumerate(self.instruction_counts):
+            if hits:
+                counts[opcode_classes[instruction]] += hits
+        return dict(counts.most_common())
+
+    # Engine specific counters
+    def stats(self):
+        pc_hot = sorted(range(len(self.pc_counts)), key=self.pc_counts.__getitem__,
+                        reverse=True)[:HOT_ENTRIES]
+        return {
+            "instructions": sum(self.pc_counts),
+            "opcodes_hot": list(self.opcode_counts().items())[:HOT_ENTRIES],
+            "pc_hot": [(format(pc, "04X"), self.pc_counts[pc])
+                       for pc in pc_hot if self.pc_counts[pc]]
+        }
+
+# Collects the time the main loop spends on each section of a frame and the
+# wall time of every frame. The caller brackets each section with
+# perf_counter() readings and reports them once per frame
+class Profiler:
+    def __init__(self, engine):
+        self.engine = engine
+
+        self.sections = {"cpu": 0.0, "render": 0.0, "events": 0.0}
+        self.frames = 0
+        self.frame_times = collections.deque(maxlen=FRAME_TIMES_MAX)
+        self.frame_start = None
+
+    # Called at the start of every frame, measures the previous frame from
+    # start to start so the wait for the next frame is included
+    def frame_begin(self):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_times.append(now - self.frame_start)
+        self.frame_start = now
+        self.frames += 1
+
+    # Add seconds to the time of a section
+    def section_add(self, section, seconds):
+        self.sections[section] += seconds
+
+    # Frame time split and percentiles in milliseconds
+    def stats(self):
+        stats = {"frames": self.frames}
+        for section, seconds in self.sections.items():
+            stats[section + "_ms"] = 1000 * seconds
+        times = sorted(self.frame_times)
+        if times:
+            stats["frame_ms_mean"] = 1000 * sum(times) / len(times)
+            stats["frame_ms_p50"] = 1000 * percentile(times, 0.50)
+            stats["frame_ms_p95"] = 1000 * percentile(times, 0.95)
+            stats["frame_ms_p99"] = 1000 * percentile(times, 0.99)
+            stats["frame_ms_max"] = 1000 * times[-1]
+        return stats
+
+    # Write the full profile, including the PC histogram, as a JSON file
+    def export(self, file):
+        profile = self.stats()
+        profile["instructions"] = sum(self.engine.pc_counts)
+        profile["opcodes"] = self.engine.opcode_counts()
+        profile["pc_histogram"] = self.engine.pc_counts
+        with open(file, "w") as f:
+            json.dump(profile, f)
@@ -1,5 +1,14 @@
 # This module contains the configuration's profiles and functions
-# New profiles may be added to the dictonary as needed
+# New profiles may be added to the dictonary as needed. "engine" selects the
+# CPU implementation from engines.py, "reference" runs CHIP8.cpu_cycle. "ips"
+# is the amount of instructions executed per second of emulated time and
+# "throttle" set to "False" runs the 60 Hz frames as fast as possible. "keys"
+# names the PC keys mapped to the hex keyboard, in COSMAC VIP layout order.
+# "rewind_seconds" is how far back holding "rewind_key" can go, 0 disables it.
+# "profiling" set to "True" runs the CPU through profiler.py and writes the
+# profile as JSON to "profile_file" at exit. "sound_frequency" in Hz and
+# "sound_volume" from 0 to 1 configure the tone played while the sound timer
+# runs
 
 import pygame
 import sys
@@ -8,8 +17,17 @@ profiles = {
 
 "normal": {  
     "zoom": 10,
-    "speed": 10,
+    "ips": 600,
+    "throttle": "True",
     "shift_VY": 0,
+    "engine": "table",
+    "keys": "1234qwerasdfzxcv",
+    "sound_frequency": 440,
+    "sound_volume": 0.25,
+    "rewind_seconds": 10,
+    "rewind_key": "backspace",
+    "profiling": "False",
+    "profile_file": "profile.json",
     "debugging": "False", 
     "background_color": (0x99, 0xBD, 0x2A),
     "foreground_color": (0x2F, 0x63, 0x33)  
@@ -17,8 +35,17 @@ profiles = {
 
 "fast": {  
     "zoom": 10,
-    "speed": 100000,
+    "ips": 100000,
+    "throttle": "True",
     "shift_VY": 0,
+    "engine": "idle",
+    "keys": "1234qwerasdfzxcv",
+    "sound_frequency": 440,
+    "sound_volume": 0.25,
+    "rewind_seconds": 10,
+    "rewind_key": "backspace",
+    "profiling": "False",
+    "profile_file": "profile.json",
     "debugging": "False", 
     "background_color": (0xFA, 0x86, 0xC4),
     "foreground_color": (0xFF, 0xFF, 0xFF)  
@@ -26,11 +53,38 @@ profiles = {
 
 "debug": {  
     "zoom": 10,
-    "speed": 10,
+    "ips": 600,
+    "throttle": "True",
     "shift_VY": 0,
+    "engine": "table",
+    "keys": "1234qwerasdfzxcv",
+    "sound_frequency": 440,
+    "sound_volume": 0.25,
+    "rewind_seconds": 10,
+    "rewind_key": "backspace",
+    "profiling": "False",
+    "profile_file": "profile.json",
     "debugging": "True", 
     "background_color": (0xFF, 0xFF, 0xFF),
     "foreground_color": (0x00, 0x00, 0x00)  
+    },
+
+"benchmark": {  
+    "zoom": 10,
+    "ips": 600,
+    "throttle": "False",
+    "shift_VY": 0,
+    "engine": "table",
+    "keys": "1234qwerasdfzxcv",
+    "sound_frequency": 440,
+    "sound_volume": 0.25,
+    "rewind_seconds": 0,
+    "rewind_key": "backspace",
+    "profiling": "True",
+    "profile_file": "profile.json",
+    "debugging": "True", 
+    "background_color": (0x99, 0xBD, 0x2A),
+    "foreground_color": (0x2F, 0x63, 0x33)  
     }
     
 }
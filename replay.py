@@ -0,0 +1,172 @@
+# This file contains the input recorder and the headless replay. A recording
+# holds the ROM, the seed of the CXNN random number generator and every change
+# of the hex keys tagged with the frame it happened on, so a play session can
+# be run again without a window at full speed, producing the same framebuffer
+# on every frame.
+
+import argparse
+import struct
+import sys
+import time
+
+import computer
+import engines
+import headless
+import library
+import scheduler
+
+# Recording binary format. A header with the magic, format version, seed,
+# instructions per second, shift_VY, frames, SHA-1 of the ROM and the length
+# of the ROM name is followed by the ROM name and one entry per key
+# transition: the frame number and the key, with bit 7 set when pressed. All
+# values are little endian
+RECORDING_MAGIC = b"CH8R"
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct("<4sBIIBI20sB")
+RECORDING_TRANSITION = struct.Struct("<IB")
+
+# Write a recording dictionary to a file
+def recording_save(path, recording):
+    name = recording["file"].encode()
+    data = bytearray(RECORDING_HEADER.pack(
+        RECORDING_MAGIC, RECORDING_VERSION, recording["seed"],
+        recording["ips"], recording["shift_VY"], recording["frames"],
+        recording["rom_sha1"], len(name)))
+    data += name
+    for frame, key, pressed in recording["transitions"]:
+        data += RECORDING_TRANSITION.pack(frame, key | (pressed << 7))
+    with open(path, "wb") as f:
+        f.write(data)
+
+# Returns the recording dictionary stored in a file
+def recording_load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    (magic, version, seed, ips, shift_VY, frames, sha1,
+     name_size) = RECORDING_HEADER.unpack_from(data)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError("NOT A CHIP-8 RECORDING OR UNSUPPORTED VERSION")
+    offset = RECORDING_HEADER.size
+    file = data[offset:offset+name_size].decode()
+    offset += name_size
+
+    transitions = [(frame, key & 0x0F, key >> 7) for frame, key in
+                   RECORDING_TRANSITION.iter_unpack(data[offset:])]
+    return {"file": file, "seed": seed, "ips": ips, "shift_VY": shift_VY,
+            "frames": frames, "rom_sha1": sha1, "transitions": transitions}
+
+# Records the key transitions of a CHIP8 instance. The keys are compared once
+# per frame, after the events are processed and before the frame runs, which
+# is the only moment the CPU can observe them. file is a ROM of the library
+# in directory
+class InputRecorder:
+    def __init__(self, chip8, file, ips, path, directory="roms"):
+        self.chip8 = chip8
+        self.path = path
+        sha1 = bytes.fromhex(library.ROMLibrary(directory).hashes[file])
+        self.recording = {"file": file, "seed": chip8.seed, "ips": ips,
+                          "shift_VY": chip8.shift_VY, "frames": 0,
+                          "rom_sha1": sha1, "transitions": []}
+        self.keys = bytes(chip8.keys_pressed)
+
+    # Log the keys that changed since the previous frame
+    def frame_record(self, frame):
+        keys_pressed = self.chip8.keys_pressed
+        if keys_pressed != self.keys:
+            for key in range(16):
+                if keys_pressed[key] != self.keys[key]:
+                    self.recording["transitions"].append((frame, key, keys_pressed[key]))
+            self.keys = bytes(keys_pressed)
+        self.recording["frames"] = frame + 1
+
+    # Write the recording to its file
+    def save(self):
+        recording_save(self.path, self.recording)
+
+    # Recorder counters
+    def stats(self):
+        return {
+            "frames": self.recording["frames"],
+            "transitions": len(self.recording["transitions"])
+        }
+
+# Run a recording headless as fast as possible. Returns the list of
+# framebuffer hashes, one per frame, and the crash description if the ROM
+# raised an exception. Reaching the end of the system memory ends the run.
+# The ROM is taken from the library in directory
+def replay(recording, engine="table", directory="roms"):
+    rom_library = library.ROMLibrary(directory)
+    sha1 = rom_library.hashes.get(recording["file"])
+    if sha1 is None or bytes.fromhex(sha1) != recording["rom_sha1"]:
+        raise ValueError("ROM " + recording["file"] + " DOES NOT MATCH THE RECORDING")
+
+    chip8 = computer.CHIP8(seed=recording["seed"])
+    chip8.shift_VY = recording["shift_VY"]
+    rom_library.chip8_load(chip8, sha1)
+    frame_scheduler = scheduler.FrameScheduler(
+        chip8, engines.engine_create(engine, chip8), recording["ips"], False)
+
+    transitions = recording["transitions"]
+    next_transition = 0
+    hashes = []
+    crash = None
+    try:
+        for frame in range(recording["frames"]):
+            while (next_transition < len(transitions) and
+                   transitions[next_transition][0] == frame):
+                key, pressed = transitions[next_transition][1:]
+                chip8.keys_pressed[key] = pressed
+                next_transition += 1
+            frame_scheduler.frame()
+            hashes.append(headless.framebuffer_hash(chip8))
+    except IndexError as exception:
+        if chip8.register_PC < len(chip8.system_memory) - 1:
+            crash = headless.crash_describe(chip8, exception)
+    except Exception as exception:
+        crash = headless.crash_describe(chip8, exception)
+    return hashes, crash
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay a CHIP-8 input recording without a window")
+    parser.add_argument("recording", help="file written by main.py")
+    parser.add_argument("--engine", default="table",
+                        choices=sorted(engines.engines))
+    parser.add_argument("--roms", default="roms",
+                        help="directory of the ROM library")
+    parser.add_argument("--hashes", default=None,
+                        help="file to write the framebuffer hash of every "
+                             "frame to, one per line")
+    parser.add_argument("--check", default=None,
+                        help="hashes file of an earlier replay to compare "
+                             "with, exits with status 1 on a mismatch")
+    args = parser.parse_args()
+
+    recording = recording_load(args.recording)
+    start_time = time.perf_counter()
+    hashes, crash = replay(recording, args.engine, args.roms)
+    elapsed = time.perf_counter() - start_time
+
+    print("FILE:", recording["file"])
+    print("SEED:", recording["seed"])
+    print("FRAMES:", len(hashes))
+    print("TRANSITIONS:", len(recording["transitions"]))
+    print("SECONDS:", format(elapsed, ".3f"))
+    if crash is not None:
+        print("CRASH:", crash["reason"], "AT", format(crash["pc"], "04X"),
+              "(" + crash["exception"] + ")")
+
+    if args.hashes is not None:
+        with open(args.hashes, "w") as f:
+            f.write("\n".join(hashes) + "\n")
+
+    if args.check is not None:
+        with open(args.check) as f:
+            expected = f.read().split()
+        for frame in range(max(len(hashes), len(expected))):
+            if frame >= len(hashes) or frame >= len(expected) or hashes[frame] != expected[frame]:
+                print("MISMATCH AT FRAME", frame)
+                sys.exit(1)
+        print("MATCH")
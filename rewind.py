@@ -0,0 +1,116 @@
+# This module contains the rewind buffer. It keeps the last seconds of
+# execution as a ring of per-frame snapshots, each one holding the full
+# register file plus the changes to the system and video memory since the
+# previous frame, so memory use stays small and bounded.
+
+import array
+import collections
+import struct
+import time
+
+import computer
+
+# PC, I, delay timer, sound timer, V0-VF and stack depth. The stack entries
+# follow as 16-bit values
+REGISTERS = struct.Struct("<HIBB16sH")
+
+# Memory is compared in pages of this many bytes. Each changed page is stored
+# as its XOR with the previous frame, trimmed of unchanged bytes at both ends
+DELTA_PAGE_SIZE = 64
+
+# Amount of recent capture times kept to compute the mean
+CAPTURE_TIMES_MAX = 600
+
+# Ring buffer of frame snapshots for a CHIP8 instance. The keys and the
+# random number generator are not rewound
+class RewindBuffer:
+    def __init__(self, chip8, seconds, frame_rate=60):
+        self.chip8 = chip8
+
+        # Each snapshot is a (registers, delta) tuple. delta lists the
+        # (offset, bytes) runs of the XOR between the memory of the frame and
+        # the memory of the previous one, one run per changed page
+        self.snapshots = collections.deque(maxlen=max(1, int(seconds * frame_rate)))
+
+        # System and video memory of the newest snapshot
+        self.memory = self.memory_get()
+
+        # Statistics
+        self.delta_bytes = 0
+        self.capture_times = collections.deque(maxlen=CAPTURE_TIMES_MAX)
+
+    # Returns the system memory followed by the video memory
+    def memory_get(self):
+        return bytes(self.chip8.system_memory) + bytes(self.chip8.video_memory)
+
+    # Snapshot the current frame. Meant to be called once per frame
+    def capture(self):
+        start_time = time.perf_counter()
+        chip8 = self.chip8
+
+        registers = REGISTERS.pack(chip8.register_PC, chip8.register_I,
+                                   chip8.delay_timer, chip8.sound_timer,
+                                   bytes(chip8.register_V), len(chip8.stack))
+        registers += struct.pack("<%dH" % len(chip8.stack), *chip8.stack)
+
+        memory = self.memory_get()
+        delta = []
+        if memory != self.memory:
+            previous = self.memory
+            for offset in range(0, len(memory), DELTA_PAGE_SIZE):
+                page = memory[offset:offset+DELTA_PAGE_SIZE]
+                previous_page = previous[offset:offset+DELTA_PAGE_SIZE]
+                if page != previous_page:
+                    xor = (int.from_bytes(page, "big") ^
+                           int.from_bytes(previous_page, "big")).to_bytes(len(page), "big")
+                    run = xor.lstrip(b"\x00")
+                    delta.append((offset + len(xor) - len(run), run.rstrip(b"\x00")))
+        self.memory = memory
+
+        if len(self.snapshots) == self.snapshots.maxlen:
+            self.delta_bytes -= sum(len(run) for offset, run in self.snapshots[0][1])
+        self.delta_bytes += sum(len(run) for offset, run in delta)
+        self.snapshots.append((registers, delta))
+        self.capture_times.append(time.perf_counter() - start_time)
+
+    # Restore the machine to the frame before the newest snapshot and drop
+    # the newest one. Returns False when there is nothing left to rewind
+    def step_back(self):
+        if len(self.snapshots) < 2:
+            return False
+
+        # Undo the newest delta to get the memory of the previous frame
+        registers, delta = self.snapshots.pop()
+        self.delta_bytes -= sum(len(run) for offset, run in delta)
+        xor = bytearray(len(self.memory))
+        for offset, run in delta:
+            xor[offset:offset+len(run)] = run
+        self.memory = (int.from_bytes(self.memory, "little") ^
+                       int.from_bytes(xor, "little")).to_bytes(len(self.memory), "little")
+
+        chip8 = self.chip8
+        registers = self.snapshots[-1][0]
+        (chip8.register_PC, chip8.register_I, chip8.delay_timer,
+         chip8.sound_timer, register_V, stack_depth) = REGISTERS.unpack_from(registers)
+        chip8.register_V[:] = register_V
+        chip8.stack[:] = array.array("H", struct.unpack_from("<%dH" % stack_depth,
+                                                             registers, REGISTERS.size))
+
+        memory_size = len(chip8.system_memory)
+        chip8.system_memory[:] = self.memory[:memory_size]
+        chip8.video_memory[:] = self.memory[memory_size:]
+        chip8.memory_epoch += 1
+        chip8.video_draw_flag = 1
+        chip8.video_dirty_rows = computer.VIDEO_ROWS_ALL
+        return True
+
+    # Rewind buffer statistics
+    def stats(self):
+        registers_bytes = sum(len(registers) for registers, delta in self.snapshots)
+        times = self.capture_times
+        return {
+            "snapshots": len(self.snapshots),
+            "snapshots_max": self.snapshots.maxlen,
+            "bytes": registers_bytes + self.delta_bytes,
+            "capture_us_mean": 1e6 * sum(times) / len(times) if times else 0.0
+        }
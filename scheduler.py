@@ -0,0 +1,70 @@
+# This module contains the frame scheduler. It splits the emulated time in
+# 60 Hz frames, runs the configured amount of instructions on every frame,
+# ticks the delay and sound timers exactly once per frame and paces the
+# frames against the host's clock.
+
+import time
+
+# Frames per second of the CHIP-8 timers and display
+FRAME_RATE = 60
+
+# When the host falls further behind than this many frames the schedule is
+# reset instead of running frames back to back to catch up
+FRAMES_BEHIND_MAX = 6
+
+# Runs a CHIP8 instance one frame at a time. When throttled, wait() sleeps
+# until the next frame is due, otherwise frames run as fast as the host can
+class FrameScheduler:
+    def __init__(self, chip8, engine, instructions_per_second, throttled=True):
+        self.chip8 = chip8
+        self.engine = engine
+        self.instructions_per_second = instructions_per_second
+        self.throttled = throttled
+        self.frame_time = 1 / FRAME_RATE
+
+        # Counters
+        self.frames = 0
+        self.cycles = 0
+        self.frames_late = 0
+
+        # perf_counter time when the next frame is due
+        self.frame_deadline = time.perf_counter() + self.frame_time
+
+    # Instructions to execute on the current frame. Spreads the remainder of
+    # instructions_per_second / FRAME_RATE so every second runs exactly
+    # instructions_per_second instructions
+    def frame_cycles(self):
+        ips = self.instructions_per_second
+        return ((self.frames + 1) * ips // FRAME_RATE) - (self.frames * ips // FRAME_RATE)
+
+    # Execute one frame worth of instructions and tick the timers
+    def frame(self):
+        cycles = self.frame_cycles()
+        self.engine.run(cycles)
+        self.chip8.timers_tick()
+        self.cycles += cycles
+        self.frames += 1
+
+    # Sleep until the next frame is due. Deadlines advance by a fixed step
+    # from the first frame, so sleep overshoots are absorbed by the next
+    # frame instead of accumulating as drift
+    def wait(self):
+        if not self.throttled:
+            return
+
+        delay = self.frame_deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.frames_late += 1
+            if -delay > FRAMES_BEHIND_MAX * self.frame_time:
+                self.frame_deadline = time.perf_counter()
+        self.frame_deadline += self.frame_time
+
+    # Scheduler counters
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "cycles": self.cycles,
+            "frames_late": self.frames_late
+        }
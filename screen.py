@@ -1,25 +1,82 @@
-# This module contains functions to read the video memory and draw 
+# This module contains functions to read the video memory and draw
 # to the screen after a DXYN instruction.
 
+import collections
+import time
+
 import pygame
 
-# Draw a pixel to the screen
-def pixel_draw(canvas, profile, x, y, pixel_bit):
-	if pixel_bit == 1:
-		x1 = x * profile["zoom"]
-		y1 = y * profile["zoom"]
-
-		pygame.draw.rect(canvas, profile["foreground_color"], 
-						(x1, y1, profile["zoom"], profile["zoom"]), 0)
-
-# Draw the entire video memory to the screen
-def frame_draw(chip8, canvas, profile):
-	# Clear the current frame before drawing a new one
-	canvas.fill(profile["background_color"])
-	
-	i = 0
-	for y in range(32):
-		for x in range(64):
-			pixel_draw(canvas, profile, x, y, chip8.video_memory[i])
-			i = i + 1
-	chip8.video_draw_flag = 0
+# Amount of recent frame render times kept to compute percentiles
+RENDER_TIMES_MAX = 1000
+
+# Mirrors the video memory on a 64x32 8-bit surface whose palette holds the
+# profile's colors. Only the rows flagged in chip8.video_dirty_rows are
+# copied, scaled with a single blit per group of contiguous rows and pushed to
+# the display
+class Renderer:
+	def __init__(self, canvas, profile):
+		self.canvas = canvas
+		self.zoom = profile["zoom"]
+		palette = [profile["background_color"], profile["foreground_color"]]
+
+		# One byte per pixel shared with the 64x32 surface, so writing the
+		# buffer updates the surface without any conversion
+		self.pixels = bytearray(64 * 32)
+		self.surface = pygame.image.frombuffer(self.pixels, (64, 32), "P")
+		self.surface.set_palette(palette)
+
+		# Scaled copy of the surface, blitted to the canvas row by row
+		self.scaled = pygame.Surface((64 * self.zoom, 32 * self.zoom), depth=8)
+		self.scaled.set_palette(palette)
+
+		# Render time statistics in seconds
+		self.frames = 0
+		self.render_time_total = 0.0
+		self.render_times = collections.deque(maxlen=RENDER_TIMES_MAX)
+
+	# Draw the changed rows of the video memory to the canvas. Returns the
+	# list of canvas rectangles that must be updated on the display
+	def frame_draw(self, chip8):
+		start_time = time.perf_counter()
+		zoom = self.zoom
+		dirty_rows = chip8.video_dirty_rows
+		rects = []
+
+		y = 0
+		while dirty_rows:
+			# Skip clean rows, then find the end of the dirty band
+			while not dirty_rows & 1:
+				dirty_rows >>= 1
+				y += 1
+			top = y
+			while dirty_rows & 1:
+				self.pixels[y*64:(y+1)*64] = chip8.video_row_pixels(y)
+				dirty_rows >>= 1
+				y += 1
+
+			band = (0, top * zoom, 64 * zoom, (y - top) * zoom)
+			pygame.transform.scale(self.surface.subsurface((0, top, 64, y - top)),
+								(band[2], band[3]), self.scaled.subsurface(band))
+			rects.append(self.canvas.blit(self.scaled, band[:2], band))
+
+		chip8.video_dirty_rows = 0
+		chip8.video_draw_flag = 0
+
+		render_time = time.perf_counter() - start_time
+		self.frames += 1
+		self.render_time_total += render_time
+		self.render_times.append(render_time)
+		return rects
+
+	# Render time statistics in milliseconds
+	def stats(self):
+		times = sorted(self.render_times)
+		if not times:
+			return {"frames": 0}
+		return {
+			"frames": self.frames,
+			"render_ms_mean": 1000 * self.render_time_total / self.frames,
+			"render_ms_p50": 1000 * times[len(times) // 2],
+			"render_ms_p95": 1000 * times[int(len(times) * 0.95)],
+			"render_ms_max": 1000 * times[-1]
+		}
@@ -0,0 +1,335 @@
+# This module contains a server hosting many CHIP8 sessions in a single
+# process. Clients connect over a Unix or TCP socket on localhost, open a
+# ROM, send key events and receive the rows of the framebuffer that changed
+# on every frame that drew something. A single 60 Hz tick runs one frame of
+# every session, starting from a different session on every tick so none of
+# them is always served last.
+
+import argparse
+import asyncio
+import collections
+import json
+import struct
+import sys
+import time
+
+import computer
+import engines
+import headless
+import library
+import profiler
+import scheduler
+
+# Every message is a type and a payload length followed by the payload
+MESSAGE = struct.Struct("<BH")
+
+# Client messages: open a ROM by name or SHA-1, set a key with a payload of
+# the key and 1 or 0, and ask for the statistics, answered with a
+# MESSAGE_STATS holding them as JSON
+MESSAGE_OPEN = 1
+MESSAGE_KEY = 2
+MESSAGE_STATS = 3
+
+# Server messages: the rows of the framebuffer that changed, and errors as
+# text. A delta holds the frame number and a mask of the rows it carries,
+# followed by the 8 bytes of each of them from the top
+MESSAGE_DELTA = 4
+MESSAGE_ERROR = 5
+DELTA = struct.Struct("<II")
+
+# Bytes waiting to be sent to a client after which its deltas are merged
+# into the next one instead of queueing more, so slow clients only skip
+# frames
+WRITE_BUFFER_MAX = 64 * 1024
+
+# Amount of recent samples kept to compute percentiles
+SAMPLES_MAX = 1000
+
+# Returns a message of the given type
+def message_pack(kind, payload=b""):
+    return MESSAGE.pack(kind, len(payload)) + payload
+
+# Returns the type and payload of the next message of reader. Raises
+# asyncio.IncompleteReadError when the connection closes
+async def message_read(reader):
+    kind, length = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+    payload = await reader.readexactly(length) if length else b""
+    return kind, payload
+
+# Returns the payload of a delta with the given rows of video_memory
+def delta_pack(frame, video_memory, rows):
+    payload = bytearray(DELTA.pack(frame, rows))
+    y = 0
+    while rows >> y:
+        if rows >> y & 1:
+            payload += video_memory[y*computer.VIDEO_ROW_SIZE:(y+1)*computer.VIDEO_ROW_SIZE]
+        y += 1
+    return bytes(payload)
+
+# Copy the rows of a delta payload into video_memory. Returns the frame
+# number and the mask of the rows
+def delta_apply(video_memory, payload):
+    frame, rows = DELTA.unpack_from(payload)
+    offset = DELTA.size
+    y = 0
+    while rows >> y:
+        if rows >> y & 1:
+            video_memory[y*computer.VIDEO_ROW_SIZE:(y+1)*computer.VIDEO_ROW_SIZE] = \
+                payload[offset:offset+computer.VIDEO_ROW_SIZE]
+            offset += computer.VIDEO_ROW_SIZE
+        y += 1
+    return frame, rows
+
+# Returns the mean, p50, p95 and max of samples in milliseconds, with names
+# starting with name
+def samples_stats(name, samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        name + "_ms_mean": 1000 * sum(samples) / len(samples),
+        name + "_ms_p50": 1000 * profiler.percentile(samples, 0.50),
+        name + "_ms_p95": 1000 * profiler.percentile(samples, 0.95),
+        name + "_ms_max": 1000 * samples[-1]
+    }
+
+# A CHIP8 running for a client. The first frame sends the whole framebuffer
+class Session:
+    def __init__(self, number, chip8, writer, engine, ips):
+        self.number = number
+        self.chip8 = chip8
+        self.writer = writer
+        self.engine = engines.engine_create(engine, chip8)
+        self.frame_scheduler = scheduler.FrameScheduler(chip8, self.engine, ips, False)
+        self.crash = None
+
+        # Rows changed since the last delta sent
+        self.dirty_rows = computer.VIDEO_ROWS_ALL
+
+        # perf_counter time of the oldest key event not followed by a delta
+        # yet, and the time from key events to their deltas
+        self.key_time = None
+        self.latencies = collections.deque(maxlen=SAMPLES_MAX)
+
+        # Counters
+        self.start_time = time.perf_counter()
+        self.cpu_time = 0.0
+        self.keys = 0
+        self.deltas = 0
+        self.deltas_merged = 0
+        self.delta_bytes = 0
+
+    # Set the state of a hex key
+    def key_set(self, key, pressed):
+        self.chip8.keys_pressed[key] = pressed
+        self.keys += 1
+        if self.key_time is None:
+            self.key_time = time.perf_counter()
+
+    # Run one frame and send the rows it changed, if any. A crash stops the
+    # session and is reported to the client
+    def frame(self):
+        chip8 = self.chip8
+        start_time = time.perf_counter()
+        try:
+            self.frame_scheduler.frame()
+        except Exception as exception:
+            self.crash = headless.crash_describe(chip8, exception)
+            self.writer.write(message_pack(MESSAGE_ERROR,
+                ("CRASH: " + self.crash["reason"]).encode()))
+        end_time = time.perf_counter()
+        self.cpu_time += end_time - start_time
+
+        if chip8.video_draw_flag:
+            self.dirty_rows |= chip8.video_dirty_rows
+            chip8.video_dirty_rows = 0
+            chip8.video_draw_flag = 0
+        if not self.dirty_rows:
+            return
+        if self.writer.transport.get_write_buffer_size() > WRITE_BUFFER_MAX:
+            self.deltas_merged += 1
+            return
+
+        payload = delta_pack(self.frame_scheduler.frames, chip8.video_memory, self.dirty_rows)
+        self.writer.write(message_pack(MESSAGE_DELTA, payload))
+        self.dirty_rows = 0
+        self.deltas += 1
+        self.delta_bytes += MESSAGE.size + len(payload)
+        if self.key_time is not None:
+            self.latencies.append(end_time - self.key_time)
+            self.key_time = None
+
+    # Session counters. "ips" is measured on the CPU time of the session and
+    # "cpu_share" is the fraction of the wall time it took
+    def stats(self):
+        elapsed = time.perf_counter() - self.start_time
+        stats = {
+            "session": self.number,
+            "frames": self.frame_scheduler.frames,
+            "cycles": self.frame_scheduler.cycles,
+            "ips": self.frame_scheduler.cycles / self.cpu_time if self.cpu_time > 0 else 0.0,
+            "cpu_share": self.cpu_time / elapsed if elapsed > 0 else 0.0,
+            "keys": self.keys,
+            "deltas": self.deltas,
+            "deltas_merged": self.deltas_merged,
+            "delta_bytes": self.delta_bytes,
+            "crash": self.crash
+        }
+        stats.update(samples_stats("key_to_delta", self.latencies))
+        return stats
+
+# Hosts the sessions and runs their frames. Every session runs ips
+# instructions per second on the named engine
+class SessionServer:
+    def __init__(self, engine="table", ips=600, directory="roms"):
+        self.engine = engine
+        self.ips = ips
+        self.rom_library = library.ROMLibrary(directory)
+        self.sessions = []
+        self.sessions_opened = 0
+
+        # Counters
+        self.ticks = 0
+        self.ticks_late = 0
+        self.tick_time_total = 0.0
+        self.tick_times = collections.deque(maxlen=SAMPLES_MAX)
+
+    # Serve a client until it disconnects
+    async def client_handle(self, reader, writer):
+        session = None
+        try:
+            while True:
+                kind, payload = await message_read(reader)
+                if kind == MESSAGE_OPEN and session is None:
+                    session = self.session_open(payload.decode(errors="replace"), writer)
+                elif kind == MESSAGE_KEY and session is not None and len(payload) == 2:
+                    if payload[0] < 16:
+                        session.key_set(payload[0], int(payload[1] != 0))
+                elif kind == MESSAGE_STATS:
+                    stats = self.stats()
+                    if session is not None:
+                        stats["session"] = session.stats()
+                    writer.write(message_pack(MESSAGE_STATS, json.dumps(stats).encode()))
+                else:
+                    writer.write(message_pack(MESSAGE_ERROR, b"UNEXPECTED MESSAGE"))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if session is not None:
+                self.sessions.remove(session)
+            writer.close()
+
+    # Start a session running rom for the client of writer. Returns None and
+    # reports the error to the client if the ROM can't be loaded
+    def session_open(self, rom, writer):
+        chip8 = computer.CHIP8(seed=self.sessions_opened)
+        try:
+            self.rom_library.chip8_load(chip8, rom)
+        except KeyError as exception:
+            writer.write(message_pack(MESSAGE_ERROR, exception.args[0].encode()))
+            return None
+        except (OSError, ValueError) as exception:
+            writer.write(message_pack(MESSAGE_ERROR, str(exception).encode()))
+            return None
+        session = Session(self.sessions_opened, chip8, writer, self.engine, self.ips)
+        self.sessions_opened += 1
+        self.sessions.append(session)
+        return session
+
+    # Run one frame of every session on every 60 Hz tick. Like
+    # scheduler.FrameScheduler, deadlines advance by a fixed step and a
+    # server too far behind resets them instead of catching up
+    async def ticks_run(self):
+        frame_time = 1 / scheduler.FRAME_RATE
+        deadline = time.perf_counter() + frame_time
+        while True:
+            start_time = time.perf_counter()
+            sessions = self.sessions
+            if sessions:
+                first = self.ticks % len(sessions)
+                for session in sessions[first:] + sessions[:first]:
+                    if session.crash is None:
+                        session.frame()
+            tick_time = time.perf_counter() - start_time
+            self.ticks += 1
+            self.tick_time_total += tick_time
+            self.tick_times.append(tick_time)
+
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.ticks_late += 1
+                if -delay > scheduler.FRAMES_BEHIND_MAX * frame_time:
+                    deadline = time.perf_counter()
+                # Let the clients' I/O run before the next tick
+                await asyncio.sleep(0)
+            deadline += frame_time
+
+    # Server counters. "load" is the mean time of the recent ticks over the
+    # frame time, above 1 the sessions run slower than real time
+    def stats(self):
+        stats = {
+            "sessions": len(self.sessions),
+            "sessions_opened": self.sessions_opened,
+            "engine": self.engine,
+            "ips": self.ips,
+            "ticks": self.ticks,
+            "ticks_late": self.ticks_late,
+            "tick_seconds": self.tick_time_total
+        }
+        stats.update(samples_stats("tick", self.tick_times))
+        if self.tick_times:
+            stats["load"] = (sum(self.tick_times) / len(self.tick_times) *
+                             scheduler.FRAME_RATE)
+        return stats
+
+# Print the server counters to stderr every interval seconds
+async def stats_print(server, interval):
+    while True:
+        await asyncio.sleep(interval)
+        stats = server.stats()
+        print("SESSIONS:", stats["sessions"], "TICKS LATE:", stats["ticks_late"],
+              "TICK P95 MS:", format(stats.get("tick_ms_p95", 0.0), ".2f"),
+              "LOAD:", format(stats.get("load", 0.0), ".2f"), file=sys.stderr)
+
+# Listen on the Unix socket path, or on host and port when it's None, and
+# serve until cancelled
+async def serve(server, path=None, host="127.0.0.1", port=8765, stats_interval=0):
+    if path is not None:
+        listener = await asyncio.start_unix_server(server.client_handle, path)
+    else:
+        listener = await asyncio.start_server(server.client_handle, host, port)
+    tasks = [asyncio.ensure_future(server.ticks_run())]
+    if stats_interval > 0:
+        tasks.append(asyncio.ensure_future(stats_print(server, stats_interval)))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Host many CHIP-8 sessions in one process")
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument("--unix", default=None, help="Unix socket path to listen on")
+    address.add_argument("--port", type=int, default=8765,
+                         help="TCP port to listen on, on --host")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--engine", default="table",
+                        choices=sorted(engines.engines))
+    parser.add_argument("--ips", type=int, default=600,
+                        help="instructions per second of every session")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="seconds between statistics printed to stderr, "
+                             "0 disables them")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(SessionServer(args.engine, args.ips), args.unix,
+                          args.host, args.port, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
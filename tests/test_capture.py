@@ -0,0 +1,82 @@
+# Tests of the capture exports. Run with python -m unittest from the root of
+# the repository.
+
+import os
+import struct
+import tempfile
+import unittest
+
+import capture
+import computer
+
+# Returns the delays of the images of a GIF file, in hundredths of a second,
+# as a list of (delay, transparent, width, height) tuples
+def gif_images_read(file):
+    with open(file, "rb") as f:
+        data = f.read()
+    flags = data[10]
+    offset = 13 + (3 << ((flags & 7) + 1) if flags & 0x80 else 0)
+    images = []
+    control = None
+    while data[offset] != 0x3b:
+        if data[offset] == 0x21:
+            label = data[offset+1]
+            offset += 2
+            if label == 0xf9:
+                packed, delay = struct.unpack_from("<BH", data, offset + 1)
+                control = (delay, bool(packed & 1))
+            while data[offset]:
+                offset += 1 + data[offset]
+            offset += 1
+        elif data[offset] == 0x2c:
+            width, height, flags = struct.unpack_from("<HHB", data, offset + 5)
+            offset += 10
+            if flags & 0x80:
+                offset += 3 << ((flags & 7) + 1)
+            offset += 1
+            while data[offset]:
+                offset += 1 + data[offset]
+            offset += 1
+            images.append(control + (width, height))
+            control = None
+        else:
+            raise ValueError("BAD GIF BLOCK AT " + str(offset))
+    return images
+
+class GIFExportTest(unittest.TestCase):
+    def gif_export(self, frames):
+        recorder = capture.FrameCapture()
+        for frame, repeats in frames:
+            for _ in range(repeats):
+                recorder.frame_add(frame)
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "capture.gif")
+            capture.gif_export(recorder, file)
+            return gif_images_read(file)
+
+    def test_short_hold(self):
+        blank = bytes(computer.VIDEO_MEMORY_SIZE)
+        lit = b"\xff" + blank[1:]
+        images = self.gif_export([(blank, 60), (lit, 30)])
+        self.assertEqual(images, [(100, False, 64, 32), (50, False, 64, 1)])
+
+    # 50000 frames last 83333 hundredths of a second, more than a graphic
+    # control block holds
+    def test_long_hold(self):
+        blank = bytes(computer.VIDEO_MEMORY_SIZE)
+        lit = b"\xff" + blank[1:]
+        images = self.gif_export([(blank, 50000), (lit, 1)])
+        self.assertEqual(images[0], (capture.GIF_DELAY_MAX, False, 64, 32))
+        self.assertEqual(images[1], (83333 - capture.GIF_DELAY_MAX, True, 1, 1))
+        self.assertEqual(images[2], (round(50001 * 100 / 60) - 83333, False, 64, 1))
+        self.assertEqual(len(images), 3)
+
+    def test_hold_over_two_blocks(self):
+        blank = bytes(computer.VIDEO_MEMORY_SIZE)
+        images = self.gif_export([(blank, 100000)])
+        self.assertTrue(all(image[0] <= capture.GIF_DELAY_MAX for image in images))
+        self.assertEqual(sum(image[0] for image in images), round(100000 * 100 / 60))
+        self.assertEqual(len(images), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,476 @@
+# This module contains a batched CHIP-8 that runs many machines in lockstep
+# with NumPy. The machines are stored as struct of arrays, one row per
+# instance, and every step executes one instruction on all of them: the
+# instances are grouped by opcode and each group runs through a vectorized
+# handler that only touches its rows. Every instance reproduces the exact
+# behaviour of CHIP8.cpu_cycle, quirks and crashes included.
+
+import argparse
+import array
+import random
+import time
+
+import numpy as np
+
+import computer
+import dispatch
+
+# Return addresses kept per instance. CHIP8.stack is an unbounded list, here
+# a call past this depth stops the instance like a crash
+STACK_SIZE = 64
+
+MEMORY_SIZE = 4096
+
+# Handler names in the order of the group indexes below
+opcode_names = sorted({handler.__name__ for handler in dispatch.instruction_handlers})
+
+# Group index of every instruction, the position of its dispatch handler's
+# name in opcode_names
+opcode_groups = np.array([opcode_names.index(handler.__name__)
+                          for handler in dispatch.instruction_handlers], dtype=np.intp)
+
+# count CHIP8 machines executing in lockstep. Instance i seeds its CXNN
+# random number generator with seed + i. An instance stops when its
+# instruction raises the exception CHIP8.cpu_cycle would raise, which is
+# flagged in faults, leaving its PC at the faulting instruction and any
+# partial writes made before the exception
+class VectorCHIP8:
+    def __init__(self, count, seed=0, shift_VY=0):
+        self.count = count
+        self.shift_VY = shift_VY
+        template = computer.CHIP8()
+
+        # Memory. Each video memory row is a big endian 64-bit word, so the
+        # bytes of an instance keep the CHIP8.video_memory layout
+        self.system_memory = np.empty((count, MEMORY_SIZE), dtype=np.uint8)
+        self.system_memory[:] = template.system_memory
+        self.video_memory = np.zeros((count, 32), dtype=">u8")
+        self.stack = np.zeros((count, STACK_SIZE), dtype=np.int64)
+        self.stack_depth = np.zeros(count, dtype=np.int64)
+
+        # Registers
+        self.register_V = np.zeros((count, 16), dtype=np.uint8)
+        self.delay_timer = np.zeros(count, dtype=np.uint8)
+        self.sound_timer = np.zeros(count, dtype=np.uint8)
+        self.register_I = np.zeros(count, dtype=np.int64)
+        self.register_PC = np.full(count, 0x0200, dtype=np.int64)
+
+        # Pseudo registers
+        self.video_draw_flag = np.zeros(count, dtype=np.uint8)
+        self.keys_pressed = np.zeros((count, 16), dtype=np.uint8)
+        self.faults = np.zeros(count, dtype=bool)
+
+        self.seeds = [seed + i for i in range(count)]
+        self.rngs = [random.Random(seed) for seed in self.seeds]
+
+        self.handlers = [getattr(self, name) for name in opcode_names]
+        self.steps = 0
+        self.instructions = 0
+
+    # Load a ROM inside the roms directory on every instance, or on the
+    # instances listed in instances
+    def file_open(self, file_name, instances=slice(None)):
+        with open("roms/" + file_name, "rb") as f:
+            file_bytes = f.read()
+        self.system_memory[instances, 0x200:0x200+len(file_bytes)] = np.frombuffer(file_bytes, dtype=np.uint8)
+
+    # Returns the 64x32 pixels of every instance, one byte per pixel set to
+    # 0 or 1, as a count x 32 x 64 array
+    def video_pixels(self):
+        return np.unpackbits(self.video_memory.view(np.uint8).reshape(self.count, 32, 8), axis=2)
+
+    # Returns a CHIP8 holding a copy of the state of an instance
+    def chip8_get(self, instance):
+        chip8 = computer.CHIP8(seed=self.seeds[instance])
+        chip8.system_memory[:] = self.system_memory[instance].tobytes()
+        chip8.video_memory[:] = self.video_memory[instance].tobytes()
+        chip8.stack[:] = array.array("H", self.stack[instance, :self.stack_depth[instance]].tolist())
+        chip8.register_V[:] = self.register_V[instance].tobytes()
+        chip8.delay_timer = int(self.delay_timer[instance])
+        chip8.sound_timer = int(self.sound_timer[instance])
+        chip8.register_I = int(self.register_I[instance])
+        chip8.register_PC = int(self.register_PC[instance])
+        chip8.video_draw_flag = int(self.video_draw_flag[instance])
+        chip8.keys_pressed[:] = self.keys_pressed[instance].tobytes()
+        chip8.shift_VY = self.shift_VY
+        chip8.rng.setstate(self.rngs[instance].getstate())
+        return chip8
+
+    # Copy the state of a CHIP8 into an instance
+    def chip8_set(self, instance, chip8):
+        self.system_memory[instance] = chip8.system_memory
+        self.video_memory[instance] = np.frombuffer(bytes(chip8.video_memory), dtype=">u8")
+        self.stack[instance, :len(chip8.stack)] = chip8.stack
+        self.stack_depth[instance] = len(chip8.stack)
+        self.register_V[instance] = chip8.register_V
+        self.delay_timer[instance] = chip8.delay_timer
+        self.sound_timer[instance] = chip8.sound_timer
+        self.register_I[instance] = chip8.register_I
+        self.register_PC[instance] = chip8.register_PC
+        self.video_draw_flag[instance] = chip8.video_draw_flag
+        self.keys_pressed[instance] = chip8.keys_pressed
+        self.rngs[instance].setstate(chip8.rng.getstate())
+        self.faults[instance] = False
+
+    # Execute one instruction on every instance that hasn't faulted. Returns
+    # the amount of instances that executed it
+    def step(self):
+        register_PC = self.register_PC
+        instances = np.flatnonzero(~self.faults)
+
+        # Fetching the last byte of memory or past it raises in cpu_cycle
+        pc = register_PC[instances]
+        fetch_faults = pc >= MEMORY_SIZE - 1
+        if fetch_faults.any():
+            self.faults[instances[fetch_faults]] = True
+            instances = instances[~fetch_faults]
+            pc = pc[~fetch_faults]
+
+        system_memory = self.system_memory
+        instructions = (system_memory[instances, pc].astype(np.int64) << 8) | system_memory[instances, pc+1]
+
+        # Sort the instances by group and run each group's handler once
+        groups = opcode_groups[instructions]
+        order = np.argsort(groups, kind="stable")
+        counts = np.bincount(groups, minlength=len(opcode_names))
+        start = 0
+        for group in np.flatnonzero(counts):
+            end = start + counts[group]
+            selection = order[start:end]
+            self.handlers[group](instances[selection], instructions[selection])
+            start = end
+
+        # Instances that faulted keep their PC on the faulting instruction
+        executed = instances[~self.faults[instances]]
+        register_PC[executed] += 2
+        self.steps += 1
+        self.instructions += len(executed)
+        return len(executed)
+
+    # Execute count steps
+    def run(self, count):
+        for _ in range(count):
+            self.step()
+
+    # Count down the delay and sound timers of every instance. Returns the
+    # mask of instances whose sound timer is running
+    def timers_tick(self):
+        self.delay_timer[self.delay_timer > 0] -= 1
+        sounding = self.sound_timer > 0
+        self.sound_timer[sounding] -= 1
+        return sounding
+
+    # Batch counters
+    def stats(self):
+        return {
+            "instances": self.count,
+            "steps": self.steps,
+            "instructions": self.instructions,
+            "faults": int(self.faults.sum())
+        }
+
+    # Vectorized handlers. Each one receives the instances running it and
+    # their instructions, and mirrors its dispatch counterpart. The PC
+    # increment after the instruction is applied by step()
+
+    # Unknown or unsupported instructions are ignored
+    def op_nop(self, instances, instructions):
+        pass
+
+    # OOEO Clear the screen
+    def op_00e0(self, instances, instructions):
+        self.video_memory[instances] = 0
+        self.video_draw_flag[instances] = 1
+
+    # 00EE Return from a subroutine. An empty stack faults
+    def op_00ee(self, instances, instructions):
+        depth = self.stack_depth[instances]
+        self.faults[instances[depth == 0]] = True
+        returning = depth > 0
+        instances = instances[returning]
+        depth = depth[returning] - 1
+        self.register_PC[instances] = self.stack[instances, depth]
+        self.stack_depth[instances] = depth
+
+    # 1NNN Jump to address NNN
+    def op_1nnn(self, instances, instructions):
+        self.register_PC[instances] = (instructions & 0x0FFF) - 2
+
+    # 2NNN Execute subroutine starting at address NNN. A full stack faults
+    def op_2nnn(self, instances, instructions):
+        depth = self.stack_depth[instances]
+        self.faults[instances[depth == STACK_SIZE]] = True
+        calling = depth < STACK_SIZE
+        instances = instances[calling]
+        depth = depth[calling]
+        self.stack[instances, depth] = self.register_PC[instances]
+        self.stack_depth[instances] = depth + 1
+        self.register_PC[instances] = (instructions[calling] & 0x0FFF) - 2
+
+    # 3XNN Skip the following instruction if VX equals NN
+    def op_3xnn(self, instances, instructions):
+        skip = self.register_V[instances, (instructions & 0x0F00) >> 8] == (instructions & 0x00FF)
+        self.register_PC[instances[skip]] += 2
+
+    # 4XNN Skip the following instruction if VX is not equal to NN
+    def op_4xnn(self, instances, instructions):
+        skip = self.register_V[instances, (instructions & 0x0F00) >> 8] != (instructions & 0x00FF)
+        self.register_PC[instances[skip]] += 2
+
+    # 5XY0 Skip the following instruction if VX equals VY
+    def op_5xy0(self, instances, instructions):
+        register_V = self.register_V
+        skip = (register_V[instances, (instructions & 0x0F00) >> 8] ==
+                register_V[instances, (instructions & 0x00F0) >> 4])
+        self.register_PC[instances[skip]] += 2
+
+    # 6XNN Store number NN in register VX
+    def op_6xnn(self, instances, instructions):
+        self.register_V[instances, (instructions & 0x0F00) >> 8] = instructions & 0x00FF
+
+    # 7XNN Add the value NN to register VX, truncated to 8 bits
+    def op_7xnn(self, instances, instructions):
+        xx = (instructions & 0x0F00) >> 8
+        self.register_V[instances, xx] = (self.register_V[instances, xx] + (instructions & 0x00FF)) & 0xFF
+
+    # 8XY0 Store the value of register VY in register VX
+    def op_8xy0(self, instances, instructions):
+        register_V = self.register_V
+        register_V[instances, (instructions & 0x0F00) >> 8] = register_V[instances, (instructions & 0x00F0) >> 4]
+
+    # 8XY1 Set VX to VX OR VY
+    def op_8xy1(self, instances, instructions):
+        register_V = self.register_V
+        xx = (instructions & 0x0F00) >> 8
+        register_V[instances, xx] |= register_V[instances, (instructions & 0x00F0) >> 4]
+
+    # 8XY2 Set VX to VX AND VY
+    def op_8xy2(self, instances, instructions):
+        register_V = self.register_V
+        xx = (instructions & 0x0F00) >> 8
+        register_V[instances, xx] &= register_V[instances, (instructions & 0x00F0) >> 4]
+
+    # 8XY3 Set VX to VX XOR VY
+    def op_8xy3(self, instances, instructions):
+        register_V = self.register_V
+        xx = (instructions & 0x0F00) >> 8
+        register_V[instances, xx] ^= register_V[instances, (instructions & 0x00F0) >> 4]
+
+    # 8XY4 Add VY to VX. Like in CHIP8.cpu_cycle VF always ends up as 00
+    def op_8xy4(self, instances, instructions):
+        register_V = self.register_V
+        xx = (instructions & 0x0F00) >> 8
+        register_V[instances, xx] += register_V[instances, (instructions & 0x00F0) >> 4]
+        register_V[instances, 0x0F] = 0x00
+
+    # 8XY5 Subtract VY from VX. VF is left unchanged when both are equal and
+    # the operands are read again after VF is written
+    def op_8xy5(self, instances, instructions):
+        register_V = self.register_V
+        xx = (instructions & 0x0F00) >> 8
+        yy = (instructions & 0x00F0) >> 4
+        vx = register_V[instances, xx]
+        vy = register_V[instances, yy]
+        register_V[instances[vx < vy], 0x0F] = 0x00
+        register_V[instances[vx > vy], 0x0F] = 0x01
+        register_V[instances, xx] = register_V[instances, xx] - register_V[instances, yy]
+
+    # 8XY6 Shift VY (or VX if shift_VY is off) right one bit into VX. VF is
+    # set to the least significant bit before the source is read again
+    def op_8xy6(self, instances, instructions):
+        register_V = self.register_V
+        xx = (instructions & 0x0F00) >> 8
+        source = (instructions & 0x00F0) >> 4 if self.shift_VY == 1 else xx
+        register_V[instances, 0x0F] = register_V[instances, source] & 0x01
+        register_V[instances, xx] = register_V[instances, source] >> 1
+
+    # 8XY7 Set VX to VY minus VX, with the same VF rules as 8XY5
+    def op_8xy7(self, instances, instructions):
+        register_V = self.register_V
+        xx = (instructions & 0x0F00) >> 8
+        yy = (instructions & 0x00F0) >> 4
+        vx = register_V[instances, xx]
+        vy = register_V[instances, yy]
+        register_V[instances[vy < vx], 0x0F] = 0x00
+        register_V[instances[vy > vx], 0x0F] = 0x01
+        register_V[instances, xx] = register_V[instances, yy] - register_V[instances, xx]
+
+    # 8XYE Shift VY (or VX if shift_VY is off) left one bit into VX. VF is
+    # set to the most significant bit before the source is read again
+    def op_8xye(self, instances, instructions):
+        register_V = self.register_V
+        xx = (instructions & 0x0F00) >> 8
+        source = (instructions & 0x00F0) >> 4 if self.shift_VY == 1 else xx
+        register_V[instances, 0x0F] = register_V[instances, source] & 0x80
+        register_V[instances, xx] = register_V[instances, source] << 1
+
+    # 9XY0 Skip the following instruction if VX is not equal to VY
+    def op_9xy0(self, instances, instructions):
+        register_V = self.register_V
+        skip = (register_V[instances, (instructions & 0x0F00) >> 8] !=
+                register_V[instances, (instructions & 0x00F0) >> 4])
+        self.register_PC[instances[skip]] += 2
+
+    # ANNN Store memory address NNN in register I
+    def op_annn(self, instances, instructions):
+        self.register_I[instances] = instructions & 0x0FFF
+
+    # BNNN Jump to address NNN + V0
+    def op_bnnn(self, instances, instructions):
+        self.register_PC[instances] = (instructions & 0x0FFF) + self.register_V[instances, 0] - 2
+
+    # CXNN Set VX to a random number with a mask of NN. Every instance draws
+    # from its own generator, so this one runs a Python loop
+    def op_cxnn(self, instances, instructions):
+        numbers = np.array([self.rngs[instance].randrange(0, 255) for instance in instances.tolist()],
+                           dtype=np.int64)
+        self.register_V[instances, (instructions & 0x0F00) >> 8] = numbers & (instructions & 0x00FF)
+
+    # DXYN Draw a sprite at position VX, VY with N bytes of sprite data
+    # starting at the address stored in I, one sprite row of every instance
+    # at a time, like CHIP8.dxyn. Reading past the end of memory faults after
+    # the rows before it were drawn
+    def op_dxyn(self, instances, instructions):
+        register_V = self.register_V
+        x = register_V[instances, (instructions & 0x0F00) >> 8].astype(np.uint64)
+        y = register_V[instances, (instructions & 0x00F0) >> 4].astype(np.int64)
+        n = instructions & 0x000F
+        register_I = self.register_I[instances]
+        register_V[instances, 0x0F] = 0
+
+        video_memory = self.video_memory
+        for i in range(int(n.max())):
+            address = register_I + i
+            readable = (i < n) & (address < MEMORY_SIZE)
+            system_memory_byte = self.system_memory[instances, np.minimum(address, MEMORY_SIZE - 1)]
+            drawing = readable & (system_memory_byte != 0) & (x < 64) & (y + i < 32)
+            if not drawing.any():
+                continue
+
+            # Shifting right past bit 0 clips the sprite at the right edge
+            drawn = instances[drawing]
+            rows = y[drawing] + i
+            sprite_row = (system_memory_byte[drawing].astype(np.uint64) << np.uint64(56)) >> x[drawing]
+            video_row = video_memory[drawn, rows]
+            register_V[drawn[(video_row & sprite_row) != 0], 0x0F] = 1
+            video_memory[drawn, rows] = video_row ^ sprite_row
+
+        faults = (n > 0) & (register_I + n > MEMORY_SIZE)
+        self.faults[instances[faults]] = True
+        self.video_draw_flag[instances[~faults]] = 1
+
+    # EX9E Skip the following instruction if the key VX is pressed. A key
+    # past F faults
+    def op_ex9e(self, instances, instructions):
+        keys = self.register_V[instances, (instructions & 0x0F00) >> 8]
+        self.faults[instances[keys > 0x0F]] = True
+        valid = keys <= 0x0F
+        instances = instances[valid]
+        skip = self.keys_pressed[instances, keys[valid]] == 1
+        self.register_PC[instances[skip]] += 2
+
+    # EXA1 Skip the following instruction if the key VX is not pressed. A
+    # key past F faults
+    def op_exa1(self, instances, instructions):
+        keys = self.register_V[instances, (instructions & 0x0F00) >> 8]
+        self.faults[instances[keys > 0x0F]] = True
+        valid = keys <= 0x0F
+        instances = instances[valid]
+        skip = self.keys_pressed[instances, keys[valid]] == 0
+        self.register_PC[instances[skip]] += 2
+
+    # FX07 Store the current value of the delay timer in register VX
+    def op_fx07(self, instances, instructions):
+        self.register_V[instances, (instructions & 0x0F00) >> 8] = self.delay_timer[instances]
+
+    # FX0A Wait for a keypress and store the lowest pressed key in VX
+    def op_fx0a(self, instances, instructions):
+        keys_pressed = self.keys_pressed[instances]
+        pressed = keys_pressed.any(axis=1)
+        self.register_V[instances[pressed], (instructions[pressed] & 0x0F00) >> 8] = keys_pressed[pressed].argmax(axis=1)
+        self.register_PC[instances[~pressed]] -= 2
+
+    # FX15 Set the delay timer to the value of register VX
+    def op_fx15(self, instances, instructions):
+        self.delay_timer[instances] = self.register_V[instances, (instructions & 0x0F00) >> 8]
+
+    # FX18 Set the sound timer to the value of register VX
+    def op_fx18(self, instances, instructions):
+        self.sound_timer[instances] = self.register_V[instances, (instructions & 0x0F00) >> 8]
+
+    # FX1E Add the value stored in register VX to register I
+    def op_fx1e(self, instances, instructions):
+        self.register_I[instances] += self.register_V[instances, (instructions & 0x0F00) >> 8]
+
+    # FX29 Set I to the address of the font sprite of the digit in VX
+    def op_fx29(self, instances, instructions):
+        self.register_I[instances] = self.register_V[instances, (instructions & 0x0F00) >> 8].astype(np.int64) * 5
+
+    # FX33 Store the BCD digits of VX at addresses I, I+1, and I+2. Digits
+    # past the end of memory fault after the ones before them were written
+    def op_fx33(self, instances, instructions):
+        value = self.register_V[instances, (instructions & 0x0F00) >> 8]
+        register_I = self.register_I[instances]
+        for i, digit in enumerate((value // 100, (value % 100) // 10, value % 10)):
+            address = register_I + i
+            writable = address < MEMORY_SIZE
+            self.system_memory[instances[writable], address[writable]] = digit[writable]
+        self.faults[instances[register_I + 2 >= MEMORY_SIZE]] = True
+
+    # FX55 Store V0 to VX inclusive in memory starting at address I. I is set
+    # to I + X + 1 after operation. Registers past the end of memory fault
+    # after the ones before them were written, leaving I unchanged
+    def op_fx55(self, instances, instructions):
+        xx = (instructions & 0x0F00) >> 8
+        register_I = self.register_I[instances]
+        for i in range(int(xx.max()) + 1):
+            address = register_I + i
+            writable = (i <= xx) & (address < MEMORY_SIZE)
+            self.system_memory[instances[writable], address[writable]] = self.register_V[instances[writable], i]
+        faults = register_I + xx >= MEMORY_SIZE
+        self.faults[instances[faults]] = True
+        self.register_I[instances[~faults]] += xx[~faults] + 1
+
+    # FX65 Fill V0 to VX inclusive from memory starting at address I. I is
+    # set to I + X + 1 after operation. Reading past the end of memory faults
+    # after the registers before it were filled, leaving I unchanged
+    def op_fx65(self, instances, instructions):
+        xx = (instructions & 0x0F00) >> 8
+        register_I = self.register_I[instances]
+        for i in range(int(xx.max()) + 1):
+            address = register_I + i
+            readable = (i <= xx) & (address < MEMORY_SIZE)
+            self.register_V[instances[readable], i] = self.system_memory[instances[readable], address[readable]]
+        faults = register_I + xx >= MEMORY_SIZE
+        self.faults[instances[faults]] = True
+        self.register_I[instances[~faults]] += xx[~faults] + 1
+
+# Entry point
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run many instances of a CHIP-8 ROM in lockstep")
+    parser.add_argument("file", help="ROM name inside the roms directory")
+    parser.add_argument("--instances", type=int, default=1000)
+    parser.add_argument("--frames", type=int, default=600,
+                        help="60 Hz frames to execute")
+    parser.add_argument("--cycles-per-frame", type=int, default=10,
+                        help="instructions executed per 60 Hz frame")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the first instance")
+    parser.add_argument("--shift-vy", action="store_true",
+                        help="shift VY instead of VX in 8XY6 and 8XYE")
+    args = parser.parse_args()
+
+    machines = VectorCHIP8(args.instances, args.seed, int(args.shift_vy))
+    machines.file_open(args.file)
+    start_time = time.perf_counter()
+    for _ in range(args.frames):
+        machines.run(args.cycles_per_frame)
+        machines.timers_tick()
+    elapsed = time.perf_counter() - start_time
+
+    print("FILE:", args.file)
+    for name, value in machines.stats().items():
+        print(name.upper() + ":", value)
+    print("SECONDS:", format(elapsed, ".3f"))
+    print("IPS:", format(machines.instructions / elapsed, ".0f"))